@@ -0,0 +1,106 @@
+# ASGI version of server.py for when many cars reconnect at once. The POST handlers
+# only touch the in-memory session index and enqueue rows for the storage thread, so
+# none of them block the event loop. Run with `python asgi_server.py` or
+# `uvicorn asgi_server:app --host 0.0.0.0 --port 4337`.
+import asyncio
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from rendezvous import (
+    client_fields,
+    init_db,
+    latest_server_for_public_ip,
+    long_poll_timeout,
+    lookup_server,
+    register_server,
+    server_response,
+    sessions,
+    storage,
+)
+from storage import now_ms
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def observed_ip(request):
+    return request.client.host if request.client else None
+
+async def server_endpoint(request):
+    body, status = register_server(await read_json(request), observed_ip(request))
+    return JSONResponse(body, status_code=status)
+
+async def client_endpoint(request):
+    body, status = lookup_server(await read_json(request), observed_ip(request))
+    return JSONResponse(body, status_code=status)
+
+async def wait_for_server(session_id, timeout):
+    """The session's server once it registers, or None after `timeout` seconds."""
+    loop = asyncio.get_running_loop()
+    registered = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(registered.set)
+
+    server = sessions.add_waiter(session_id, wake)
+    if server is not None:
+        return server
+    try:
+        await asyncio.wait_for(registered.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        sessions.remove_waiter(session_id, wake)
+    return sessions.lookup(session_id)
+
+async def client_wait_endpoint(request):
+    # Waiting costs an event, not a thread, so thousands of cars can be held at once
+    data = await read_json(request)
+    ip = observed_ip(request)
+
+    body, status = lookup_server(data, ip)
+    if status == 500:
+        session_id, client_public_ip = client_fields(data, ip)
+        server = await wait_for_server(session_id, long_poll_timeout(data))
+        body, status = server_response(server, client_public_ip, ip, now_ms())
+    return JSONResponse(body, status_code=status)
+
+async def latest_server_endpoint(request):
+    # Reads SQLite, so keep it off the event loop
+    body, status = await run_in_threadpool(
+        latest_server_for_public_ip, request.query_params.get('public_ip')
+    )
+    return JSONResponse(body, status_code=status)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Opening the database and warming the index do blocking I/O
+    await run_in_threadpool(init_db)
+    try:
+        yield
+    finally:
+        # Write out any client rows still waiting for their batch
+        await run_in_threadpool(storage.stop)
+
+app = Starlette(
+    routes=[
+        Route('/server', server_endpoint, methods=['POST']),
+        Route('/client', client_endpoint, methods=['POST']),
+        Route('/client/wait', client_wait_endpoint, methods=['POST']),
+        Route('/server/latest', latest_server_endpoint, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # Per-request access logging costs more than the handlers themselves
+    uvicorn.run(app, host='0.0.0.0', port=4337, access_log=False, backlog=4096)
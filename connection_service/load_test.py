@@ -0,0 +1,126 @@
+# Load test for the connection service: many simulated headsets and cars hitting
+# /server and /client at once over keep-alive connections, stdlib only.
+#
+#   python asgi_server.py        (or python server.py)
+#   python load_test.py --clients 1000 --requests 20
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import time
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+
+async def post(reader, writer, host, path, payload):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f'POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+    )
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by server')
+    status = int(status_line.split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            content_length = int(value)
+    await reader.readexactly(content_length)
+    return status
+
+
+async def run_client(index, args, start, latencies, errors):
+    session_id = f'load-{index // 2}'
+    # Even clients are headsets registering, odd ones are cars looking them up
+    if index % 2 == 0:
+        path = '/server'
+        payload = {
+            'session_id': session_id,
+            'server_port': 6778,
+            'server_local_ip': '10.0.0.2',
+            'server_public_ip': f'198.51.100.{index % 250}',
+        }
+    else:
+        path = '/client'
+        payload = {
+            'session_id': session_id,
+            'client_local_ip': '10.0.0.3',
+            'client_public_ip': f'203.0.113.{index % 250}',
+        }
+
+    await start.wait()
+    try:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    except OSError:
+        errors[path] = errors.get(path, 0) + args.requests
+        return
+
+    try:
+        for _ in range(args.requests):
+            sent_at = time.perf_counter()
+            try:
+                status = await post(reader, writer, args.host, path, payload)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                errors[path] = errors.get(path, 0) + 1
+                break
+            latencies[path].append(time.perf_counter() - sent_at)
+            # A car asking before its headset registered gets a 500, which is expected
+            if status != 200 and not (path == '/client' and status == 500):
+                errors[path] = errors.get(path, 0) + 1
+    finally:
+        writer.close()
+
+
+async def main(args):
+    latencies = {'/server': [], '/client': []}
+    errors = {}
+    start = asyncio.Event()
+    tasks = [
+        asyncio.create_task(run_client(i, args, start, latencies, errors))
+        for i in range(args.clients)
+    ]
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    total = sum(len(values) for values in latencies.values())
+    print(f'{args.clients} clients, {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s)')
+    for path, values in latencies.items():
+        ms = [value * 1000 for value in values]
+        print(
+            f'{path:>8}: n={len(ms):<6} p50={percentile(ms, 50):.1f}ms '
+            f'p99={percentile(ms, 99):.1f}ms max={max(ms, default=0):.1f}ms '
+            f'mean={statistics.fmean(ms) if ms else 0:.1f}ms errors={errors.get(path, 0)}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the connection service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4337)
+    parser.add_argument('--clients', type=int, default=1000, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=10, help='requests per connection')
+    args = parser.parse_args()
+
+    # Every client needs its own socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.clients + 100
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    asyncio.run(main(args))
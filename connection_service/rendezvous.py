@@ -0,0 +1,147 @@
+from datetime import datetime
+
+from sessions import SessionIndex
+from storage import DEFAULT_SESSION_ID, Storage, now_ms
+
+DB_NAME = 'ips.db'
+
+# How long a car's /client/wait request is held open for its headset to register
+LONG_POLL_TIMEOUT = 25  # Seconds, below common proxy idle timeouts
+MAX_LONG_POLL_TIMEOUT = 60
+
+storage = Storage(DB_NAME)
+# Active headset servers by session; lookups never touch the database
+sessions = SessionIndex()
+
+
+def iso_timestamp(timestamp_ms):
+    # Responses keep the ISO strings clients already parse
+    return datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+
+
+# Initialize DB
+def init_db():
+    storage.open()
+
+    # Warm the index with each session's latest server, oldest first to keep expiry order
+    now = now_ms()
+    rows = sorted(storage.latest_servers(), key=lambda row: row[4])
+    for session_id, server_port, server_local_ip, server_public_ip, timestamp_ms in rows:
+        age = (now - timestamp_ms) / 1000
+        sessions.register(session_id, {
+            'server_port': server_port,
+            'server_local_ip': server_local_ip,
+            'server_public_ip': server_public_ip,
+        }, age=max(age, 0.0))
+
+    storage.start()
+
+
+def register_server(data, observed_ip=None):
+    """
+    Handle a headset registering itself. Returns (response body, status code).
+
+    `observed_ip` is the address the request came from. It stands in for a missing
+    server_public_ip and is echoed back, so headsets need no IP lookup service.
+    """
+    if not data:
+        return {'error': 'No JSON received'}, 400
+
+    session_id = data.get('session_id') or DEFAULT_SESSION_ID
+    server_port = data.get('server_port')
+    server_local_ip = data.get('server_local_ip')
+    server_public_ip = data.get('server_public_ip') or observed_ip
+    timestamp_ms = now_ms()
+
+    if not (server_port and server_local_ip and server_public_ip):
+        return {'error': 'Missing server_port/server_local_ip/server_public_ip'}, 400
+    # Stored as TEXT, so a port sent as a number comes back as a string after a warm
+    # start; keep it a string throughout
+    server_port = str(server_port)
+
+    sessions.register(session_id, {
+        'server_port': server_port,
+        'server_local_ip': server_local_ip,
+        'server_public_ip': server_public_ip,
+    })
+    storage.record_server(session_id, server_port, server_local_ip, server_public_ip, timestamp_ms)
+
+    return {
+        'status': 'Server info stored',
+        'timestamp': iso_timestamp(timestamp_ms),
+        'observed_ip': observed_ip,
+    }, 200
+
+
+def client_fields(data, observed_ip=None):
+    """(session_id, client_public_ip) of a car's request, falling back to the observed IP."""
+    return (
+        data.get('session_id') or DEFAULT_SESSION_ID,
+        data.get('client_public_ip') or observed_ip,
+    )
+
+
+def lookup_server(data, observed_ip=None):
+    """Handle a car asking where its headset is. Returns (response body, status code)."""
+    if not data:
+        return {'error': 'No JSON received'}, 400
+
+    session_id, client_public_ip = client_fields(data, observed_ip)
+    client_local_ip = data.get('client_local_ip')
+    timestamp_ms = now_ms()
+
+    if not (client_local_ip and client_public_ip):
+        return {'error': 'Missing client_local_ip/client_public_ip'}, 400
+
+    # Store client info
+    storage.record_client(session_id, client_local_ip, client_public_ip, timestamp_ms)
+
+    return server_response(sessions.lookup(session_id), client_public_ip, observed_ip, timestamp_ms)
+
+
+def server_response(server, client_public_ip, observed_ip, timestamp_ms):
+    """Tell a car how to reach `server`, its session's headset (None if not registered)."""
+    if server is None:
+        # No server data found
+        return {'error': 'No server data available', 'observed_ip': observed_ip}, 500
+
+    # Compare client public IP to the server's public IP
+    if client_public_ip == server['server_public_ip']:
+        server_ip = server['server_local_ip']
+    else:
+        server_ip = server['server_public_ip']
+
+    return {
+        'server_ip': server_ip,
+        'server_port': server['server_port'],
+        'stored_at': iso_timestamp(timestamp_ms),
+        'observed_ip': observed_ip,
+    }, 200
+
+
+def long_poll_timeout(data):
+    """Seconds a /client/wait request may be held, from its optional 'timeout' field."""
+    try:
+        timeout = float((data or {}).get('timeout', LONG_POLL_TIMEOUT))
+    except (TypeError, ValueError):
+        timeout = LONG_POLL_TIMEOUT
+    return min(max(timeout, 0.0), MAX_LONG_POLL_TIMEOUT)
+
+
+def latest_server_for_public_ip(public_ip):
+    """Newest headset registered from `public_ip`. Returns (response body, status code)."""
+    if not public_ip:
+        return {'error': 'Missing public_ip'}, 400
+
+    row = storage.latest_server_for_public_ip(public_ip)
+    if row is None:
+        return {'error': 'No server data available'}, 404
+
+    session_id, server_port, server_local_ip, server_public_ip, timestamp_ms = row
+    return {
+        'session_id': session_id,
+        'server_port': server_port,
+        'server_local_ip': server_local_ip,
+        'server_public_ip': server_public_ip,
+        'timestamp': iso_timestamp(timestamp_ms),
+    }, 200
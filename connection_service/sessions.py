@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+# A headset registers once when it starts, so its entry has to outlive a long drive
+SESSION_TTL = 12 * 60 * 60  # Seconds
+
+
+class SessionIndex:
+    """
+    In-memory map of session id -> the headset server registered for it.
+
+    Entries expire SESSION_TTL seconds after their last registration. Since every
+    entry has the same TTL, keeping them in registration order means the expired ones
+    are always at the front, so eviction never scans live sessions.
+
+    Long-poll requests leave a callback with add_waiter, which runs the moment the
+    session registers.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (expires_at, server)
+        self._waiters = {}  # session_id -> callbacks for its next registration
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def register(self, session_id, server, age=0.0):
+        """Store `server` (a dict) for the session; `age` is seconds since it registered."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            if age >= self.ttl:
+                return
+            self._sessions[session_id] = (now + self.ttl - age, server)
+            self._sessions.move_to_end(session_id)
+            waiters = self._waiters.pop(session_id, [])
+        for callback in waiters:
+            callback()
+
+    def lookup(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+        return None if entry is None else entry[1]
+
+    def add_waiter(self, session_id, callback):
+        """
+        Call `callback()` when the session next registers. If it already has a server,
+        that is returned instead and the callback is not added.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._waiters.setdefault(session_id, []).append(callback)
+        return None if entry is None else entry[1]
+
+    def remove_waiter(self, session_id, callback):
+        with self._lock:
+            callbacks = self._waiters.get(session_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._waiters.pop(session_id, None)
+
+    def wait(self, session_id, timeout):
+        """Block until the session has a server or `timeout` seconds pass. Returns it or None."""
+        registered = threading.Event()
+        server = self.add_waiter(session_id, registered.set)
+        if server is not None:
+            return server
+        try:
+            registered.wait(timeout)
+        finally:
+            self.remove_waiter(session_id, registered.set)
+        return self.lookup(session_id)
+
+    def _evict_expired(self, now):
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            del self._sessions[session_id]
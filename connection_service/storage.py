@@ -0,0 +1,280 @@
+import queue
+import sqlite3
+import threading
+import time
+
+# Client lookups are only an audit log, so they are written in batches
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 0.5  # Seconds a client row may wait before it is written
+
+DEFAULT_SESSION_ID = 'default'
+
+# Retention, run by the writer thread between writes
+RETENTION_INTERVAL = 60 * 60  # Seconds between retention passes
+CLIENT_RETENTION_MS = 30 * 24 * 60 * 60 * 1000  # Client audit rows kept for 30 days
+SERVER_RETENTION_MS = 90 * 24 * 60 * 60 * 1000  # Old registrations kept for 90 days
+RETENTION_CHUNK = 5000  # Rows deleted per transaction, so writes never stall for long
+
+SCHEMA_VERSION = 1
+
+# Version 1: integer timestamps (unix ms), session ids and lookup indexes
+SCHEMA_V1 = '''
+    CREATE TABLE IF NOT EXISTS server_data(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL DEFAULT 'default',
+        server_port TEXT,
+        server_local_ip TEXT,
+        server_public_ip TEXT,
+        timestamp INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS client_data(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL DEFAULT 'default',
+        client_local_ip TEXT,
+        client_public_ip TEXT,
+        timestamp INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS server_data_public_ip ON server_data(server_public_ip, id);
+    CREATE INDEX IF NOT EXISTS server_data_session ON server_data(session_id, id);
+    CREATE INDEX IF NOT EXISTS server_data_timestamp ON server_data(timestamp);
+    CREATE INDEX IF NOT EXISTS client_data_public_ip ON client_data(client_public_ip, id);
+    CREATE INDEX IF NOT EXISTS client_data_timestamp ON client_data(timestamp);
+'''
+
+DATA_COLUMNS = {
+    'server_data': 'server_port, server_local_ip, server_public_ip',
+    'client_data': 'client_local_ip, client_public_ip',
+}
+
+# ISO strings from datetime.now() (local time) -> unix ms
+_ISO_TO_MS = "CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class Storage:
+    """
+    Owns the service's SQLite connections.
+
+    The database runs in WAL mode and every write goes through one background thread,
+    so request handlers only enqueue a row and never wait on disk. Server
+    registrations are committed right away; client audit rows are grouped into one
+    transaction per batch. The same thread periodically deletes rows past their
+    retention period. Reads use a second connection, which WAL lets run alongside
+    the writer.
+    """
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self._conn: sqlite3.Connection | None = None
+        self._read_conn: sqlite3.Connection | None = None
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The writer connection."""
+        if self._conn is None:
+            raise RuntimeError('Storage is not open')
+        return self._conn
+
+    @property
+    def read_conn(self) -> sqlite3.Connection:
+        """The connection reads go through."""
+        if self._read_conn is None:
+            raise RuntimeError('Storage is not open')
+        return self._read_conn
+
+    def open(self):
+        # auto_vacuum only takes effect on a new database or after VACUUM
+        self._conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.migrate()
+        self._read_conn = sqlite3.connect(self.db_name, check_same_thread=False)
+
+    def migrate(self):
+        """Bring the schema up to SCHEMA_VERSION, tracked in PRAGMA user_version."""
+        conn = self.conn
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        old_tables = [table for table in DATA_COLUMNS if table in tables]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Version 0 tables (ISO string timestamps, maybe no session ids) are set
+            # aside, recreated in the new layout and their rows converted
+            for table in old_tables:
+                conn.execute(f'ALTER TABLE {table} RENAME TO {table}_v0')
+            for statement in SCHEMA_V1.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            for table in old_tables:
+                columns = DATA_COLUMNS[table]
+                old_columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table}_v0)')]
+                session_id = 'session_id' if 'session_id' in old_columns else f"'{DEFAULT_SESSION_ID}'"
+                conn.execute(f'''
+                    INSERT INTO {table}(id, session_id, {columns}, timestamp)
+                    SELECT id, {session_id}, {columns}, COALESCE({_ISO_TO_MS}, 0)
+                    FROM {table}_v0
+                ''')
+                conn.execute(f'DROP TABLE {table}_v0')
+            conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Switch an existing database to incremental vacuum, so retention can give
+            # space back without a full VACUUM every time
+            conn.execute('VACUUM')
+
+    def latest_servers(self):
+        """The newest server row of every session, to warm the in-memory index."""
+        with self._read_lock:
+            return self.read_conn.execute('''
+                SELECT session_id, server_port, server_local_ip, server_public_ip, timestamp
+                FROM server_data
+                WHERE id IN (SELECT MAX(id) FROM server_data GROUP BY session_id)
+            ''').fetchall()
+
+    def latest_server_for_public_ip(self, public_ip):
+        """
+        Newest registration from `public_ip`, or None.
+
+        Served by the (server_public_ip, id) index, so it is a single O(log n) seek
+        however large the table grows.
+        """
+        with self._read_lock:
+            return self.read_conn.execute('''
+                SELECT session_id, server_port, server_local_ip, server_public_ip, timestamp
+                FROM server_data
+                WHERE server_public_ip = ?
+                ORDER BY id DESC
+                LIMIT 1
+            ''', (public_ip,)).fetchone()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        for conn in (self._read_conn, self._conn):
+            if conn is not None:
+                conn.close()
+        self._read_conn = None
+        self._conn = None
+
+    def record_server(self, session_id, server_port, server_local_ip, server_public_ip, timestamp_ms):
+        self._queue.put(('server', (session_id, server_port, server_local_ip, server_public_ip, timestamp_ms)))
+
+    def record_client(self, session_id, client_local_ip, client_public_ip, timestamp_ms):
+        self._queue.put(('client', (session_id, client_local_ip, client_public_ip, timestamp_ms)))
+
+    def apply_retention(self, current_ms=None):
+        """Delete rows past their retention period. Returns how many were deleted."""
+        if current_ms is None:
+            current_ms = now_ms()
+        deleted = self._delete_in_chunks(
+            'client_data', 'timestamp < ?', (current_ms - CLIENT_RETENTION_MS,)
+        )
+        # Each session's latest registration stays, since the index is warmed from it
+        deleted += self._delete_in_chunks(
+            'server_data',
+            'timestamp < ? AND id NOT IN (SELECT MAX(id) FROM server_data GROUP BY session_id)',
+            (current_ms - SERVER_RETENTION_MS,),
+        )
+        if deleted:
+            self.conn.execute('PRAGMA incremental_vacuum')
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return deleted
+
+    def _delete_in_chunks(self, table, condition, params):
+        total = 0
+        while True:
+            cur = self.conn.execute(
+                f'DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {condition} LIMIT {RETENTION_CHUNK})',
+                params,
+            )
+            self.conn.commit()
+            total += cur.rowcount
+            if cur.rowcount < RETENTION_CHUNK:
+                return total
+
+    def _attempt(self, description, write, *args):
+        """
+        Run one write on the writer thread. A failure (database locked, disk full, ...)
+        is rolled back and logged instead of killing the thread, so the queue keeps
+        draining and stop() still returns. Returns the write's result, or None.
+        """
+        try:
+            return write(*args)
+        except Exception as e:
+            print(f'Storage: {description} failed: {e}')
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+            return None
+
+    def _insert_server(self, row):
+        self.conn.execute('''
+            INSERT INTO server_data(session_id, server_port, server_local_ip, server_public_ip, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', row)
+        self.conn.commit()
+
+    def _insert_clients(self, rows):
+        self.conn.executemany('''
+            INSERT INTO client_data(session_id, client_local_ip, client_public_ip, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def _run(self):
+        client_rows = []
+        flush_at: float | None = None
+        retention_at = time.monotonic()
+        running = True
+        while running:
+            wake_at = retention_at if flush_at is None else min(flush_at, retention_at)
+            try:
+                item = self._queue.get(timeout=max(0.0, wake_at - time.monotonic()))
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                running = False
+            elif item and item[0] == 'server':
+                # The session index already has it, so a lost row only costs the warm start
+                self._attempt(f'storing server {item[1][0]}', self._insert_server, item[1])
+            elif item:
+                client_rows.append(item[1])
+                if flush_at is None:
+                    flush_at = time.monotonic() + AUDIT_FLUSH_INTERVAL
+
+            if client_rows and (
+                not running
+                or len(client_rows) >= AUDIT_BATCH_SIZE
+                or (flush_at is not None and time.monotonic() >= flush_at)
+            ):
+                self._attempt(
+                    f'storing {len(client_rows)} client rows', self._insert_clients, client_rows
+                )
+                client_rows = []
+                flush_at = None
+
+            if running and time.monotonic() >= retention_at:
+                deleted = self._attempt('retention', self.apply_retention)
+                if deleted:
+                    print(f"Retention removed {deleted} old rows")
+                retention_at = time.monotonic() + RETENTION_INTERVAL
@@ -0,0 +1,321 @@
+# Benchmarks for the control pipeline, no hardware needed.
+#
+# Microbenchmarks time the per-packet hot paths. The loopback benchmark runs the
+# asyncio receiver in a child process against a VirtualArduino, drives it over UDP
+# at each target rate and reports throughput, the receiver's CPU use and latency.
+# Results are written as JSON; pass an earlier file with --compare to see what moved.
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+from manager.arduino_communication import (ARDUINO_PORT_ENV, LINK_FRAME, TELEMETRY_FRAME,
+                                           FrameCodec, send_command_to_arduino)
+from manager.checksum import calculate_checksum
+from manager.control_redundancy import pack_control_packet
+from manager.udp_control_receiver import LOCAL_PORT, decode_control_header
+from manager.utils import sleep_until
+from manager.virtual_arduino import VirtualArduino
+
+DEFAULT_RATES = (100, 500, 1000, 2000, 5000)
+STEP_DURATION = 5.0  # Seconds per loopback rate
+WARMUP_TIMEOUT = 10.0  # Seconds to wait for the receiver to reach the Arduino
+MICRO_REPEATS = 5
+
+
+class NullSerial:
+    """Stands in for the serial port, so only the packing is timed."""
+
+    def write(self, data):
+        return len(data)
+
+
+def time_per_call(func, number: int) -> float:
+    """Best of MICRO_REPEATS runs, in nanoseconds per call."""
+    return min(timeit.repeat(func, number=number, repeat=MICRO_REPEATS)) / number * 1e9
+
+
+def run_microbenchmarks() -> dict[str, dict[str, float]]:
+    packet = pack_control_packet(1234, int(time.time() * 1000), (10.0, -5.0, 0.5, -0.25), [])
+    payload = packet[14:]
+    null_serial = NullSerial()
+
+    telemetry_frame = bytearray(TELEMETRY_FRAME.size)
+    TELEMETRY_FRAME.pack_into(telemetry_frame, 7, 12.5, 340.0, 87, 64)
+    telemetry_frame = bytes(telemetry_frame)
+    codec = FrameCodec(TELEMETRY_FRAME, LINK_FRAME)
+
+    def parse_telemetry():
+        # What read_from_arduino does for every frame
+        codec.feed(telemetry_frame)
+        codec.decode()
+
+    cases = {
+        "control_header_unpack": (lambda: decode_control_header(packet), 200_000),
+        "calculate_checksum": (lambda: calculate_checksum(payload), 500_000),
+        "command_frame_pack": (
+            lambda: send_command_to_arduino(null_serial, 7, 10.0, -5.0, 0.5, -0.25),
+            200_000,
+        ),
+        "telemetry_parse": (parse_telemetry, 100_000),
+    }
+    results = {}
+    for name, (func, number) in cases.items():
+        ns = time_per_call(func, number)
+        results[name] = {"ns_per_op": ns, "ops_per_s": 1e9 / ns}
+        print(f"{name:>22}: {ns:8.1f} ns/op  ({1e9 / ns:,.0f} ops/s)")
+    return results
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, so split after it
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def latency_summary(values_s: list[float]) -> dict[str, float]:
+    if not values_s:
+        return {"count": 0}
+    ordered = sorted(values_s)
+
+    def at(percent):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] * 1e6
+
+    return {
+        "count": len(ordered),
+        "p50_us": at(50),
+        "p99_us": at(99),
+        "p999_us": at(99.9),
+        "max_us": ordered[-1] * 1e6,
+    }
+
+
+class CommandLog:
+    """Arrival time of each command at the virtual Arduino, keyed by the sender's index."""
+
+    def __init__(self):
+        self.arrivals: dict[int, float] = {}
+        self.lock = threading.Lock()
+
+    def on_command(self, sequence_number, pitch, yaw, throttle, steering):
+        # The sender stores the packet index in the yaw field
+        with self.lock:
+            self.arrivals[int(yaw)] = time.perf_counter()
+
+    def take(self) -> dict[int, float]:
+        with self.lock:
+            arrivals, self.arrivals = self.arrivals, {}
+        return arrivals
+
+
+def start_receiver(arduino_port: str) -> subprocess.Popen:
+    env = dict(os.environ, **{ARDUINO_PORT_ENV: arduino_port})
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--receiver-child"],
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def stop_receiver(receiver: subprocess.Popen) -> dict:
+    """Stop the child and return its final metrics snapshot."""
+    receiver.send_signal(signal.SIGTERM)
+    output, _ = receiver.communicate(timeout=10)
+    for line in reversed(output.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {}
+
+
+def run_loopback_step(rate_hz: float, duration: float) -> dict:
+    command_log = CommandLog()
+    arduino = VirtualArduino(on_command=command_log.on_command)
+    arduino.start()
+    receiver = start_receiver(arduino.port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = ("127.0.0.1", LOCAL_PORT)
+    index = 0
+
+    def send():
+        nonlocal index
+        index += 1
+        packet = pack_control_packet(index, int(time.time() * 1000), (0.0, float(index), 0.0, 0.0), [])
+        sock.sendto(packet, target)
+        return index
+
+    try:
+        # Keep sending until commands come out the other end
+        deadline = time.monotonic() + WARMUP_TIMEOUT
+        while not command_log.arrivals:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Receiver never reached the virtual Arduino")
+            send()
+            time.sleep(0.01)
+        time.sleep(0.1)
+        command_log.take()
+        # Only count what happens from here on
+        receiver.send_signal(signal.SIGUSR1)
+        time.sleep(0.05)
+
+        sent_at: dict[int, float] = {}
+        interval = 1.0 / rate_hz
+        cpu_start = process_cpu_seconds(receiver.pid)
+        start = time.perf_counter()
+        next_send = start
+        end = start + duration
+        while next_send < end:
+            sleep_until(next_send)
+            sent_at[send()] = time.perf_counter()
+            # Deadline based, so a late send doesn't push back the ones after it
+            next_send += interval
+        elapsed = time.perf_counter() - start
+        cpu_seconds = process_cpu_seconds(receiver.pid) - cpu_start
+        time.sleep(0.1)  # Let the last commands arrive
+    finally:
+        snapshot = stop_receiver(receiver)
+        sock.close()
+        arduino.stop()
+
+    arrivals = command_log.take()
+    latencies = [arrivals[i] - sent_at[i] for i in arrivals if i in sent_at]
+    stages = snapshot.get("stages", {})
+    # Valid packets; the parse stage is timed once per received batch, not per packet
+    processed = snapshot.get("counters", {}).get("control_packets", 0)
+    return {
+        "rate_hz": rate_hz,
+        "duration_s": elapsed,
+        "sent": len(sent_at),
+        "sent_per_s": len(sent_at) / elapsed,
+        "processed_per_s": processed / elapsed,
+        "commands_delivered": len(latencies),
+        "cpu_percent": cpu_seconds / elapsed * 100,
+        "recv_to_serial": {
+            key: stages.get("recv_to_serial", {}).get(key, 0)
+            for key in ("count", "p50_us", "p99_us", "p999_us", "max_us")
+        },
+        "send_to_arduino": latency_summary(latencies),
+        "counters": snapshot.get("counters", {}),
+    }
+
+
+def print_step(step: dict):
+    recv = step["recv_to_serial"]
+    e2e = step["send_to_arduino"]
+    print(
+        f"{step['rate_hz']:>6g} Hz: sent {step['sent_per_s']:7.0f}/s  processed "
+        f"{step['processed_per_s']:7.0f}/s  cpu {step['cpu_percent']:5.1f}%  "
+        f"recv->serial p50/p99/p999 {recv['p50_us'] / 1000:.2f}/{recv['p99_us'] / 1000:.2f}/"
+        f"{recv['p999_us'] / 1000:.2f}ms  send->arduino p99 "
+        f"{e2e.get('p99_us', 0) / 1000:.2f}ms ({e2e['count']} commands)"
+    )
+
+
+def compare(current: dict, previous: dict):
+    """Print how each number changed against an earlier results file."""
+    print(f"\nCompared with {previous.get('commit', 'unknown')}:")
+    for name, result in current["micro"].items():
+        before = previous.get("micro", {}).get(name)
+        if before:
+            change = (result["ns_per_op"] / before["ns_per_op"] - 1) * 100
+            print(f"{name:>22}: {before['ns_per_op']:8.1f} -> {result['ns_per_op']:8.1f} ns/op ({change:+.1f}%)")
+    previous_steps = {step["rate_hz"]: step for step in previous.get("loopback", [])}
+    for step in current["loopback"]:
+        before = previous_steps.get(step["rate_hz"])
+        if before:
+            print(
+                f"{step['rate_hz']:>6g} Hz: recv->serial p99 {before['recv_to_serial']['p99_us'] / 1000:.2f} -> "
+                f"{step['recv_to_serial']['p99_us'] / 1000:.2f}ms, cpu {before['cpu_percent']:.1f} -> "
+                f"{step['cpu_percent']:.1f}%"
+            )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_receiver_child():
+    """
+    Entry point of the child process: the asyncio receiver, until SIGTERM. SIGUSR1
+    resets the metrics once warm-up is over.
+    """
+    from manager.async_control_receiver import run_async_udp_control_receiver
+    from manager.metrics import metrics
+
+    async def main():
+        task = asyncio.current_task()
+        assert task is not None  # asyncio.run() runs main() as a task
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        loop.add_signal_handler(signal.SIGUSR1, metrics.reset)
+        try:
+            await run_async_udp_control_receiver(
+                headset_location={"server_ip": "127.0.0.1", "server_port": "0"}
+            )
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    print(json.dumps(metrics.snapshot()), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the control pipeline")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--rates", default=",".join(str(rate) for rate in DEFAULT_RATES),
+                        help="comma separated loopback send rates in Hz")
+    parser.add_argument("--duration", type=float, default=STEP_DURATION, help="seconds per rate")
+    parser.add_argument("--micro-only", action="store_true", help="skip the loopback benchmark")
+    parser.add_argument("--receiver-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.receiver_child:
+        run_receiver_child()
+        sys.exit(0)
+
+    results = {
+        "commit": git_commit(),
+        "taken_at": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+    print("Microbenchmarks:")
+    results["micro"] = run_microbenchmarks()
+
+    results["loopback"] = []
+    if not args.micro_only:
+        print("\nLoopback (receiver -> virtual Arduino):")
+        for rate in args.rates.split(","):
+            step = run_loopback_step(float(rate), args.duration)
+            print_step(step)
+            results["loopback"].append(step)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -2,27 +2,28 @@ import struct
 import requests
 import collections
 import socket
-import subprocess
 import time
 import threading
 import serial
 
+from manager.arduino_communication import (ARDUINO_BAUD_RATE, TELEMETRY_FRAME, FrameCodec,
+                                           get_arduino_port, negotiate_baud_rate)
 
-# Run the bash command as a single subprocess
-arduino_port = subprocess.run(
-    ["bash", "-c", "arduino-cli board list | grep 'Nano Every' | awk '{print $1}'"],
-    capture_output=True,
-    text=True,
-).stdout.strip()
+# Matched by USB VID/PID, falling back to arduino-cli
+arduino_port = get_arduino_port()
 
 print(f"Arduino Port: {arduino_port}")
-baud_rate = 115200
 
 READ_FROM_ARDUINO_THREAD_ENABLED = False
 
 # Open the serial connection to the Arduino
-ser = serial.Serial(arduino_port, baud_rate)
+ser = serial.Serial(arduino_port, ARDUINO_BAUD_RATE)
 time.sleep(1)  # Give some time for the connection to establish
+baud_rate, rtt_ms = negotiate_baud_rate(ser)
+if rtt_ms is None:
+    print(f"Link check failed, staying at {baud_rate} baud")
+else:
+    print(f"Arduino link at {baud_rate} baud, frame round trip {rtt_ms:.2f}ms")
 
 
 def recv_all(sock, length):
@@ -40,18 +41,16 @@ def get_controller_server_info():
     CONNECTION_SERVICE_PORT = 4337
 
     client_local_ip = socket.gethostbyname(socket.gethostname())
-    client_public_ip = requests.get("https://api.ipify.org").text
 
     print(f"Client Local IP: {client_local_ip}")
-    print(f"Client Public IP: {client_public_ip}")
 
-    # Send a request to the connection service
+    # Held open until the headset registers; the service fills in our public IP
     response = requests.post(
-        f"http://{CONNECTION_SERVICE_IP}:{CONNECTION_SERVICE_PORT}/client",
+        f"http://{CONNECTION_SERVICE_IP}:{CONNECTION_SERVICE_PORT}/client/wait",
         json={
             "client_local_ip": client_local_ip,
-            "client_public_ip": client_public_ip,
         },
+        timeout=30,
     )
     if response.status_code == 200:
         """
@@ -238,31 +237,29 @@ def send_command_to_arduino(sequence_number, pitch, yaw, throttle, steering):
 
 # Create a thread that listens for data from the Arduino
 def read_from_arduino(active_socket):
+    codec = FrameCodec(TELEMETRY_FRAME)
     while READ_FROM_ARDUINO_THREAD_ENABLED:
-        data = ser.readline().decode("utf-8").strip()
-        if data:
-            print(f"Received from Arduino: {data}")
-            if data.startswith("tel:"):
-                (
-                    _,
+        # Block for at least one byte, then take everything that is buffered
+        codec.feed(ser.read(ser.in_waiting or 1))
+        for _, _, fields in codec.decode():
+            (
+                speed_mph,
+                distance_ft,
+                control_battery_percentage,
+                drive_battery_percentage,
+            ) = fields
+            print(f"Received telemetry from Arduino: {fields}")
+            active_socket.sendall(
+                struct.pack(
+                    # "<Qffii" means little-endian unsigned long long (8 bytes), float (4 bytes), float (4 bytes), int (4 bytes), int (4 bytes)
+                    "<Qffii",
+                    0,
                     speed_mph,
                     distance_ft,
                     control_battery_percentage,
                     drive_battery_percentage,
-                ) = data.split(" ")
-                speed_mph = float(speed_mph)
-                distance_ft = float(distance_ft)
-                active_socket.sendall(
-                    struct.pack(
-                        # "<Qffii" means little-endian unsigned long long (8 bytes), float (4 bytes), float (4 bytes), int (4 bytes), int (4 bytes)
-                        "<Qffii",
-                        0,
-                        speed_mph,
-                        distance_ft,
-                        control_battery_percentage,
-                        drive_battery_percentage,
-                    )
                 )
+            )
 
 
 try:
@@ -0,0 +1,422 @@
+# Headless load generator: simulated headsets streaming control packets to pi
+# receivers, without a keyboard.
+#
+# Each headset replays a pose/throttle trace (synthetic, or recorded as CSV with
+# columns time_s,pitch,yaw,throttle,steering) at its target rate. One scheduler
+# thread sends every packet at its deadline, so rates don't drift. Loss, reordering,
+# duplication and clock offset can be injected per packet.
+#
+# A receiver follows exactly one headset, so give every headset its own --target
+# (one receiver per car). Headsets beyond the number of targets share one
+# round-robin, which only tests how a receiver copes with a second, interleaved
+# stream: its packets are mostly rejected as out of order. With --register every
+# headset also goes through the connection service rendezvous the way a car and
+# headset do; connection_service/load_test.py is the sustained throughput test.
+#
+#   python load_generator.py --rate 200 --loss 0.02 --reorder 0.01
+#   python load_generator.py --target car1:12345 --target car2:12345 --headsets 2
+#   python load_generator.py --trace drive.csv --clock-offset 250 --duration 60
+import argparse
+import bisect
+import csv
+import heapq
+import json
+import math
+import os
+import random
+import select
+import socket
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from manager.clock_sync import is_sync_request, make_sync_reply, wall_clock_us
+from manager.compact_packets import encode_compact_control, is_compact_telemetry
+from manager.constants import CONTROL_STREAM_PORT
+from manager.control_redundancy import MAX_REDUNDANT_FRAMES, pack_control_packet
+from manager.link_quality import is_rate_message
+from manager.udp_control_receiver import LOCAL_PORT
+from manager.utils import sleep_until
+
+# A scheduler that falls further behind than this skips ahead instead of bursting
+MAX_CATCH_UP = 0.1  # Seconds
+REPORT_INTERVAL = 5.0  # Seconds between progress lines
+TELEMETRY_PACKET_SIZE = 16
+RENDEZVOUS_TIMEOUT = 10.0  # Seconds a car waits for its headset to register
+CAR_HEAD_START = 0.2  # Seconds the cars' long polls get to reach the service
+
+
+def synthetic_trace(phase: float):
+    """Smooth head motion and a throttle/steering pattern, offset by `phase` radians."""
+
+    def sample(t: float) -> tuple[float, float, float, float]:
+        return (
+            20.0 * math.sin(2 * math.pi * 0.2 * t + phase),  # pitch, degrees
+            60.0 * math.sin(2 * math.pi * 0.1 * t + phase),  # yaw, degrees
+            0.5 + 0.5 * math.sin(2 * math.pi * 0.05 * t + phase),  # throttle
+            math.sin(2 * math.pi * 0.3 * t + phase),  # steering
+        )
+
+    return sample
+
+
+def recorded_trace(path: str):
+    """Replay a CSV trace, looping at its end."""
+    times = []
+    rows = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            times.append(float(row["time_s"]))
+            rows.append(
+                (float(row["pitch"]), float(row["yaw"]), float(row["throttle"]), float(row["steering"]))
+            )
+    if not rows:
+        raise ValueError(f"Trace {path} has no rows")
+    length = times[-1] - times[0] or 1.0
+
+    def sample(t: float) -> tuple[float, float, float, float]:
+        index = bisect.bisect_right(times, times[0] + t % length) - 1
+        return rows[max(index, 0)]
+
+    return sample
+
+
+class SimulatedHeadset:
+    """
+    One headset's control stream.
+
+    Packets are built the way the headset builds them (optionally compact or with
+    redundant copies), then lost, held back behind the next packet, or sent twice
+    according to the impairment rates. Clock sync requests from the pi are answered
+    in the headset's own (offset) clock.
+    """
+
+    def __init__(self, index: int, args, sample, target: tuple[str, int], bind_port: int):
+        self.index = index
+        self.target = target
+        self.interval = 1.0 / args.rate
+        self.sample = sample
+        self.compact = args.compact
+        self.loss = args.loss
+        self.reorder = args.reorder
+        self.duplicate = args.duplicate
+        self.random = random.Random(None if args.seed is None else args.seed + index)
+        self.clock_offset_ms = args.clock_offset + self.random.uniform(
+            -args.clock_offset_spread, args.clock_offset_spread
+        )
+        self.history = deque(maxlen=args.redundancy)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("0.0.0.0", bind_port))
+        self.sock.setblocking(False)
+
+        self.seq = 0
+        self.held: bytes | None = None
+        self.sent = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicated = 0
+        self.sync_replies = 0
+        self.telemetry = 0
+        self.rate_messages = 0
+
+    def _transmit(self, packet: bytes):
+        try:
+            _ = self.sock.sendto(packet, self.target)
+        except BlockingIOError:
+            # The socket buffer is full, which is loss all the same
+            self.lost += 1
+            return
+        self.sent += 1
+
+    def send_next(self, t: float):
+        self.seq += 1
+        values = self.sample(t)
+        timestamp_ms = int(time.time() * 1000 + self.clock_offset_ms)
+        if self.compact:
+            packet = encode_compact_control(self.seq, timestamp_ms, *values)
+        else:
+            packet = pack_control_packet(self.seq, timestamp_ms, values, list(self.history))
+        self.history.appendleft((timestamp_ms, values))
+
+        if self.random.random() < self.loss:
+            self.lost += 1
+        elif self.held is None and self.random.random() < self.reorder:
+            # Goes out right after the next packet
+            self.held = packet
+            self.reordered += 1
+            return
+        else:
+            self._transmit(packet)
+            if self.random.random() < self.duplicate:
+                self._transmit(packet)
+                self.duplicated += 1
+
+        self.flush()
+
+    def flush(self):
+        """Send the packet held back for reordering, if any."""
+        if self.held is not None:
+            self._transmit(self.held)
+            self.held = None
+
+    def poll(self):
+        """Answer clock sync requests and count what the pi sends back."""
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except BlockingIOError:
+                return
+            if is_sync_request(data):
+                reply = make_sync_reply(data, wall_clock_us(), int(self.clock_offset_ms * 1000))
+                _ = self.sock.sendto(reply, addr)
+                self.sync_replies += 1
+            elif is_rate_message(data):
+                self.rate_messages += 1
+            elif is_compact_telemetry(data) or len(data) == TELEMETRY_PACKET_SIZE:
+                self.telemetry += 1
+
+    def stats(self) -> dict:
+        return {
+            "headset": self.index,
+            "target": f"{self.target[0]}:{self.target[1]}",
+            "packets": self.seq,
+            "sent": self.sent,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "duplicated": self.duplicated,
+            "clock_offset_ms": self.clock_offset_ms,
+            "sync_replies": self.sync_replies,
+            "telemetry": self.telemetry,
+            "rate_messages": self.rate_messages,
+        }
+
+
+def parse_target(target: str) -> tuple[str, int]:
+    host, _, port = target.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def rendezvous(url: str, headsets: list[SimulatedHeadset], session_prefix: str) -> dict:
+    """
+    Put every headset through the connection service rendezvous, one session each.
+
+    A car-side /client/wait is opened for every session first, then the headsets
+    register, the way a car that starts before its headset does. Returns how many
+    cars were told the right port and how long after its registration each was
+    answered.
+    """
+    import requests
+
+    local_ip = socket.gethostbyname(socket.gethostname())
+    registered_at: dict[int, float] = {}
+
+    def wait_as_car(headset: SimulatedHeadset) -> float | None:
+        response = requests.post(
+            f"{url}/client/wait",
+            json={
+                "session_id": f"{session_prefix}-{headset.index}",
+                "client_local_ip": local_ip,
+                "timeout": RENDEZVOUS_TIMEOUT,
+            },
+            timeout=RENDEZVOUS_TIMEOUT + 5,
+        )
+        answered_at = time.perf_counter()
+        if response.status_code != 200:
+            print(f"Car {headset.index} got no headset: {response.status_code}")
+            return None
+        if int(response.json()["server_port"]) != headset.sock.getsockname()[1]:
+            print(f"Car {headset.index} was sent to the wrong port")
+            return None
+        return answered_at - registered_at[headset.index]
+
+    with ThreadPoolExecutor(max_workers=len(headsets)) as pool:
+        cars = [pool.submit(wait_as_car, headset) for headset in headsets]
+        time.sleep(CAR_HEAD_START)
+        for headset in headsets:
+            registered_at[headset.index] = time.perf_counter()
+            response = requests.post(
+                f"{url}/server",
+                json={
+                    "session_id": f"{session_prefix}-{headset.index}",
+                    "server_port": headset.sock.getsockname()[1],
+                    "server_local_ip": local_ip,
+                },
+                timeout=5,
+            )
+            if response.status_code != 200:
+                print(f"Failed to register headset {headset.index}: {response.status_code}")
+        latencies = sorted(
+            latency for latency in (car.result() for car in cars) if latency is not None
+        )
+
+    return {
+        "sessions": len(headsets),
+        "answered": len(latencies),
+        "registration_to_car_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+            "mean": (statistics.fmean(latencies) if latencies else 0.0) * 1000,
+        },
+    }
+
+
+def percentile(ordered: list[float], percent: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def run(headsets: list[SimulatedHeadset], duration: float) -> dict:
+    """Send every headset's packets at their deadlines until `duration` (0 = forever)."""
+    sockets = {headset.sock: headset for headset in headsets}
+    start = time.perf_counter()
+    end = start + duration if duration > 0 else math.inf
+    # Headsets start spread across one interval, like independent devices would
+    schedule = [
+        (start + headset.interval * i / len(headsets), i) for i, headset in enumerate(headsets)
+    ]
+    heapq.heapify(schedule)
+    lateness: list[float] = []
+    skipped = 0
+    next_report = start + REPORT_INTERVAL
+
+    try:
+        while True:
+            deadline, i = schedule[0]
+            if deadline >= end:
+                break
+
+            # Handle replies while waiting, leaving the last stretch to sleep_until()
+            while True:
+                wait = deadline - time.perf_counter() - 0.001
+                if wait <= 0:
+                    break
+                readable, _, _ = select.select(list(sockets), [], [], wait)
+                for sock in readable:
+                    sockets[sock].poll()
+            sleep_until(deadline)
+
+            now = time.perf_counter()
+            headset = headsets[i]
+            headset.send_next(now - start)
+            lateness.append(now - deadline)
+
+            next_deadline = deadline + headset.interval
+            if now - next_deadline > MAX_CATCH_UP:
+                missed = int((now - next_deadline) / headset.interval)
+                skipped += missed
+                next_deadline += missed * headset.interval
+            heapq.heapreplace(schedule, (next_deadline, i))
+
+            if now >= next_report:
+                next_report += REPORT_INTERVAL
+                sent = sum(headset.sent for headset in headsets)
+                print(f"{now - start:6.1f}s: {sent} packets sent ({sent / (now - start):.0f}/s)")
+    except KeyboardInterrupt:
+        pass
+
+    for headset in headsets:
+        headset.flush()
+    elapsed = time.perf_counter() - start
+    lateness.sort()
+    sent = sum(headset.sent for headset in headsets)
+    return {
+        "elapsed_s": elapsed,
+        "sent": sent,
+        "sent_per_s": sent / elapsed,
+        "skipped_deadlines": skipped,
+        "lateness_us": {
+            "p50": percentile(lateness, 50) * 1e6,
+            "p99": percentile(lateness, 99) * 1e6,
+            "max": (lateness[-1] if lateness else 0.0) * 1e6,
+        },
+        "headsets": [headset.stats() for headset in headsets],
+    }
+
+
+def print_summary(summary: dict):
+    late = summary["lateness_us"]
+    print(
+        f"\n{summary['sent']} packets in {summary['elapsed_s']:.1f}s ({summary['sent_per_s']:.0f}/s), "
+        f"send lateness p50 {late['p50']:.0f}us p99 {late['p99']:.0f}us max {late['max']:.0f}us, "
+        f"{summary['skipped_deadlines']} deadlines skipped"
+    )
+    for stats in summary["headsets"]:
+        print(
+            f"  headset {stats['headset']} -> {stats['target']}: sent={stats['sent']} lost={stats['lost']} "
+            f"reordered={stats['reordered']} duplicated={stats['duplicated']} "
+            f"offset={stats['clock_offset_ms']:.0f}ms sync_replies={stats['sync_replies']} "
+            f"telemetry={stats['telemetry']}"
+        )
+    if "rendezvous" in summary:
+        latency = summary["rendezvous"]["registration_to_car_ms"]
+        print(
+            f"Rendezvous: {summary['rendezvous']['answered']}/{summary['rendezvous']['sessions']} "
+            f"cars found their headset, registration -> car p50 {latency['p50']:.1f}ms "
+            f"p99 {latency['p99']:.1f}ms max {latency['max']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless load generator for pi receivers")
+    parser.add_argument("--target", action="append", metavar="HOST:PORT",
+                        help="pi receiver of one headset; repeat for each "
+                             f"(default 127.0.0.1:{LOCAL_PORT})")
+    parser.add_argument("--headsets", type=int, default=1, help="simulated headsets")
+    parser.add_argument("--rate", type=float, default=100.0, help="packets per second per headset")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds to run (0 = until Ctrl-C)")
+    parser.add_argument("--trace", help="CSV trace (time_s,pitch,yaw,throttle,steering) to replay")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability a packet is dropped")
+    parser.add_argument("--reorder", type=float, default=0.0,
+                        help="probability a packet is sent after the next one")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="probability a packet is sent twice")
+    parser.add_argument("--clock-offset", type=float, default=0.0,
+                        help="ms added to every headset's timestamps")
+    parser.add_argument("--clock-offset-spread", type=float, default=0.0,
+                        help="each headset's offset varies by up to this many ms")
+    parser.add_argument("--redundancy", type=int, default=0, choices=range(MAX_REDUNDANT_FRAMES + 1),
+                        help="previous frames repeated in every packet")
+    parser.add_argument("--compact", action="store_true", help="use the compact packet format")
+    parser.add_argument("--first-port", type=int, default=CONTROL_STREAM_PORT,
+                        help="local port of the first headset, where a pi sends keepalives, "
+                             "sync requests and telemetry (0 = any); the others use any free port")
+    parser.add_argument("--register", metavar="URL",
+                        help="first rendezvous every headset with a car through this connection service")
+    parser.add_argument("--session-prefix", default=f"load-{os.getpid()}",
+                        help="session id prefix for --register")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the impairments")
+    parser.add_argument("--output", help="write the summary as JSON here")
+    args = parser.parse_args()
+
+    targets = [parse_target(target) for target in args.target or [f"127.0.0.1:{LOCAL_PORT}"]]
+    if args.headsets > len(targets):
+        print(
+            f"Warning: {args.headsets} headsets for {len(targets)} receivers; a receiver follows "
+            "one headset, so the extra streams are mostly rejected as out of order"
+        )
+
+    headsets = []
+    for i in range(args.headsets):
+        sample = recorded_trace(args.trace) if args.trace else synthetic_trace(2 * math.pi * i / args.headsets)
+        bind_port = args.first_port if i == 0 else 0
+        headsets.append(SimulatedHeadset(i, args, sample, targets[i % len(targets)], bind_port))
+
+    rendezvous_summary = None
+    if args.register:
+        rendezvous_summary = rendezvous(args.register, headsets, args.session_prefix)
+
+    print(
+        f"Sending {args.headsets} x {args.rate:g} Hz to {len(targets)} receiver(s) "
+        f"(loss {args.loss}, reorder {args.reorder}, duplicate {args.duplicate})"
+    )
+    summary = run(headsets, args.duration)
+    if rendezvous_summary is not None:
+        summary["rendezvous"] = rendezvous_summary
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
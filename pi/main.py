@@ -1,27 +1,21 @@
-# First, get the headset location from the aws server and cache it (happens in clock sync)
-# Then, create a TCP socket connection to the headset server to sync clocks
+# First, get the headset location from the aws server and cache it, while the
+# Arduino's serial port is found and opened and the UDP socket is bound
+# A TCP socket connection to the headset server syncs clocks alongside the control loop
 # After clock sync finishes, the clock sync server will be closed, causing the TCP socket to close
 # The clock offset is stored on the headset
 
-# Then, we can create a UDP socket to send and receive real-time data
+# Meanwhile, we create a UDP socket to send and receive real-time data
 # The UDP socket starts listening
 # The UDP socket punches a keepalive packet through the firewall and NAT every 10 seconds
 # Then, the headset will know the client's IP address and port (NAT mapped)
 # The UDP socket will then receive a stream of control messages from the headset
 # These headset messages are validated and then sent to the arduino
 # The UDP socket is also used to stream telemetry data to the headset
+# All of this runs on a single asyncio event loop, so work only happens when a
+# packet or serial byte actually arrives
 
-from manager.clock_sync import start_clock_sync_client
-from manager.udp_control_receiver import start_udp_control_receiver
+from manager.startup import start
 
-clock_sync_cycles = start_clock_sync_client()
-print(f"Clock sync cycles: {clock_sync_cycles}")
-
-if clock_sync_cycles == 0:
-    print("Clock sync failed")
-    exit(1)
-
-print("Clock sync finished")
-
-# Now we can start the UDP socket to send and receive real-time data
-start_udp_control_receiver(mac_test_environment=True)
+# Startup runs its stages concurrently (rendezvous, serial port, socket bind) and
+# prints a timeline once the first command arrives from the headset
+start(mac_test_environment=True)
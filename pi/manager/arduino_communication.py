@@ -1,105 +1,664 @@
+import os
 import struct
 import subprocess
+import threading
 import time
 
 import serial
+from serial.tools import list_ports
 
-from .utils import cache_if_not_none
+from .checksum import xor_checksum
+from .compact_packets import encode_compact_telemetry
+from .metrics import (COUNTER_COMMANDS_COALESCED, STAGE_ARDUINO_ACK, STAGE_LINK_RTT,
+                      STAGE_RECV_TO_SERIAL, STAGE_SERIAL_WRITE, STAGE_TELEMETRY_SEND,
+                      metrics)
+from .ring_log import log
+from .utils import TokenBucket, persistent_cache
 
+# Rate the firmware boots at; negotiate_baud_rate() steps up from here
 ARDUINO_BAUD_RATE = 115200
 
+# Rates tried during negotiation, fastest first. The firmware accepts the same list.
+CANDIDATE_BAUD_RATES = (1000000, 500000, 250000, 230400)
+
+# USB ids of the Arduino Nano Every
+ARDUINO_USB_VID = 0x2341
+ARDUINO_USB_PID = 0x0058
+
+# Set to a device path (e.g. a VirtualArduino's pty) to skip discovery
+ARDUINO_PORT_ENV = "ARDUINO_PORT"
+
+# Discovery is cheap now, but a restart can still skip it entirely
+ARDUINO_PORT_TTL = 60 * 60  # Seconds
+ARDUINO_PORT_MAX_STALE = 30 * 24 * 60 * 60  # Seconds
+
+# Longest the board may take to answer after the port is opened. Firmware without
+# link support never answers, so it always costs this long.
+ARDUINO_SETTLE_TIME = 1.0  # Seconds
+
+# How often ArduinoPortWatcher checks whether the board is plugged in
+HOTPLUG_POLL_INTERVAL = 0.2  # Seconds
+
+
+def find_arduino_port() -> str | None:
+    """Device path of the Nano Every, matched by USB VID/PID, or None if it isn't plugged in."""
+    override = os.environ.get(ARDUINO_PORT_ENV)
+    if override:
+        return override if os.path.exists(override) else None
+
+    # Reads sysfs directly, so it takes milliseconds
+    for port in list_ports.comports():
+        if port.vid == ARDUINO_USB_VID and port.pid == ARDUINO_USB_PID:
+            return port.device
+    return None
+
+
+def find_arduino_port_with_cli() -> str | None:
+    """Slow fallback for boards the USB ids don't match: ask arduino-cli."""
+    arduino_port = subprocess.run(
+        [
+            "bash",
+            "-c",
+            "arduino-cli board list | grep 'Nano Every' | awk '{print $1}'",
+        ],
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    return arduino_port or None
+
+
+def get_arduino_port() -> str:
+    """$ARDUINO_PORT if it is set, otherwise the discovered (and cached) port."""
+    return os.environ.get(ARDUINO_PORT_ENV) or discover_arduino_port()
+
+
+@persistent_cache("arduino_port", ttl=ARDUINO_PORT_TTL, max_stale=ARDUINO_PORT_MAX_STALE)
+def discover_arduino_port() -> str:
+    arduino_port = find_arduino_port()
+    if arduino_port:
+        return arduino_port
 
-@cache_if_not_none
-def get_arduino_port():
-    # Run the bash command as a single subprocess
     retries = 3
     for _ in range(retries):
-        arduino_port = subprocess.run(
-            [
-                "bash",
-                "-c",
-                "arduino-cli board list | grep 'Nano Every' | awk '{print $1}'",
-            ],
-            capture_output=True,
-            text=True,
-        ).stdout.strip()
+        arduino_port = find_arduino_port_with_cli()
         if arduino_port:
             return arduino_port
     raise RuntimeError(f"Failed to get Arduino port after {retries} retries.")
 
 
-def get_arduino_serial_interface():
-    arduino_port = get_arduino_port()
+class ArduinoPortWatcher:
+    """
+    Polls for the Arduino from a background thread and calls `on_change(port)` when
+    it is plugged in or re-enumerated, and `on_change(None)` when it goes away.
+    After retry(), a port that is present is reported again on the next poll.
+    """
+
+    def __init__(self, on_change, interval: float = HOTPLUG_POLL_INTERVAL):
+        self.on_change = on_change
+        self.interval = interval
+        self.port = find_arduino_port()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def retry(self):
+        """Report the port again on the next poll, e.g. because opening it failed."""
+        self.port = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            port = find_arduino_port()
+            if port == self.port:
+                continue
+            self.port = port
+            discover_arduino_port.invalidate()
+            try:
+                self.on_change(port)
+            except Exception as e:
+                log.error("Arduino hotplug handler failed: %s", e)
+
+
+def get_arduino_serial_interface(negotiate_baud: bool = True, arduino_port: str | None = None):
+    if arduino_port is None:
+        arduino_port = get_arduino_port()
     print(
         f"Connecting to Arduino on port {arduino_port} at baud rate {ARDUINO_BAUD_RATE}..."
     )
-    ser = serial.Serial(arduino_port, ARDUINO_BAUD_RATE)
-    time.sleep(1)  # Give some time for the connection to establish
+    try:
+        ser = serial.Serial(arduino_port, ARDUINO_BAUD_RATE)
+    except serial.SerialException:
+        # The cached port may be stale; look it up again next time
+        discover_arduino_port.invalidate()
+        raise
+    # Rather than always sleeping through the settle time, ping until the firmware answers
+    ser.timeout = LINK_REPLY_TIMEOUT
+    ready = ArduinoLink(ser).wait_until_ready(ARDUINO_SETTLE_TIME)
+    ser.timeout = None
     print("Connected to Arduino")
+
+    if not ready:
+        print(f"Link check failed, staying at {ARDUINO_BAUD_RATE} baud")
+    elif negotiate_baud:
+        baud_rate, rtt_ms = negotiate_baud_rate(ser)
+        if rtt_ms is None:
+            print(f"Link check failed, staying at {baud_rate} baud")
+        else:
+            print(f"Arduino link at {baud_rate} baud, frame round trip {rtt_ms:.2f}ms")
     return ser
 
 
+class FrameSpec:
+    """
+    Layout of one framed message on the Arduino serial link.
+
+    Every frame is a 4-byte little-endian header, a 1-byte sequence number, the
+    fields described by `fields_format`, then an XOR checksum of everything before it.
+    """
+
+    __slots__ = ("name", "header", "header_bytes", "header_checksum", "layout", "size")
+
+    def __init__(self, name: str, header: int, fields_format: str):
+        self.name = name
+        self.header = header
+        self.header_bytes = struct.pack("<I", header)
+        # The header never changes, so its share of the checksum is computed once
+        self.header_checksum = xor_checksum(self.header_bytes)
+        self.layout = struct.Struct("<IB" + fields_format)
+        self.size = self.layout.size + 1
+
+    def pack_into(self, frame: bytearray, sequence_number: int, *values):
+        """Build a frame in place in a bytearray of at least `size` bytes."""
+        self.layout.pack_into(frame, 0, self.header, sequence_number, *values)
+        frame[self.layout.size] = self.header_checksum ^ xor_checksum(
+            memoryview(frame)[len(self.header_bytes) : self.layout.size]
+        )
+
+    def builder(self):
+        """
+        Return build(sequence_number, values), which packs a frame into one reused
+        bytearray and returns it. For hot paths: everything is looked up once here,
+        so a frame costs one struct call and the checksum loop.
+        """
+        frame = bytearray(self.size)
+        checksum_index = self.layout.size
+        body = memoryview(frame)[len(self.header_bytes) : checksum_index]
+        pack_into = self.layout.pack_into
+        header = self.header
+        header_checksum = self.header_checksum
+
+        def build(sequence_number: int, values: tuple) -> bytearray:
+            pack_into(frame, 0, header, sequence_number, *values)
+            checksum = header_checksum
+            for byte in body:
+                checksum ^= byte
+            frame[checksum_index] = checksum
+            return frame
+
+        return build
+
+
+class FrameCodec:
+    """
+    Incremental encoder/decoder for the framed Arduino serial protocol.
+
+    Bytes can be fed in chunks of any size. decode() resyncs on the next known
+    header with bytes.find, so boot messages, debug prints and line noise are
+    skipped, and keeps counts of bad checksums and sequence gaps per link.
+    """
+
+    def __init__(self, *specs: FrameSpec):
+        self.specs = specs
+        self.buffer = bytearray()
+        self.frame_count = 0
+        self.bad_checksum_count = 0
+        self.sequence_gap_count = 0
+        self.skipped_byte_count = 0
+        self._last_sequence_numbers: dict[int, int] = {}
+
+    def feed(self, data: bytes):
+        self.buffer += data
+
+    def _find_header(self, offset: int) -> tuple[int, FrameSpec | None]:
+        best_start = -1
+        best_spec = None
+        for spec in self.specs:
+            start = self.buffer.find(spec.header_bytes, offset)
+            if start >= 0 and (best_start < 0 or start < best_start):
+                best_start = start
+                best_spec = spec
+        return best_start, best_spec
+
+    def decode(self) -> list[tuple[FrameSpec, int, tuple]]:
+        """Return (spec, sequence_number, fields) for every complete frame buffered so far."""
+        buffer = self.buffer
+        frames = []
+
+        offset = 0
+        while True:
+            start, spec = self._find_header(offset)
+            if spec is None:
+                # Keep a possible partial header at the end
+                keep_from = max(offset, len(buffer) - 3)
+                self.skipped_byte_count += keep_from - offset
+                offset = keep_from
+                break
+            self.skipped_byte_count += start - offset
+            if len(buffer) - start < spec.size:
+                offset = start
+                break
+
+            checksum_index = start + spec.layout.size
+            if xor_checksum(memoryview(buffer)[start:checksum_index]) != buffer[checksum_index]:
+                self.bad_checksum_count += 1
+                self.skipped_byte_count += 1
+                offset = start + 1
+                continue
+
+            values = spec.layout.unpack_from(buffer, start)
+            sequence_number = values[1]
+            last_sequence_number = self._last_sequence_numbers.get(spec.header)
+            if last_sequence_number is not None:
+                self.sequence_gap_count += (sequence_number - last_sequence_number - 1) % 256
+            self._last_sequence_numbers[spec.header] = sequence_number
+
+            self.frame_count += 1
+            frames.append((spec, sequence_number, values[2:]))
+            offset = start + spec.size
+
+        del buffer[:offset]
+        return frames
+
+
+# Command packet is structured as follows:
+# 0xDEADBEEF as a header
+# 1 byte sequence number
+# 4 bytes for pitch
+# 4 bytes for yaw
+# 4 bytes for throttle
+# 4 bytes for steering
+# 1 byte checksum
+COMMAND_FRAME = FrameSpec("command", 0xDEADBEEF, "ffff")
+
+# Telemetry frame sent by the Arduino, mirroring the command frame:
+# 0xFEEDFACE as a header
+# 1 byte sequence number
+# 4 bytes for speed (mph)
+# 4 bytes for distance (ft)
+# 1 byte for control (LiPo) battery percentage
+# 1 byte for drive (NiMH) battery percentage
+# 1 byte checksum
+TELEMETRY_FRAME = FrameSpec("telemetry", 0xFEEDFACE, "ffBB")
+
+# Link management frame, used in both directions:
+# 0xCAFEBABE as a header
+# 1 byte sequence number
+# 1 byte operation (LINK_*)
+# 4 bytes for the operation's value (ping nonce or baud rate)
+# 1 byte checksum
+LINK_FRAME = FrameSpec("link", 0xCAFEBABE, "BI")
+
+LINK_PING = 1  # Pi -> Arduino, answered with LINK_PONG carrying the same value
+LINK_PONG = 2
+LINK_SET_BAUD = 3  # Pi -> Arduino, answered with LINK_BAUD_ACK, then both switch
+LINK_BAUD_ACK = 4
+LINK_COMMIT_BAUD = 5  # Pi -> Arduino at the new rate, answered with LINK_BAUD_ACK
+
+# The firmware falls back to ARDUINO_BAUD_RATE if a new rate isn't committed in time
+BAUD_COMMIT_TIMEOUT = 1.0
+
+LINK_REPLY_TIMEOUT = 0.1
+LINK_PING_COUNT = 20
+
+
+class ArduinoLink:
+    """Request/response helper for LINK_FRAME exchanges on an open serial port."""
+
+    def __init__(self, serial_interface):
+        self.serial_interface = serial_interface
+        self.codec = FrameCodec(LINK_FRAME, TELEMETRY_FRAME)
+        self.sequence_number = 0
+        self._frame = bytearray(LINK_FRAME.size)
+
+    def send(self, operation: int, value: int):
+        LINK_FRAME.pack_into(self._frame, self.sequence_number, operation, value)
+        _ = self.serial_interface.write(self._frame)
+        self.sequence_number = (self.sequence_number + 1) % 256
+
+    def wait_for(self, operation: int, value: int, timeout: float = LINK_REPLY_TIMEOUT) -> bool:
+        """Read until a link frame with this operation and value arrives."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.codec.feed(self.serial_interface.read(self.serial_interface.in_waiting or 1))
+            for spec, _, fields in self.codec.decode():
+                if spec is LINK_FRAME and fields == (operation, value):
+                    return True
+        return False
+
+    def request(self, operation: int, value: int, reply_operation: int) -> float | None:
+        """Send a link frame and return the round trip time in ms, or None on timeout."""
+        start = time.perf_counter()
+        self.send(operation, value)
+        if not self.wait_for(reply_operation, value):
+            return None
+        return (time.perf_counter() - start) * 1000
+
+    def wait_until_ready(self, timeout: float) -> bool:
+        """Ping until the firmware answers, for at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        nonce = 0
+        while time.monotonic() < deadline:
+            if self.request(LINK_PING, nonce, LINK_PONG) is not None:
+                return True
+            nonce += 1
+        return False
+
+    def measure_rtt(self, count: int = LINK_PING_COUNT) -> list[float]:
+        """Ping the Arduino up to `count` times, stopping at the first lost reply."""
+        rtts_ms = []
+        for nonce in range(count):
+            rtt_ms = self.request(LINK_PING, nonce, LINK_PONG)
+            if rtt_ms is None:
+                break
+            rtts_ms.append(rtt_ms)
+        return rtts_ms
+
+
+def negotiate_baud_rate(
+    serial_interface, candidates: tuple[int, ...] = CANDIDATE_BAUD_RATES
+) -> tuple[int, float | None]:
+    """
+    Step the link up to the fastest rate both ends sustain.
+
+    Each candidate is proposed at the current rate, then checked with a burst of
+    pings at the new rate. It is only committed if every ping came back; otherwise
+    both ends fall back to the starting rate and the next candidate is tried.
+    Returns (baud rate, median frame round trip in ms or None if the link is dead).
+    """
+    base_baud_rate = serial_interface.baudrate
+    original_timeout = serial_interface.timeout
+    serial_interface.timeout = LINK_REPLY_TIMEOUT
+    link = ArduinoLink(serial_interface)
+
+    try:
+        if link.request(LINK_PING, 0, LINK_PONG) is None:
+            # Firmware without link support; keep the default rate
+            return base_baud_rate, None
+        base_rtts_ms = link.measure_rtt()
+
+        for baud_rate in candidates:
+            if baud_rate <= base_baud_rate:
+                continue
+
+            if link.request(LINK_SET_BAUD, baud_rate, LINK_BAUD_ACK) is None:
+                continue
+            serial_interface.flush()
+            serial_interface.baudrate = baud_rate
+            serial_interface.reset_input_buffer()
+            switch_time = time.monotonic()
+
+            rtts_ms = link.measure_rtt()
+            if (
+                len(rtts_ms) == LINK_PING_COUNT
+                and link.request(LINK_COMMIT_BAUD, baud_rate, LINK_BAUD_ACK) is not None
+            ):
+                return baud_rate, sorted(rtts_ms)[len(rtts_ms) // 2]
+
+            print(f"Arduino link unstable at {baud_rate} baud, falling back")
+            serial_interface.baudrate = base_baud_rate
+            # Wait for the firmware to give up on the new rate too
+            time.sleep(max(0.0, switch_time + BAUD_COMMIT_TIMEOUT - time.monotonic()) + 0.1)
+            serial_interface.reset_input_buffer()
+
+        return base_baud_rate, sorted(base_rtts_ms)[len(base_rtts_ms) // 2]
+    finally:
+        serial_interface.timeout = original_timeout
+
+
+# How often the headset sends commands at most. The Arduino reads one byte per
+# loop() iteration, so anything much faster than this just piles up in the TTY buffer.
+COMMAND_RATE_HZ = 100
+# The writer is paced a little above the rate commands arrive at: commands arriving
+# on schedule pass straight through, while a backlog released after a stall is
+# spread out instead of reaching the servos back to back
+COMMAND_RATE_HEADROOM = 1.5
+# Commands the writer may send back to back, so one early arrival isn't held back
+COMMAND_BURST = 2
+# How often the writer checks whether the previous frame has left the output buffer
+OUTPUT_DRAIN_POLL_INTERVAL = 0.0002  # Seconds
+
+
+# Shared by every send_command_to_arduino() call, which must not run concurrently
+_build_command_frame = COMMAND_FRAME.builder()
+
+
 def send_command_to_arduino(
     serial_interface, sequence_number, pitch, yaw, throttle, steering
 ):
-    # Packet is structured as follows:
-    # 0xDEADBEEF as a header
-    # 1 byte sequence number
-    # 4 bytes for pitch
-    # 4 bytes for yaw
-    # 4 bytes for throttle
-    # 4 bytes for steering
-    # 1 byte checksum
-    ready_to_send_bytes = struct.pack(
-        "<IBffff",
-        0xDEADBEEF,
-        sequence_number,
-        pitch,
-        yaw,
-        throttle,
-        steering,
-    )
+    frame = _build_command_frame(sequence_number, (pitch, yaw, throttle, steering))
 
-    print(f"processing - Seq: {int(sequence_number):03d}, Data: {throttle}, {steering}")
+    # Send the packet
+    _ = serial_interface.write(frame)
 
-    checksum = 0
-    for byte in ready_to_send_bytes:
-        checksum ^= byte
 
-    ready_to_send_bytes += struct.pack("<B", checksum)
+# How often the writer pings the Arduino to measure command acknowledgement latency.
+# The firmware doesn't answer commands, so while driving the ping goes out right
+# behind a command and its pong marks the point the command has been worked through.
+LINK_PING_INTERVAL = 1.0
 
-    # Send the packet
-    _ = serial_interface.write(ready_to_send_bytes)
+
+class SerialCommandWriter:
+    """
+    Writes commands to the Arduino from a dedicated thread.
+
+    submit() only records the command, so the network receiver never blocks on the
+    UART. Commands are coalesced latest-wins and a token bucket paces writes at
+    COMMAND_RATE_HEADROOM times the rate commands arrive at; a command is held back
+    while the previous frame is still sitting in the kernel's output buffer, so stale
+    commands never queue up behind it. Every
+    `ping_interval` seconds the writer pings the Arduino, right behind a command while
+    driving (arduino_ack) or on its own while idle (link_rtt); the telemetry reader
+    hands the replies back through on_link_frame(). If the port goes away, commands
+    are dropped until attach() hands the writer a reopened one.
+    """
+
+    def __init__(
+        self,
+        serial_interface,
+        rate_hz: float = COMMAND_RATE_HZ,
+        ping_interval: float = LINK_PING_INTERVAL,
+    ):
+        self.serial_interface = serial_interface
+        self.max_rate_hz = rate_hz * COMMAND_RATE_HEADROOM
+        self.command_bucket = TokenBucket(self.max_rate_hz, COMMAND_BURST)
+        self.ping_interval = ping_interval
+        self.sequence_number = 0
+        self.written_count = 0
+        self.coalesced_count = 0
+
+        self._build_frame = COMMAND_FRAME.builder()
+        self._pending: tuple[float, float, float, float] | None = None
+        self._pending_since = 0.0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: threading.Thread | None = None
+
+        self._link_frame = bytearray(LINK_FRAME.size)
+        self._link_sequence_number = 0
+        self._ping_nonce = 0
+        self._ping_sent_at = 0.0
+        self._ping_stage = STAGE_LINK_RTT
+        self._next_ping_time = 0.0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, pitch, yaw, throttle, steering):
+        with self._condition:
+            if self._pending is not None:
+                self.coalesced_count += 1
+                metrics.increment(COUNTER_COMMANDS_COALESCED)
+            self._pending = (pitch, yaw, throttle, steering)
+            self._pending_since = time.perf_counter()
+            self._condition.notify()
+
+    def attach(self, serial_interface):
+        """Start writing to a (re)opened serial port."""
+        with self._condition:
+            self.serial_interface = serial_interface
+            self._condition.notify()
+
+    def detach(self):
+        """Stop writing, e.g. because the Arduino was unplugged."""
+        with self._condition:
+            self.serial_interface = None
+            self._pending = None
+
+    def on_link_frame(self, operation: int, value: int):
+        """Called by the reader for every link frame the Arduino sends."""
+        if operation == LINK_PONG and value == self._ping_nonce and self._ping_sent_at:
+            metrics.record(self._ping_stage, time.perf_counter() - self._ping_sent_at)
+            self._ping_sent_at = 0.0
+
+    def _send_ping(self, serial_interface, command_written_at: float | None = None):
+        """Ping the Arduino, timing from `command_written_at` when it follows a command."""
+        self._ping_nonce = (self._ping_nonce + 1) & 0xFFFFFFFF
+        LINK_FRAME.pack_into(
+            self._link_frame, self._link_sequence_number, LINK_PING, self._ping_nonce
+        )
+        if command_written_at is None:
+            self._ping_stage = STAGE_LINK_RTT
+            self._ping_sent_at = time.perf_counter()
+        else:
+            self._ping_stage = STAGE_ARDUINO_ACK
+            self._ping_sent_at = command_written_at
+        _ = serial_interface.write(self._link_frame)
+        self._link_sequence_number = (self._link_sequence_number + 1) % 256
+        self._next_ping_time = time.monotonic() + self.ping_interval
+
+    def set_rate(self, rate_hz: float):
+        """Pace writes for commands arriving at `rate_hz`, e.g. the rate the headset was told to send at."""
+        self.command_bucket.set_rate(min(rate_hz * COMMAND_RATE_HEADROOM, self.max_rate_hz))
+
+    def _run(self):
+        self._next_ping_time = time.monotonic() + self.ping_interval
+        while True:
+            with self._condition:
+                while self._running and (self._pending is None or self.serial_interface is None):
+                    if self.serial_interface is None:
+                        self._condition.wait()
+                        continue
+                    ping_delay = self._next_ping_time - time.monotonic()
+                    if ping_delay <= 0:
+                        break
+                    self._condition.wait(ping_delay)
+                if not self._running:
+                    return
+                has_command = self._pending is not None
+                serial_interface = self.serial_interface
+
+            try:
+                self._write_next(serial_interface, has_command)
+            except (serial.SerialException, OSError) as e:
+                log.warning("Serial write failed, waiting for the Arduino: %s", e)
+                with self._condition:
+                    if self.serial_interface is serial_interface:
+                        self.serial_interface = None
+
+    def _write_next(self, serial_interface, has_command: bool):
+        if not has_command:
+            self._send_ping(serial_interface)
+            return
+
+        # Hold the command until a token is available; newer submits replace it
+        delay = self.command_bucket.time_until_available()
+        if delay > 0:
+            time.sleep(delay)
+        # A frame at 1 Mbaud takes ~0.2 ms to drain, so poll instead of sleeping a whole interval
+        while self._running and serial_interface.out_waiting > 0:
+            time.sleep(OUTPUT_DRAIN_POLL_INTERVAL)
+
+        with self._condition:
+            command = self._pending
+            pending_since = self._pending_since
+            self._pending = None
+        if command is None:
+            return
+
+        frame = self._build_frame(self.sequence_number, command)
+        _ = self.command_bucket.try_take()
+        write_start = time.perf_counter()
+        _ = serial_interface.write(frame)
+        write_end = time.perf_counter()
+        self.sequence_number = (self.sequence_number + 1) % 256
+        self.written_count += 1
+        metrics.record(STAGE_SERIAL_WRITE, write_end - write_start)
+        metrics.record(STAGE_RECV_TO_SERIAL, write_end - pending_since)
+        if time.monotonic() >= self._next_ping_time:
+            self._send_ping(serial_interface, write_start)
+
+
+# Telemetry packet sent on to the headset
+# "<ffii" means little-endian 2 floats (4 bytes each), 2 ints (4 bytes each)
+HEADSET_TELEMETRY_PACKET = struct.Struct("<ffii")
+
+
+def pack_headset_telemetry(
+    speed_mph: float, distance_ft: float, control_battery: int, drive_battery: int
+) -> bytes:
+    return HEADSET_TELEMETRY_PACKET.pack(
+        speed_mph, distance_ft, control_battery, drive_battery
+    )
+
+
+def handle_arduino_frames(
+    codec: FrameCodec,
+    active_socket,
+    addr,
+    command_writer: SerialCommandWriter | None = None,
+    compact_telemetry: bool = False,
+):
+    """
+    Forward decoded telemetry to the headset and link replies to the command writer.
+
+    Telemetry is sent in the compact format once the headset has shown it speaks it.
+    """
+    pack_telemetry = encode_compact_telemetry if compact_telemetry else pack_headset_telemetry
+    for spec, _, fields in codec.decode():
+        if spec is TELEMETRY_FRAME:
+            send_start = time.perf_counter()
+            try:
+                _ = active_socket.sendto(pack_telemetry(*fields), addr)
+            except Exception as e:
+                log.error("Error sending data to socket: %s", e)
+                continue
+            metrics.record(STAGE_TELEMETRY_SEND, time.perf_counter() - send_start)
+        elif spec is LINK_FRAME and command_writer is not None:
+            command_writer.on_link_frame(*fields)
 
 
 # Create a thread that listens for data from the Arduino
-def read_from_arduino(flags, active_socket, serial_port, addr):
+def read_from_arduino(flags, active_socket, serial_port, addr, command_writer=None):
+    codec = FrameCodec(TELEMETRY_FRAME, LINK_FRAME)
     while flags['thread_enabled']:
-        data = serial_port.readline().decode("utf-8").strip()
-        if data:
-            # print(f"Received from Arduino: {data}")
-            if data.startswith("tel:"):
-                (
-                    _,
-                    speed_mph,
-                    distance_ft,
-                    control_battery_percentage,
-                    drive_battery_percentage,
-                ) = data.split(" ")
-                speed_mph = float(speed_mph)
-                distance_ft = float(distance_ft)
-
-                try:
-                    _ = active_socket.sendto(
-                        struct.pack(
-                            # "<ffii" means little-endian 2 floats (4 bytes each), 2 ints (4 bytes each)
-                            "<ffii",
-                            speed_mph,
-                            distance_ft,
-                            int(control_battery_percentage),
-                            int(drive_battery_percentage),
-                        ),
-                        addr,
-                    )
-                except Exception as e:
-                    print(f"Error sending data to socket: {e}")
+        # Block for at least one byte, then take everything that is buffered
+        codec.feed(serial_port.read(serial_port.in_waiting or 1))
+        handle_arduino_frames(
+            codec, active_socket, addr, command_writer, flags.get("compact_telemetry", False)
+        )
@@ -0,0 +1,391 @@
+import asyncio
+import socket
+
+import serial
+
+from .arduino_communication import (LINK_FRAME, TELEMETRY_FRAME, ArduinoPortWatcher,
+                                    FrameCodec, SerialCommandWriter,
+                                    get_arduino_serial_interface, handle_arduino_frames)
+from .clock_sync import ClockSync
+from .control_frame_ring import (FIELD_PITCH, FIELD_STEERING, FIELD_THROTTLE, FIELD_YAW,
+                                 ControlFrameRing)
+from .datagram_batch import DatagramBatch
+from .headset_location import get_headset_location
+from .link_quality import LinkQualityMonitor
+from .metrics import MetricsReporter
+from .pose_prediction import PosePredictor
+from .ring_log import log
+from .udp_control_receiver import (KEEPALIVE_INTERVAL, KEEPALIVE_MESSAGE, LOCAL_IP, LOCAL_PORT,
+                                   expand_compact_packets, get_remote_address,
+                                   ingest_control_batch)
+
+
+class ControlSocketReader:
+    """
+    Receives control packets from the headset and forwards the newest one to the Arduino.
+
+    The event loop calls on_readable() only when datagrams have actually arrived, so a
+    packet is handled as soon as it lands instead of on the next select() poll. Each
+    wakeup drains the socket into a DatagramBatch (one recvmmsg() per burst) and runs
+    it through the same batch validation as the select() loop, so the burst the
+    headset flushes after a stall costs a single vectorized pass.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        command_writer: SerialCommandWriter | None = None,
+        control_frames: ControlFrameRing | None = None,
+        clock_sync: ClockSync | None = None,
+        pose_predictor: PosePredictor | None = None,
+    ):
+        self.sock = sock
+        self.command_writer = command_writer
+        self.forwarded_count = 0
+        # Burst datagrams are received into this preallocated ring
+        self.batch = DatagramBatch()
+        # History of accepted frames; the newest one is what we forward
+        self.control_frames = control_frames if control_frames is not None else ControlFrameRing()
+        # Headset clock estimate, refreshed by replies arriving on this socket
+        self.clock_sync = clock_sync if clock_sync is not None else ClockSync()
+        # Optional: lead the turret by the network latency
+        self.pose_predictor = pose_predictor
+        # Recommends a send rate to the headset from the measured loss, jitter and lag
+        self.link_quality = LinkQualityMonitor()
+        # Answer in the compact telemetry format once the headset sends compact packets
+        self.compact_telemetry = False
+        # Called once, when the first command is handed to the serial writer
+        self.on_first_command = None
+
+    def start(self):
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self.on_readable)
+
+    def stop(self):
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+
+    def on_readable(self):
+        # Drain the socket buffer to find the latest packet
+        time_lag_ms = None
+        while True:
+            try:
+                count = self.batch.receive(self.sock)
+            except OSError as e:
+                log.error("UDP control socket error: %s", e)
+                break
+            if count == 0:
+                break
+
+            if expand_compact_packets(self.batch, count, self.clock_sync.headset_time_ms()):
+                self.compact_telemetry = True
+
+            batch_lag_ms = ingest_control_batch(
+                self.batch, count, self.control_frames, self.clock_sync, self.link_quality
+            )
+            if batch_lag_ms is not None:
+                time_lag_ms = batch_lag_ms
+
+        if time_lag_ms is not None:
+            self.forward(time_lag_ms)
+
+    def forward(self, time_lag_ms: float):
+        """Hand the newest frame in the ring to the serial writer."""
+        control_frames = self.control_frames
+        pitch = control_frames.get(FIELD_PITCH)
+        yaw = control_frames.get(FIELD_YAW)
+        throttle = control_frames.get(FIELD_THROTTLE)
+        steering = control_frames.get(FIELD_STEERING)
+
+        if self.pose_predictor is not None and self.clock_sync.synced:
+            # The lag is only a true one-way latency once the clocks are synced
+            pitch, yaw = self.pose_predictor.predict(control_frames, time_lag_ms)
+
+        if self.forwarded_count % 100 == 0:
+            log.info(
+                "processing - Seq: %05d, lag: %.2fms p: %.2f, y: %.2f, t: %.2f, s: %.2f",
+                control_frames.latest_seq,
+                time_lag_ms,
+                pitch,
+                yaw,
+                throttle,
+                steering,
+            )
+
+        if self.command_writer is not None:
+            # Hand the command to the serial writer thread
+            self.command_writer.submit(pitch, yaw, throttle, steering)
+        if self.on_first_command is not None:
+            self.on_first_command()
+            self.on_first_command = None
+        self.forwarded_count += 1
+
+    def sendto(self, message: bytes, addr: tuple[str, int]):
+        try:
+            _ = self.sock.sendto(message, addr)
+        except OSError as e:
+            # Full socket buffer or no route yet; the next send tries again
+            log.error("Error sending to %s:%d: %s", addr[0], addr[1], e)
+
+    def send_to_headset(self, message: bytes, addr: tuple[str, int]):
+        self.sendto(message, addr)
+
+    def send_keepalive(self, addr: tuple[str, int]):
+        """Send a keepalive packet to maintain the NAT mapping."""
+        self.sendto(KEEPALIVE_MESSAGE, addr)
+        log.debug("Sent keepalive to %s:%d", addr[0], addr[1])
+
+
+# Until the first command arrives the headset may still be in its TCP clock sync,
+# with no UDP socket bound to take the keepalive, so the NAT punch is repeated
+# this often instead of waiting out KEEPALIVE_INTERVAL
+FIRST_CONTACT_KEEPALIVE_INTERVAL = 0.2  # Seconds
+
+
+async def send_keepalives(receiver: ControlSocketReader, addr: tuple[str, int]):
+    while True:
+        receiver.send_keepalive(addr)
+        if receiver.forwarded_count == 0:
+            await asyncio.sleep(FIRST_CONTACT_KEEPALIVE_INTERVAL)
+        else:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+
+async def run_clock_sync(receiver: ControlSocketReader, addr: tuple[str, int]):
+    clock_sync = receiver.clock_sync
+    while True:
+        request = clock_sync.poll()
+        if request is not None:
+            receiver.send_to_headset(request, addr)
+        await asyncio.sleep(clock_sync.seconds_until_poll())
+
+
+async def send_rate_recommendations(receiver: ControlSocketReader, addr: tuple[str, int]):
+    link_quality = receiver.link_quality
+    while True:
+        rate_message = link_quality.poll()
+        if rate_message is not None:
+            receiver.send_to_headset(rate_message, addr)
+            if receiver.command_writer is not None:
+                receiver.command_writer.set_rate(link_quality.rate_hz)
+        await asyncio.sleep(link_quality.seconds_until_poll())
+
+
+class SerialTelemetryReader:
+    """
+    Decodes frames from the Arduino whenever the serial fd becomes readable,
+    forwarding telemetry to the headset over the control socket.
+    """
+
+    def __init__(
+        self,
+        serial_port,
+        receiver: ControlSocketReader,
+        addr: tuple[str, int],
+        command_writer: SerialCommandWriter | None = None,
+    ):
+        self.serial_port = None
+        self.receiver = receiver
+        self.addr = addr
+        self.command_writer = command_writer
+        self.codec = FrameCodec(TELEMETRY_FRAME, LINK_FRAME)
+        if serial_port is not None:
+            self.attach(serial_port)
+
+    def attach(self, serial_port):
+        """Start reading from a (re)opened serial port."""
+        self.detach()
+        self.serial_port = serial_port
+        self.codec = FrameCodec(TELEMETRY_FRAME, LINK_FRAME)
+        asyncio.get_running_loop().add_reader(serial_port.fileno(), self.on_readable)
+
+    def detach(self):
+        """Stop reading and close the port."""
+        if self.serial_port is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.serial_port.fileno())
+        self.serial_port.close()
+        self.serial_port = None
+
+    def on_readable(self):
+        serial_port = self.serial_port
+        if serial_port is None:
+            return
+        try:
+            self.codec.feed(serial_port.read(serial_port.in_waiting or 1))
+        except (serial.SerialException, OSError) as e:
+            # Unplugged; follow_arduino_hotplug() reattaches once it is back
+            log.warning("Serial read failed, waiting for the Arduino: %s", e)
+            self.detach()
+            return
+        handle_arduino_frames(
+            self.codec,
+            self.receiver.sock,
+            self.addr,
+            self.command_writer,
+            self.receiver.compact_telemetry,
+        )
+
+
+async def follow_arduino_hotplug(
+    telemetry_reader: SerialTelemetryReader,
+    command_writer: SerialCommandWriter,
+    attached: bool = True,
+):
+    """
+    Reopen the Arduino as soon as ArduinoPortWatcher sees it come back. While no port
+    is attached (`attached` is False, or reopening failed), opening it is retried on
+    every poll.
+    """
+    loop = asyncio.get_running_loop()
+    changes: asyncio.Queue[str | None] = asyncio.Queue()
+    watcher = ArduinoPortWatcher(lambda port: loop.call_soon_threadsafe(changes.put_nowait, port))
+    if not attached:
+        watcher.retry()
+    watcher.start()
+    try:
+        while True:
+            port = await changes.get()
+            command_writer.detach()
+            telemetry_reader.detach()
+            if port is None:
+                print("Arduino disconnected")
+                continue
+
+            print(f"Arduino appeared on {port}, reconnecting")
+            try:
+                serial_port = await loop.run_in_executor(
+                    None, get_arduino_serial_interface, True, port
+                )
+            except (RuntimeError, serial.SerialException, OSError) as e:
+                log.error("Failed to reopen the Arduino on %s: %s", port, e)
+                watcher.retry()
+                continue
+            if not changes.empty():
+                # Re-enumerated again while we were opening it
+                serial_port.close()
+                continue
+            telemetry_reader.attach(serial_port)
+            command_writer.attach(serial_port)
+    finally:
+        await loop.run_in_executor(None, watcher.stop)
+
+
+async def connect_arduino(
+    serial_ready: asyncio.Future,
+    telemetry_reader: SerialTelemetryReader,
+    command_writer: SerialCommandWriter,
+):
+    """Attach the serial port once it has been opened, then keep it attached across hotplugs."""
+    try:
+        serial_port = await serial_ready
+    except (RuntimeError, serial.SerialException, OSError) as e:
+        # Not plugged in yet, or not ready; the hotplug watcher keeps trying
+        log.error("Failed to open the Arduino: %s", e)
+        attached = False
+    else:
+        telemetry_reader.attach(serial_port)
+        command_writer.attach(serial_port)
+        attached = True
+    await follow_arduino_hotplug(telemetry_reader, command_writer, attached)
+
+
+def bind_control_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((LOCAL_IP, LOCAL_PORT))
+    sock.setblocking(False)
+    return sock
+
+
+async def run_async_udp_control_receiver(
+    mac_test_environment: bool = False,
+    control_frames: ControlFrameRing | None = None,
+    predict_pose: bool = False,
+    headset_location: dict[str, str] | None = None,
+    sock: socket.socket | None = None,
+    serial_ready: asyncio.Future | None = None,
+    on_first_command=None,
+    clock_sync: ClockSync | None = None,
+):
+    """
+    Run the control loop until cancelled.
+
+    The startup orchestrator passes in what it already has: the headset location, the
+    bound socket, a future for the serial port and the ClockSync its TCP clock sync
+    stage feeds. Commands flow as soon as the socket is up; the Arduino is attached
+    whenever `serial_ready` resolves.
+    """
+    loop = asyncio.get_running_loop()
+
+    if headset_location is None:
+        headset_location = get_headset_location()
+    if headset_location is None:
+        print("Failed to get headset server info in async_control_receiver.py")
+        return
+
+    remote_addr = get_remote_address(headset_location, mac_test_environment)
+
+    command_writer = None
+    if not mac_test_environment:
+        if serial_ready is None:
+            serial_ready = loop.run_in_executor(None, get_arduino_serial_interface)
+        command_writer = SerialCommandWriter(None)
+        command_writer.start()
+
+    metrics_reporter = MetricsReporter()
+    metrics_reporter.start()
+
+    if sock is None:
+        sock = bind_control_socket()
+
+    receiver = ControlSocketReader(
+        sock,
+        command_writer,
+        control_frames,
+        clock_sync,
+        pose_predictor=PosePredictor() if predict_pose else None,
+    )
+    receiver.start()
+    receiver.on_first_command = on_first_command
+
+    # Keepalives establish the NAT mapping, quickly repeated until the first command
+    keepalive_task = asyncio.create_task(send_keepalives(receiver, remote_addr))
+    clock_sync_task = asyncio.create_task(run_clock_sync(receiver, remote_addr))
+    link_quality_task = asyncio.create_task(send_rate_recommendations(receiver, remote_addr))
+
+    telemetry_reader = None
+    arduino_task = None
+    if command_writer is not None and serial_ready is not None:
+        telemetry_reader = SerialTelemetryReader(None, receiver, remote_addr, command_writer)
+        arduino_task = asyncio.create_task(
+            connect_arduino(serial_ready, telemetry_reader, command_writer)
+        )
+
+    print(f"Listening for UDP packets on {LOCAL_IP}:{LOCAL_PORT}...")
+    try:
+        await asyncio.Future()  # Run until cancelled
+    finally:
+        keepalive_task.cancel()
+        clock_sync_task.cancel()
+        link_quality_task.cancel()
+        if arduino_task is not None:
+            arduino_task.cancel()
+        metrics_reporter.stop()
+        if command_writer is not None:
+            command_writer.stop()
+        if telemetry_reader is not None:
+            telemetry_reader.detach()
+        receiver.stop()
+
+
+def start_async_udp_control_receiver(
+    mac_test_environment: bool = False,
+    control_frames: ControlFrameRing | None = None,
+    predict_pose: bool = False,
+):
+    asyncio.run(
+        run_async_udp_control_receiver(mac_test_environment, control_frames, predict_pose)
+    )
+
+
+if __name__ == "__main__":
+    start_async_udp_control_receiver()
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def calculate_checksum(data: bytes | bytearray | memoryview) -> int:
+    """Calculate a 16-bit checksum by summing the bytes of the payload."""
+    # sum() walks the buffer in C; for control payloads it beats both an
+    # int.from_bytes() lane fold and per-byte lookup tables
+    return sum(data) & 0xFFFF  # Mask to 16 bits
+
+
+def xor_checksum(data: bytes | bytearray | memoryview) -> int:
+    """XOR all bytes together (the Arduino frame checksum)."""
+    # A plain loop is the fastest option at frame sizes; int.from_bytes() folds
+    # and functools.reduce() both measured slower
+    checksum = 0
+    for byte in data:
+        checksum ^= byte
+    return checksum
+
+
+def _control_header_dtype(slot_size: int) -> np.dtype:
+    return np.dtype(
+        {
+            "names": ["seq", "checksum", "timestamp_ms"],
+            "formats": [">u4", ">u2", ">u8"],
+            "offsets": [0, 4, 6],
+            "itemsize": slot_size,
+        }
+    )
+
+
+def validate_control_batch(
+    buffer: bytearray,
+    count: int,
+    slot_size: int,
+    lengths,
+    header_size: int,
+    payload_size: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Validate `count` control packets laid out in fixed-size slots of one buffer.
+
+    Packet i lives at buffer[i * slot_size:] and is lengths[i] bytes long (see
+    DatagramBatch), with its payload starting `header_size` bytes in. Returns
+    (seq, timestamp_ms, valid) arrays; valid is False for packets that are too
+    short or whose payload checksum doesn't match.
+    """
+    headers = np.frombuffer(buffer, dtype=_control_header_dtype(slot_size), count=count)
+    packet_lengths = np.frombuffer(lengths, dtype=np.uint32, count=count).astype(np.int64)
+
+    seq = headers["seq"].astype(np.int64)
+    timestamp_ms = headers["timestamp_ms"].astype(np.int64)
+    received_checksum = headers["checksum"].astype(np.int64)
+
+    rows = np.frombuffer(buffer, dtype=np.uint8, count=count * slot_size).reshape(
+        count, slot_size
+    )
+    max_length = int(packet_lengths.max()) if count else header_size
+    payload = rows[:, header_size:max(max_length, header_size)]
+
+    # Ignore whatever an earlier, longer packet left beyond this packet's end
+    columns = np.arange(header_size, header_size + payload.shape[1])
+    in_packet = columns[np.newaxis, :] < packet_lengths[:, np.newaxis]
+    payload_sum = np.where(in_packet, payload, 0).sum(axis=1, dtype=np.int64)
+
+    valid = (packet_lengths >= header_size + payload_size) & (
+        (payload_sum & 0xFFFF) == received_checksum
+    )
+    return seq, timestamp_ms, valid
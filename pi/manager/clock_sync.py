@@ -1,15 +1,23 @@
 import socket
 import struct
 import time
+from collections import deque
 
 from manager.constants import CLOCK_SYNC_PORT
 
 from .utils import recv_all
 from .exceptions import ControllerServerConnectionRefusedError
 from .headset_location import get_headset_location
+from .ring_log import log
 
 
-def start_clock_sync_client():
+def start_clock_sync_client() -> int | None:
+    """
+    Answer the headset's clock sync requests with our time, until it hangs up.
+
+    The headset adds the offset it works out to the timestamps of its control
+    packets. Returns the number of requests answered.
+    """
     clock_sync_packet_count = 0
 
     headset_location = get_headset_location()
@@ -35,8 +43,11 @@ def start_clock_sync_client():
                 s.connect((HOST, PORT))
             except socket.timeout:
                 print("Socket timed out")
+                get_headset_location.invalidate()
                 raise ControllerServerConnectionRefusedError(HOST, PORT)
             except ConnectionRefusedError:
+                # The cached location may be out of date; ask the service next time
+                get_headset_location.invalidate()
                 raise ControllerServerConnectionRefusedError(HOST, PORT)
             print(f"connected to headset at {HOST}:{PORT}")
 
@@ -52,6 +63,251 @@ def start_clock_sync_client():
                 continue
     except (TimeoutError, ConnectionError):
         print("Socket timed out")
-        return clock_sync_packet_count
-    except Exception as e:
-        raise e
+    return clock_sync_packet_count
+
+
+# Background resync over the UDP control channel. The pi sends
+# SYNC(t1) and the headset answers SYNR(t1, t2, t3), where t2/t3 are its receive and
+# send times in the clock it stamps control packets with. All times are microseconds.
+SYNC_REQUEST = struct.Struct(">4sQ")
+SYNC_REQUEST_MAGIC = b"SYNC"
+SYNC_REPLY = struct.Struct(">4sQQQ")
+SYNC_REPLY_MAGIC = b"SYNR"
+
+SYNC_BURST_SIZE = 8  # Requests per round; the lowest-RTT reply of the round wins
+SYNC_BURST_SPACING = 0.02  # Seconds between requests in a round
+SYNC_REPLY_TIMEOUT = 0.25  # Seconds to wait for replies after the last request
+RESYNC_INTERVAL = 5.0  # Seconds between rounds once synced
+UNSYNCED_RESYNC_INTERVAL = 1.0  # Seconds between rounds until the first good round
+MAX_SYNC_DELAY_US = 1_000_000  # Replies slower than this carry no useful information
+# A round whose best round trip is this much worse than recent rounds was congested
+# end to end, so its offset is not trusted
+CONGESTED_DELAY_FACTOR = 2
+CONGESTED_DELAY_SLACK_US = 5_000
+
+DRIFT_HISTORY = 32  # Rounds kept for the drift fit
+MIN_DRIFT_SPAN_US = 10_000_000  # Don't estimate drift from less than 10s of history
+
+# Once the round trip is measured, packets are stale after the round trip plus this
+# many jitters, but never sooner than SYNCED_STALE_FLOOR_MS, so a queueing burst on
+# the LTE link doesn't drop every packet
+STALE_JITTER_FACTOR = 4
+SYNCED_STALE_FLOOR_MS = 150
+JITTER_GAIN = 1 / 16  # Smoothing of the jitter estimate, as in RFC 3550
+
+
+def wall_clock_us() -> int:
+    return time.time_ns() // 1000
+
+
+def monotonic_us() -> int:
+    return time.monotonic_ns() // 1000
+
+
+def is_sync_reply(data: bytes | bytearray | memoryview) -> bool:
+    return len(data) == SYNC_REPLY.size and bytes(data[:4]) == SYNC_REPLY_MAGIC
+
+
+def is_sync_request(data: bytes | bytearray | memoryview) -> bool:
+    return len(data) == SYNC_REQUEST.size and bytes(data[:4]) == SYNC_REQUEST_MAGIC
+
+
+def make_sync_reply(request: bytes, receive_us: int, clock_offset_us: int = 0) -> bytes:
+    """
+    Answer a SYNC request (the headset side).
+
+    `receive_us` is the local time the request arrived; `clock_offset_us` is added
+    to both timestamps so they match the clock the control packets are stamped with.
+    """
+    _, t1 = SYNC_REQUEST.unpack(request)
+    return SYNC_REPLY.pack(
+        SYNC_REPLY_MAGIC,
+        t1,
+        receive_us + clock_offset_us,
+        wall_clock_us() + clock_offset_us,
+    )
+
+
+class ClockSync:
+    """
+    NTP-style estimate of the headset clock relative to ours.
+
+    Each round sends a burst of SYNC requests; for every reply
+        offset = ((t2 - t1) + (t3 - t4)) / 2    delay = (t4 - t1) - (t3 - t2)
+    and the offset of the lowest-delay reply is kept, since queueing only ever adds
+    delay and asymmetric queueing is what skews the offset. The kept offsets are fit
+    against our monotonic clock to estimate drift, so the offset stays accurate
+    between rounds.
+
+    offset_us() is headset minus pi time: a packet stamped `timestamp_ms` by the
+    headset was sent at `timestamp_ms - offset_ms()` on our clock.
+    """
+
+    def __init__(self, burst_size: int = SYNC_BURST_SIZE, resync_interval: float = RESYNC_INTERVAL):
+        self.burst_size = burst_size
+        self.resync_interval = resync_interval
+
+        self.synced = False
+        self.round_count = 0
+        self.reply_count = 0
+        self.rejected_count = 0
+
+        self.delay_us = 0  # Round trip of the sample the offset came from
+        self.jitter_us = 0.0  # Smoothed change in round trip between replies
+        self._last_delay_us: int | None = None
+        self.drift = 0.0  # Offset change per microsecond of our clock
+        self._offset_us = 0.0
+        self._reference_us = 0  # Monotonic time _offset_us was measured at
+
+        self._round_best: tuple[float, int, int] | None = None  # (offset, delay, monotonic)
+        self._anchors: deque[tuple[int, float, int]] = deque(maxlen=DRIFT_HISTORY)
+        self._round_sent = 0
+        self._next_poll = 0.0
+
+    def offset_us(self, now_monotonic_us: int | None = None) -> float:
+        if not self.synced:
+            return 0.0
+        if now_monotonic_us is None:
+            now_monotonic_us = monotonic_us()
+        return self._offset_us + self.drift * (now_monotonic_us - self._reference_us)
+
+    def offset_ms(self) -> float:
+        return self.offset_us() / 1000
+
+    def headset_time_ms(self) -> float:
+        """Current time on the clock the headset stamps control packets with."""
+        return time.time() * 1000 + self.offset_ms()
+
+    def lag_ms(self, timestamp_ms: float, now_ms: float | None = None) -> float:
+        """Age of a packet stamped `timestamp_ms` by the headset, on our clock."""
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        return now_ms - (timestamp_ms - self.offset_ms())
+
+    def stale_threshold_ms(self, unsynced_threshold_ms: float) -> float:
+        """Age above which a packet is stale; tighter once SYNR rounds measured the link."""
+        if not self._anchors:
+            return unsynced_threshold_ms
+        # One-way delay plus offset uncertainty are each at most half the round trip
+        margin_ms = self.delay_us / 1000 + STALE_JITTER_FACTOR * self.jitter_us / 1000
+        return min(unsynced_threshold_ms, max(SYNCED_STALE_FLOOR_MS, margin_ms))
+
+    def adopt_headset_sync(self):
+        """
+        Fall back on the headset's TCP clock sync, for headsets that never answer SYNC.
+
+        Such a headset already adds its own offset estimate to the control packet
+        timestamps, so they are on our clock and the offset is zero. The round trip
+        is unknown, so the stale threshold stays loose; SYNR rounds, when they do
+        arrive, take over.
+        """
+        if self.synced:
+            return
+        self._offset_us = 0.0
+        self._reference_us = monotonic_us()
+        self.drift = 0.0
+        self.synced = True
+        log.info("Clock sync: using the headset's TCP sync")
+
+    def make_request(self) -> bytes:
+        return SYNC_REQUEST.pack(SYNC_REQUEST_MAGIC, wall_clock_us())
+
+    def handle_reply(self, data: bytes | bytearray | memoryview) -> bool:
+        """Take one SYNR reply into the current round. Returns False if it was rejected."""
+        t4 = wall_clock_us()
+        _, t1, t2, t3 = SYNC_REPLY.unpack(data)
+        delay = (t4 - t1) - (t3 - t2)
+        if delay < 0 or delay > MAX_SYNC_DELAY_US or t3 < t2:
+            self.rejected_count += 1
+            return False
+
+        self.reply_count += 1
+        if self._last_delay_us is not None:
+            self.jitter_us += (abs(delay - self._last_delay_us) - self.jitter_us) * JITTER_GAIN
+        self._last_delay_us = delay
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        if self._round_best is None or delay < self._round_best[1]:
+            self._round_best = (offset, delay, monotonic_us())
+        return True
+
+    def finish_round(self):
+        """Adopt the best sample of the round and refit the drift."""
+        self.round_count += 1
+        best = self._round_best
+        self._round_best = None
+        if best is None:
+            log.warning("Clock sync round %d got no replies", self.round_count)
+            return
+
+        offset, delay, measured_at = best
+        if self._anchors:
+            recent_delay = min(anchor[2] for anchor in self._anchors)
+            if delay > max(
+                recent_delay * CONGESTED_DELAY_FACTOR, recent_delay + CONGESTED_DELAY_SLACK_US
+            ):
+                log.warning(
+                    "Clock sync round trip %.3fms vs %.3fms recently, keeping the old offset",
+                    delay / 1000,
+                    recent_delay / 1000,
+                )
+                return
+
+        self._anchors.append((measured_at, offset, delay))
+        self._offset_us = offset
+        self._reference_us = measured_at
+        self.delay_us = delay
+        self.synced = True
+        self._fit_drift()
+        log.info(
+            "Clock sync: offset %.3fms, round trip %.3fms, jitter %.3fms, drift %.2fppm",
+            offset / 1000,
+            delay / 1000,
+            self.jitter_us / 1000,
+            self.drift * 1e6,
+        )
+
+    def _fit_drift(self):
+        if len(self._anchors) < 3:
+            return
+        first_at = self._anchors[0][0]
+        if self._anchors[-1][0] - first_at < MIN_DRIFT_SPAN_US:
+            return
+
+        # Least-squares slope of offset against our monotonic clock
+        count = len(self._anchors)
+        mean_t = sum(t - first_at for t, _, _ in self._anchors) / count
+        mean_offset = sum(offset for _, offset, _ in self._anchors) / count
+        covariance = 0.0
+        variance = 0.0
+        for t, offset, _ in self._anchors:
+            dt = t - first_at - mean_t
+            covariance += dt * (offset - mean_offset)
+            variance += dt * dt
+        if variance > 0:
+            self.drift = covariance / variance
+
+    def poll(self) -> bytes | None:
+        """
+        Drive the sync rounds from a receive loop: returns a SYNC request when one is
+        due, and closes the round once its replies had time to arrive.
+        """
+        now = time.monotonic()
+        if now < self._next_poll:
+            return None
+
+        if self._round_sent == self.burst_size:
+            self.finish_round()
+            self._round_sent = 0
+            interval = self.resync_interval if self.synced else UNSYNCED_RESYNC_INTERVAL
+            self._next_poll = now + interval
+            return None
+
+        self._round_sent += 1
+        if self._round_sent < self.burst_size:
+            self._next_poll = now + SYNC_BURST_SPACING
+        else:
+            self._next_poll = now + SYNC_REPLY_TIMEOUT
+        return self.make_request()
+
+    def seconds_until_poll(self) -> float:
+        return max(0.0, self._next_poll - time.monotonic())
@@ -0,0 +1,146 @@
+import struct
+
+from .checksum import xor_checksum
+
+# Compact control packet (headset -> pi), version 1:
+#   marker 0xC1 | seq (LEB128 varint) | timestamp_ms & 0xFFFF (>H)
+#   | pitch, yaw (>h, 1/8 degree) | throttle, steering (>h, 1/32767) | XOR checksum
+# The first byte of a regular control packet is the top byte of its sequence number,
+# and compact packets are always shorter than regular ones, so the two can't be
+# confused.
+COMPACT_CONTROL_MARKER = 0xC1
+COMPACT_TIMESTAMP = struct.Struct(">H")
+COMPACT_CONTROL_VALUES = struct.Struct(">hhhh")
+COMPACT_CONTROL_MAX_SIZE = 1 + 5 + COMPACT_TIMESTAMP.size + COMPACT_CONTROL_VALUES.size + 1
+
+# Compact telemetry packet (pi -> headset), version 1:
+#   marker 0xD1 | speed (>h, 1/100 mph) | distance (>I, 1/10 ft)
+#   | control battery % | drive battery % | XOR checksum
+COMPACT_TELEMETRY_MARKER = 0xD1
+COMPACT_TELEMETRY = struct.Struct(">BhIBBB")
+
+ANGLE_SCALE = 8  # Fixed-point steps per degree
+UNIT_SCALE = 32767  # Fixed-point steps for throttle/steering in [-1, 1]
+SPEED_SCALE = 100
+DISTANCE_SCALE = 10
+
+TIMESTAMP_WRAP_MS = 1 << 16
+
+
+def _clamp(value: float, low: int, high: int) -> int:
+    return max(low, min(high, int(round(value))))
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(
+    data: bytes | bytearray | memoryview, offset: int = 0
+) -> tuple[int, int] | None:
+    """(value, offset after it), or None if the data ends mid-varint."""
+    value = 0
+    shift = 0
+    while offset < len(data) and shift < 35:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+    return None
+
+
+def unwrap_timestamp_ms(wrapped_ms: int, reference_ms: float) -> int:
+    """The full timestamp ending in `wrapped_ms` that lies closest to `reference_ms`."""
+    base = int(reference_ms) - TIMESTAMP_WRAP_MS // 2
+    return base + (wrapped_ms - base) % TIMESTAMP_WRAP_MS
+
+
+def is_compact_control(data: bytes | bytearray | memoryview) -> bool:
+    return 0 < len(data) <= COMPACT_CONTROL_MAX_SIZE and data[0] == COMPACT_CONTROL_MARKER
+
+
+def encode_compact_control(
+    seq: int, timestamp_ms: int, pitch: float, yaw: float, throttle: float, steering: float
+) -> bytes:
+    packet = bytearray((COMPACT_CONTROL_MARKER,))
+    packet += encode_varint(seq & 0xFFFFFFFF)
+    packet += COMPACT_TIMESTAMP.pack(timestamp_ms % TIMESTAMP_WRAP_MS)
+    packet += COMPACT_CONTROL_VALUES.pack(
+        _clamp(pitch * ANGLE_SCALE, -32768, 32767),
+        _clamp(yaw * ANGLE_SCALE, -32768, 32767),
+        _clamp(throttle * UNIT_SCALE, -UNIT_SCALE, UNIT_SCALE),
+        _clamp(steering * UNIT_SCALE, -UNIT_SCALE, UNIT_SCALE),
+    )
+    packet.append(xor_checksum(packet))
+    return bytes(packet)
+
+
+def decode_compact_control(
+    data: bytes | bytearray | memoryview, reference_ms: float
+) -> tuple[int, int, float, float, float, float] | None:
+    """
+    (seq, timestamp_ms, pitch, yaw, throttle, steering), or None if malformed.
+
+    `reference_ms` is the current time on the headset's clock (our time plus the
+    clock sync offset); the 16-bit timestamp is unwrapped around it.
+    """
+    if not is_compact_control(data) or xor_checksum(data[:-1]) != data[-1]:
+        return None
+    decoded = decode_varint(data, 1)
+    if decoded is None:
+        return None
+    seq, offset = decoded
+    if offset + COMPACT_TIMESTAMP.size + COMPACT_CONTROL_VALUES.size != len(data) - 1:
+        return None
+
+    (wrapped_ms,) = COMPACT_TIMESTAMP.unpack_from(data, offset)
+    pitch, yaw, throttle, steering = COMPACT_CONTROL_VALUES.unpack_from(
+        data, offset + COMPACT_TIMESTAMP.size
+    )
+    return (
+        seq,
+        unwrap_timestamp_ms(wrapped_ms, reference_ms),
+        pitch / ANGLE_SCALE,
+        yaw / ANGLE_SCALE,
+        throttle / UNIT_SCALE,
+        steering / UNIT_SCALE,
+    )
+
+
+def is_compact_telemetry(data: bytes | bytearray | memoryview) -> bool:
+    return len(data) == COMPACT_TELEMETRY.size and data[0] == COMPACT_TELEMETRY_MARKER
+
+
+def encode_compact_telemetry(
+    speed_mph: float, distance_ft: float, control_battery: int, drive_battery: int
+) -> bytes:
+    packet = bytearray(COMPACT_TELEMETRY.size)
+    COMPACT_TELEMETRY.pack_into(
+        packet,
+        0,
+        COMPACT_TELEMETRY_MARKER,
+        _clamp(speed_mph * SPEED_SCALE, -32768, 32767),
+        _clamp(distance_ft * DISTANCE_SCALE, 0, 0xFFFFFFFF),
+        _clamp(control_battery, 0, 255),
+        _clamp(drive_battery, 0, 255),
+        0,
+    )
+    packet[-1] = xor_checksum(memoryview(packet)[:-1])
+    return bytes(packet)
+
+
+def decode_compact_telemetry(
+    data: bytes | bytearray | memoryview,
+) -> tuple[float, float, int, int] | None:
+    """(speed_mph, distance_ft, control_battery, drive_battery), or None if malformed."""
+    if not is_compact_telemetry(data) or xor_checksum(data[:-1]) != data[-1]:
+        return None
+    _, speed, distance, control_battery, drive_battery, _ = COMPACT_TELEMETRY.unpack(data)
+    return speed / SPEED_SCALE, distance / DISTANCE_SCALE, control_battery, drive_battery
@@ -1,2 +1,3 @@
 CLOCK_SYNC_PORT = 6778
 CONTROL_STREAM_PORT = 6779
+METRICS_PORT = 6780
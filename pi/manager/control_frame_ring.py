@@ -0,0 +1,176 @@
+from array import array
+
+from .ring_log import log
+
+# Control packet sequence numbers are 32-bit (">I") and wrap around
+SEQ_MODULUS = 1 << 32
+HALF_SEQ_RANGE = 1 << 31
+
+# Layout of one frame in the ring
+FIELD_SEQ = 0
+FIELD_TIMESTAMP_MS = 1
+FIELD_PITCH = 2
+FIELD_YAW = 3
+FIELD_THROTTLE = 4
+FIELD_STEERING = 5
+FIELD_COUNT = 6
+
+# A frame this far behind the latest one can't be a late packet from the
+# current session, so the headset must have restarted its sequence numbers
+DEFAULT_RESYNC_WINDOW = 1024
+# Nor can a frame that is behind in sequence but stamped this much later than the
+# latest one; late packets carry older timestamps. This catches a restart whose
+# new sequence numbers land inside the resync window.
+DEFAULT_RESTART_GAP_MS = 100
+
+
+def seq_distance(seq: int, reference: int) -> int:
+    """Signed distance from `reference` to `seq`, accounting for 32-bit wraparound."""
+    diff = (seq - reference) % SEQ_MODULUS
+    if diff >= HALF_SEQ_RANGE:
+        return diff - SEQ_MODULUS
+    return diff
+
+
+def seq_newer(seq: int, reference: int) -> bool:
+    """True if `seq` comes after `reference` (RFC 1982 serial number arithmetic)."""
+    return seq_distance(seq, reference) > 0
+
+
+class ControlFrameRing:
+    """
+    Fixed-size history of decoded control frames, newest wins.
+
+    Frames are stored as (seq, timestamp_ms, pitch, yaw, throttle, steering) in one
+    preallocated array('d'), so pushing and reading never allocate containers. The
+    receiver is the only writer; the control loop and telemetry path can read the
+    latest frame or window statistics at any time.
+    """
+
+    __slots__ = ("capacity", "resync_window", "restart_gap_ms", "data", "head", "count")
+
+    def __init__(
+        self,
+        capacity: int = 64,
+        resync_window: int = DEFAULT_RESYNC_WINDOW,
+        restart_gap_ms: float = DEFAULT_RESTART_GAP_MS,
+    ):
+        self.capacity = capacity
+        self.resync_window = resync_window
+        self.restart_gap_ms = restart_gap_ms
+        self.data = array("d", bytes(8 * capacity * FIELD_COUNT))
+        self.head = -1  # Slot of the latest frame
+        self.count = 0  # Frames pushed since the last reset
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def reset(self):
+        self.head = -1
+        self.count = 0
+
+    def _is_restart(self, distance: int, timestamp_ms: float | None) -> bool:
+        if distance < -self.resync_window:
+            return True
+        return (
+            distance <= 0
+            and timestamp_ms is not None
+            and timestamp_ms - self.get(FIELD_TIMESTAMP_MS) > self.restart_gap_ms
+        )
+
+    def is_newer(self, seq: int, timestamp_ms: float | None = None) -> bool:
+        """Whether a frame with this sequence number and timestamp would be accepted by push()."""
+        if self.count == 0:
+            return True
+        distance = seq_distance(seq, self.latest_seq)
+        return distance > 0 or self._is_restart(distance, timestamp_ms)
+
+    def push(
+        self,
+        seq: int,
+        timestamp_ms: float,
+        pitch: float,
+        yaw: float,
+        throttle: float,
+        steering: float,
+    ) -> bool:
+        """Store a frame if it is newer than the latest one. Returns False if it was dropped."""
+        if self.count:
+            distance = seq_distance(seq, self.latest_seq)
+            if self._is_restart(distance, timestamp_ms):
+                log.warning("Sequence restarted at %d, resetting control frame history", seq)
+                self.reset()
+            elif distance <= 0:
+                return False
+
+        slot = (self.head + 1) % self.capacity
+        base = slot * FIELD_COUNT
+        data = self.data
+        data[base + FIELD_SEQ] = seq
+        data[base + FIELD_TIMESTAMP_MS] = timestamp_ms
+        data[base + FIELD_PITCH] = pitch
+        data[base + FIELD_YAW] = yaw
+        data[base + FIELD_THROTTLE] = throttle
+        data[base + FIELD_STEERING] = steering
+
+        # Publish the frame only once it is fully written
+        self.head = slot
+        self.count += 1
+        return True
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self.data[self.head * FIELD_COUNT + FIELD_SEQ])
+
+    def get(self, field: int, age: int = 0) -> float:
+        """Value of `field` for the frame `age` pushes before the latest one."""
+        if age >= len(self):
+            raise IndexError("control frame not in history")
+        slot = (self.head - age) % self.capacity
+        return self.data[slot * FIELD_COUNT + field]
+
+    def latest(self) -> tuple[float, ...] | None:
+        if self.count == 0:
+            return None
+        base = self.head * FIELD_COUNT
+        return tuple(self.data[base : base + FIELD_COUNT])
+
+    def read_latest_into(self, out) -> bool:
+        """Copy the latest frame into a caller-owned buffer of FIELD_COUNT floats."""
+        if self.count == 0:
+            return False
+        base = self.head * FIELD_COUNT
+        for i in range(FIELD_COUNT):
+            out[i] = self.data[base + i]
+        return True
+
+    def window_stats(self, field: int, window: int) -> tuple[float, float, float]:
+        """(mean, min, max) of `field` over the last `window` frames."""
+        window = min(window, len(self))
+        if window == 0:
+            return (0.0, 0.0, 0.0)
+
+        data = self.data
+        total = 0.0
+        low = float("inf")
+        high = float("-inf")
+        slot = self.head
+        for _ in range(window):
+            value = data[slot * FIELD_COUNT + field]
+            total += value
+            if value < low:
+                low = value
+            if value > high:
+                high = value
+            slot = (slot - 1) % self.capacity
+        return (total / window, low, high)
+
+    def window_rate_hz(self, window: int) -> float:
+        """Frame rate over the last `window` frames, from the headset timestamps."""
+        window = min(window, len(self))
+        if window < 2:
+            return 0.0
+        elapsed_ms = self.get(FIELD_TIMESTAMP_MS) - self.get(FIELD_TIMESTAMP_MS, window - 1)
+        if elapsed_ms <= 0:
+            return 0.0
+        return (window - 1) * 1000.0 / elapsed_ms
@@ -0,0 +1,82 @@
+import struct
+from collections.abc import Collection, Sequence
+
+from .checksum import calculate_checksum
+from .control_frame_ring import ControlFrameRing, seq_distance
+
+# Redundant control packets are a normal packet followed by copies of the previous
+# K frames, newest first: age relative to the packet timestamp (ms) + the 4 values.
+# The header checksum covers them too.
+REDUNDANT_FRAME = struct.Struct(">Hffff")
+MAX_REDUNDANT_FRAMES = 8
+
+# Same layout as udp_control_receiver.CONTROL_HEADER/CONTROL_PAYLOAD
+_CONTROL_HEADER = struct.Struct(">IHQ")
+_CONTROL_PAYLOAD = struct.Struct(">ffff")
+_CONTROL_PACKET_SIZE = _CONTROL_HEADER.size + _CONTROL_PAYLOAD.size
+
+
+def redundant_frame_count(length: int) -> int:
+    """How many previous frames a control packet of `length` bytes carries."""
+    extra = length - _CONTROL_PACKET_SIZE
+    if extra <= 0 or extra % REDUNDANT_FRAME.size:
+        return 0
+    return min(extra // REDUNDANT_FRAME.size, MAX_REDUNDANT_FRAMES)
+
+
+def pack_control_packet(
+    seq: int,
+    timestamp_ms: int,
+    values: tuple[float, float, float, float],
+    history: Sequence[tuple[int, tuple[float, float, float, float]]] = (),
+) -> bytes:
+    """
+    Build a control packet (the headset side).
+
+    `history` holds (timestamp_ms, values) of the previous frames, newest first; each
+    one is appended as a redundant copy.
+    """
+    payload = bytearray(_CONTROL_PAYLOAD.pack(*values))
+    for frame_timestamp_ms, frame_values in history[:MAX_REDUNDANT_FRAMES]:
+        age_ms = min(max(timestamp_ms - frame_timestamp_ms, 0), 0xFFFF)
+        payload += REDUNDANT_FRAME.pack(age_ms, *frame_values)
+    header = _CONTROL_HEADER.pack(seq, calculate_checksum(payload), timestamp_ms)
+    return header + payload
+
+
+def recover_missing_frames(
+    buffer: bytes | bytearray | memoryview,
+    offset: int,
+    length: int,
+    seq: int,
+    timestamp_ms: int,
+    control_frames: ControlFrameRing,
+    received_seqs: Collection[int] = (),
+) -> int:
+    """
+    Push the frames a redundant packet carries that `control_frames` never received.
+
+    Call this before pushing the packet's own frame. Frames whose seq is in
+    `received_seqs` arrived in packets of their own (e.g. earlier in the same burst)
+    and are pushed without being counted. Returns the number of frames recovered.
+    """
+    count = redundant_frame_count(length)
+    if count == 0 or not len(control_frames):
+        # Frames from before the first one received weren't lost
+        return 0
+
+    recovered = 0
+    # Oldest first, so each push is newer than the last
+    for age in range(count, 0, -1):
+        frame_seq = (seq - age) % (1 << 32)
+        if seq_distance(frame_seq, control_frames.latest_seq) <= 0:
+            continue
+        age_ms, pitch, yaw, throttle, steering = REDUNDANT_FRAME.unpack_from(
+            buffer, offset + _CONTROL_PACKET_SIZE + (age - 1) * REDUNDANT_FRAME.size
+        )
+        if (
+            control_frames.push(frame_seq, timestamp_ms - age_ms, pitch, yaw, throttle, steering)
+            and frame_seq not in received_seqs
+        ):
+            recovered += 1
+    return recovered
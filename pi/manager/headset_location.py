@@ -1,42 +1,65 @@
+import os
 import socket
 
 import requests
 
 from manager.constants import CLOCK_SYNC_PORT
 
-from .utils import cache_if_not_none
+from .utils import persistent_cache
 
 CONNECTION_SERVICE_IP = "3.215.138.208"
 CONNECTION_SERVICE_PORT = 4337
 
+# Pairs a headset with its car when several use the same connection service
+SESSION_ID = os.environ.get("FPV_SESSION_ID", "default")
 
-@cache_if_not_none
+# /client/wait answers as soon as the headset registers, or after this long
+LONG_POLL_TIMEOUT = 25  # Seconds
+
+# A restarted control process reuses the last known headset right away and asks the
+# connection service again in the background
+HEADSET_LOCATION_TTL = 60  # Seconds before the location is refreshed
+HEADSET_LOCATION_MAX_STALE = 12 * 60 * 60  # Seconds an old location is still tried
+
+
+@persistent_cache(
+    f"headset_location_{SESSION_ID}",
+    ttl=HEADSET_LOCATION_TTL,
+    max_stale=HEADSET_LOCATION_MAX_STALE,
+)
 def get_headset_location() -> dict[str, str] | None:
     client_local_ip = socket.gethostbyname(socket.gethostname())
-    client_public_ip = requests.get("https://api.ipify.org").text
 
     print(f"Client Local IP: {client_local_ip}")
-    print(f"Client Public IP: {client_public_ip}")
 
-    # Send a request to the connection service
-    response = requests.post(
-        f"http://{CONNECTION_SERVICE_IP}:{CONNECTION_SERVICE_PORT}/client",
-        json={
-            "client_local_ip": client_local_ip,
-            "client_public_ip": client_public_ip,
-        },
-    )
+    # Long poll: the connection service holds the request until the headset registers,
+    # and fills in our public IP from the address it sees
+    try:
+        response = requests.post(
+            f"http://{CONNECTION_SERVICE_IP}:{CONNECTION_SERVICE_PORT}/client/wait",
+            json={
+                "session_id": SESSION_ID,
+                "client_local_ip": client_local_ip,
+                "timeout": LONG_POLL_TIMEOUT,
+            },
+            timeout=LONG_POLL_TIMEOUT + 5,
+        )
+    except requests.RequestException as e:
+        print(f"Failed to reach connection service: {e}")
+        return None
     if response.status_code == 200:
         """
         Response looks like this:
         {
           "server_ip": "192.168.0.10",
           "server_port": "8080",
-          "stored_at": "2024-12-14T12:34:56.789Z"
+          "stored_at": "2024-12-14T12:34:56.789Z",
+          "observed_ip": "73.42.180.203"
         }
         """
         resp_json = response.json()
         print("Received response from connection service")
+        print(f"Client Public IP: {resp_json.get('observed_ip')}")
         print(f"headset ip: {resp_json['server_ip']} port: {resp_json['server_port']}")
         return resp_json
     else:
@@ -46,18 +69,17 @@ def get_headset_location() -> dict[str, str] | None:
 
 def set_headset_location() -> bool:
     """Set the headset location in the connection service."""
-    public_ip = requests.get("https://api.ipify.org").text
-
+    # The service records the public IP it sees the request come from
     response = requests.post(
         f"http://{CONNECTION_SERVICE_IP}:{CONNECTION_SERVICE_PORT}/server",
         json={
-            "server_public_ip": public_ip,
+            "session_id": SESSION_ID,
             "server_local_ip": socket.gethostbyname(socket.gethostname()),
             "server_port": CLOCK_SYNC_PORT,
         },
     )
     if response.status_code == 200:
-        print("Successfully set headset location")
+        print(f"Successfully set headset location (public IP {response.json().get('observed_ip')})")
         return True
     else:
         print("Failed to set headset location")
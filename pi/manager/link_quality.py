@@ -0,0 +1,131 @@
+import struct
+import time
+from collections import deque
+
+from .control_frame_ring import seq_distance
+from .ring_log import log
+
+# Rate recommendation sent to the headset on the telemetry channel:
+# magic, recommended control rate (Hz), loss (per mille), jitter (us)
+RATE_MESSAGE = struct.Struct(">4sHHI")
+RATE_MESSAGE_MAGIC = b"RATE"
+
+QUALITY_WINDOW = 1.0  # Seconds of traffic each measurement covers
+MIN_RATE_HZ = 20
+MAX_RATE_HZ = 100  # Matches COMMAND_RATE_HZ; more is coalesced away anyway
+RATE_DECREASE_FACTOR = 0.75  # Multiplicative decrease when the link is congested
+RATE_INCREASE_HZ = 10  # Additive increase per clean window
+
+HIGH_LOSS = 0.05  # Loss above this means congestion
+LOW_LOSS = 0.01  # Loss below this lets the rate grow again
+HIGH_JITTER_MS = 20.0
+# Mean lag this far above the best recent window means packets are queueing
+LAG_RISE_MS = 40.0
+BASE_LAG_WINDOWS = 10  # Windows the baseline lag is taken over
+
+
+def is_rate_message(data: bytes | bytearray | memoryview) -> bool:
+    return len(data) == RATE_MESSAGE.size and bytes(data[:4]) == RATE_MESSAGE_MAGIC
+
+
+def unpack_rate_message(data: bytes) -> tuple[int, float, float]:
+    """(rate_hz, loss, jitter_ms) from a RATE message."""
+    _, rate_hz, loss_permille, jitter_us = RATE_MESSAGE.unpack(data)
+    return rate_hz, loss_permille / 1000, jitter_us / 1000
+
+
+class LinkQualityMonitor:
+    """
+    Measures loss, jitter and lag of the control stream once per window and adjusts a
+    recommended headset send rate (AIMD).
+
+    Loss comes from the sequence numbers, jitter is the RFC 3550 interarrival
+    estimate over the packet lags, and a mean lag rising above the best recent window
+    means the LTE link is buffering. On congestion the rate is cut; on clean windows
+    it creeps back up, since fewer fresh packets beat many queued ones.
+    """
+
+    def __init__(
+        self,
+        window: float = QUALITY_WINDOW,
+        min_rate_hz: int = MIN_RATE_HZ,
+        max_rate_hz: int = MAX_RATE_HZ,
+    ):
+        self.window = window
+        self.min_rate_hz = min_rate_hz
+        self.max_rate_hz = max_rate_hz
+        self.rate_hz = float(max_rate_hz)
+
+        self.loss = 0.0
+        self.jitter_ms = 0.0
+        self.mean_lag_ms = 0.0
+
+        self._window_end = time.monotonic() + window
+        self._received = 0
+        self._lag_total = 0.0
+        self._base_seq: int | None = None  # Highest seq at the end of the last window
+        self._highest_seq: int | None = None
+        self._last_lag_ms: float | None = None
+        self._window_lags: deque[float] = deque(maxlen=BASE_LAG_WINDOWS)
+
+    def record(self, seq: int, lag_ms: float, count: int = 1):
+        """Account for `count` packets received, the newest being `seq`."""
+        self._received += count
+        self._lag_total += lag_ms * count
+        if self._highest_seq is None or seq_distance(seq, self._highest_seq) > 0:
+            self._highest_seq = seq
+        if self._base_seq is None:
+            self._base_seq = seq - count
+
+        # RFC 3550: lag changes between packets are the transit time differences
+        if self._last_lag_ms is not None:
+            self.jitter_ms += (abs(lag_ms - self._last_lag_ms) - self.jitter_ms) / 16
+        self._last_lag_ms = lag_ms
+
+    def poll(self) -> bytes | None:
+        """Close the window if it is over; returns the RATE message to send."""
+        now = time.monotonic()
+        if now < self._window_end:
+            return None
+        self._window_end = now + self.window
+
+        if self._received == 0 or self._highest_seq is None or self._base_seq is None:
+            return None  # Nothing to judge the link by
+
+        expected = seq_distance(self._highest_seq, self._base_seq)
+        self.loss = max(0.0, 1.0 - self._received / expected) if expected > 0 else 0.0
+        self.mean_lag_ms = self._lag_total / self._received
+        base_lag_ms = min(self._window_lags, default=self.mean_lag_ms)
+        self._window_lags.append(self.mean_lag_ms)
+
+        self._base_seq = self._highest_seq
+        self._received = 0
+        self._lag_total = 0.0
+
+        previous_rate = int(self.rate_hz)
+        if (
+            self.loss > HIGH_LOSS
+            or self.jitter_ms > HIGH_JITTER_MS
+            or self.mean_lag_ms > base_lag_ms + LAG_RISE_MS
+        ):
+            self.rate_hz = max(self.min_rate_hz, self.rate_hz * RATE_DECREASE_FACTOR)
+        elif self.loss < LOW_LOSS:
+            self.rate_hz = min(self.max_rate_hz, self.rate_hz + RATE_INCREASE_HZ)
+
+        if int(self.rate_hz) != previous_rate:
+            log.info(
+                "Link quality: loss %.1f%%, jitter %.1fms, lag %.1fms -> %d Hz",
+                self.loss * 100,
+                self.jitter_ms,
+                self.mean_lag_ms,
+                int(self.rate_hz),
+            )
+        return RATE_MESSAGE.pack(
+            RATE_MESSAGE_MAGIC,
+            int(self.rate_hz),
+            min(int(self.loss * 1000), 1000),
+            min(int(self.jitter_ms * 1000), 0xFFFFFFFF),
+        )
+
+    def seconds_until_poll(self) -> float:
+        return max(0.0, self._window_end - time.monotonic())
@@ -0,0 +1,232 @@
+import json
+import socket
+import threading
+import time
+from array import array
+
+from manager.constants import METRICS_PORT
+
+# Each power of two is split into 2^(SUB_BUCKET_BITS - 1) linear buckets, so any
+# recorded value is off by at most ~3% while the whole histogram stays a few KB
+SUB_BUCKET_BITS = 6
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+MAX_TRACKED_US = 60_000_000  # Anything above a minute is clamped
+
+# Per-stage latency histograms, all in microseconds
+STAGE_NETWORK_LAG = "network_lag"  # Headset timestamp -> packet received
+STAGE_PARSE = "parse"  # Batch received -> newest frame decoded and validated
+STAGE_RECV_TO_SERIAL = "recv_to_serial"  # Frame decoded -> command written to the UART
+STAGE_SERIAL_WRITE = "serial_write"  # Duration of the serial write call
+# Command frame written -> pong for the ping sent right behind it, so it includes the
+# firmware working through the command
+STAGE_ARDUINO_ACK = "arduino_ack"
+STAGE_LINK_RTT = "link_rtt"  # Ping -> pong on an idle link
+STAGE_TELEMETRY_SEND = "telemetry_send"  # Sending a telemetry packet to the headset
+STAGES = (
+    STAGE_NETWORK_LAG,
+    STAGE_PARSE,
+    STAGE_RECV_TO_SERIAL,
+    STAGE_SERIAL_WRITE,
+    STAGE_ARDUINO_ACK,
+    STAGE_LINK_RTT,
+    STAGE_TELEMETRY_SEND,
+)
+
+COUNTER_CONTROL_PACKETS = "control_packets"  # Valid control packets, stale or not
+COUNTER_INVALID_PACKETS = "invalid_packets"  # Too short or failed checksum
+COUNTER_STALE_DROPS = "stale_drops"
+COUNTER_SEQ_GAPS = "seq_gaps"
+COUNTER_COMMANDS_COALESCED = "commands_coalesced"
+COUNTER_FRAMES_RECOVERED = "frames_recovered"  # Lost frames rebuilt from redundant copies
+COUNTERS = (
+    COUNTER_CONTROL_PACKETS,
+    COUNTER_INVALID_PACKETS,
+    COUNTER_STALE_DROPS,
+    COUNTER_SEQ_GAPS,
+    COUNTER_COMMANDS_COALESCED,
+    COUNTER_FRAMES_RECOVERED,
+)
+
+REPORT_INTERVAL = 5.0  # Seconds between metric dumps
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * SUB_BUCKET_HALF:
+        return value
+    exponent = value.bit_length() - SUB_BUCKET_BITS
+    return exponent * SUB_BUCKET_HALF + (value >> exponent)
+
+
+def _bucket_value(index: int) -> int:
+    """Lowest value that lands in bucket `index`."""
+    if index < 2 * SUB_BUCKET_HALF:
+        return index
+    exponent = index // SUB_BUCKET_HALF - 1
+    return (index - exponent * SUB_BUCKET_HALF) << exponent
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of integer microsecond values with constant-time record().
+
+    Buckets are log-linear: exact below 2^SUB_BUCKET_BITS, then a fixed number of
+    linear sub-buckets per power of two, so relative precision is the same from
+    microseconds to seconds.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * (_bucket_index(MAX_TRACKED_US) + 1)))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value_us: float):
+        value = int(value_us)
+        if value < 0:
+            value = 0
+        elif value > MAX_TRACKED_US:
+            value = MAX_TRACKED_US
+
+        self.counts[_bucket_index(value)] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(1, int(self.count * percent / 100 + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                # Report the top of the bucket, bounded by what was actually seen
+                return min(_bucket_value(index + 1) - 1, self.max)
+        return self.max
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "min_us": self.min,
+            "mean_us": self.total / self.count if self.count else 0,
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us": self.max,
+        }
+
+
+class Metrics:
+    """
+    Latency histograms for each pipeline stage plus event counters.
+
+    The receiver, the serial writer and the telemetry reader all record from their
+    own threads, so every update is made under one lock; uncontended it costs well
+    under a microsecond.
+    """
+
+    def __init__(self):
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.counters: dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.histograms[stage].record(seconds * 1_000_000)
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.started_at = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "taken_at": time.time(),
+                "stages": {
+                    stage: histogram.snapshot() for stage, histogram in self.histograms.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+# Process-wide instance the control pipeline records into
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """Periodically sends a JSON snapshot of the metrics to a local UDP port."""
+
+    def __init__(
+        self,
+        source: Metrics = metrics,
+        interval: float = REPORT_INTERVAL,
+        address: tuple[str, int] = ("127.0.0.1", METRICS_PORT),
+    ):
+        self.source = source
+        self.interval = interval
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sock.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                _ = self.sock.sendto(
+                    json.dumps(self.source.snapshot()).encode(), self.address
+                )
+            except OSError as e:
+                print(f"Failed to send metrics: {e}")
+
+
+def print_metrics(snapshot: dict):
+    for stage, stats in snapshot["stages"].items():
+        if stats["count"] == 0:
+            continue
+        print(
+            f"{stage:>15}: n={stats['count']:<7} p50={stats['p50_us'] / 1000:.2f}ms "
+            f"p99={stats['p99_us'] / 1000:.2f}ms p999={stats['p999_us'] / 1000:.2f}ms "
+            f"max={stats['max_us'] / 1000:.2f}ms"
+        )
+    print("  ".join(f"{name}={value}" for name, value in snapshot["counters"].items()))
+
+
+if __name__ == "__main__":
+    # Listen for snapshots from a running receiver and print them
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", METRICS_PORT))
+    print(f"Waiting for metrics on 127.0.0.1:{METRICS_PORT}...")
+    while True:
+        data, _ = sock.recvfrom(65535)
+        print_metrics(json.loads(data))
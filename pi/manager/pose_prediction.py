@@ -0,0 +1,78 @@
+import numpy as np
+
+from .control_frame_ring import (FIELD_COUNT, FIELD_PITCH, FIELD_TIMESTAMP_MS, FIELD_YAW,
+                                 ControlFrameRing)
+
+DEFAULT_WINDOW = 8  # Frames the angular velocity is fit over
+MAX_HISTORY_MS = 120  # Frames older than this describe a different motion
+MAX_LEAD_MS = 150  # Never extrapolate further ahead than this
+MAX_CORRECTION_DEG = 15.0  # Largest change prediction may make to either angle
+
+
+class PosePredictor:
+    """
+    Extrapolates head pitch/yaw ahead by the network latency.
+
+    The angular velocity is the least-squares slope of the recent frames in a
+    ControlFrameRing against their headset timestamps, fit for both angles at once.
+    The prediction starts from the latest frame, so a still head is never moved, and
+    both the lead time and the correction are clamped so a glitchy fit can't fling
+    the turret.
+    """
+
+    def __init__(
+        self,
+        window: int = DEFAULT_WINDOW,
+        max_history_ms: float = MAX_HISTORY_MS,
+        max_lead_ms: float = MAX_LEAD_MS,
+        max_correction_deg: float = MAX_CORRECTION_DEG,
+    ):
+        self.window = window
+        self.max_history_ms = max_history_ms
+        self.max_lead_ms = max_lead_ms
+        self.max_correction_deg = max_correction_deg
+        self._ages = np.arange(window)
+        self._angle_fields = np.array([FIELD_PITCH, FIELD_YAW])
+
+    def angular_velocity(self, control_frames: ControlFrameRing) -> tuple[float, float] | None:
+        """(pitch, yaw) rate in degrees per ms, or None without enough recent history."""
+        count = min(self.window, len(control_frames))
+        if count < 3:
+            return None
+
+        frames = np.frombuffer(control_frames.data, dtype=np.float64).reshape(
+            control_frames.capacity, FIELD_COUNT
+        )
+        slots = (control_frames.head - self._ages[:count]) % control_frames.capacity
+        recent = frames[slots]
+
+        # Time relative to the latest frame, so values stay small
+        times_ms = recent[:, FIELD_TIMESTAMP_MS] - recent[0, FIELD_TIMESTAMP_MS]
+        in_window = times_ms >= -self.max_history_ms
+        if int(in_window.sum()) < 3:
+            return None
+        times_ms = times_ms[in_window]
+        angles = recent[in_window][:, self._angle_fields]
+
+        centered_times = times_ms - times_ms.mean()
+        variance = float(centered_times @ centered_times)
+        if variance == 0.0:
+            return None
+        pitch_rate, yaw_rate = centered_times @ (angles - angles.mean(axis=0)) / variance
+        return float(pitch_rate), float(yaw_rate)
+
+    def predict(
+        self, control_frames: ControlFrameRing, lead_ms: float
+    ) -> tuple[float, float]:
+        """(pitch, yaw) of the latest frame, moved `lead_ms` ahead along the fit."""
+        pitch = control_frames.get(FIELD_PITCH)
+        yaw = control_frames.get(FIELD_YAW)
+        rates = self.angular_velocity(control_frames)
+        if rates is None or lead_ms <= 0:
+            return pitch, yaw
+
+        lead_ms = min(lead_ms, self.max_lead_ms)
+        limit = self.max_correction_deg
+        pitch_correction = min(max(rates[0] * lead_ms, -limit), limit)
+        yaw_correction = min(max(rates[1] * lead_ms, -limit), limit)
+        return pitch + pitch_correction, yaw + yaw_correction
@@ -0,0 +1,194 @@
+import atexit
+import itertools
+import sys
+import threading
+import time
+
+# Levels, lowest to highest
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+DEFAULT_CAPACITY = 4096  # Records held between flushes before the oldest are overwritten
+FLUSH_INTERVAL = 0.1  # Seconds between background flushes
+MAX_LINES_PER_SECOND = 200  # Total lines written per second
+MAX_REPEATS_PER_SECOND = 5  # Lines per second from any one message format
+
+
+def _disabled(fmt: str, *args):
+    """Stand-in for a log method below the current level."""
+
+
+class RingLogger:
+    """
+    Logger whose hot path only stores a record in a preallocated ring.
+
+    Calls like `log.warning("seq %d too old", seq)` save the format string, its
+    arguments and a timestamp; a background thread formats and writes them out every
+    FLUSH_INTERVAL, so a slow terminal or journald never stalls the caller. Messages
+    are rate limited per format string and overall, and a summary of what was
+    suppressed is written instead.
+
+    Methods below the current level are rebound to a no-op function, so a disabled
+    call costs one function call. Each slot is written with a single assignment
+    tagged with a unique record number, so any thread can log without a lock.
+    """
+
+    def __init__(
+        self,
+        level: int = INFO,
+        capacity: int = DEFAULT_CAPACITY,
+        stream=None,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_lines_per_second: int = MAX_LINES_PER_SECOND,
+        max_repeats_per_second: int = MAX_REPEATS_PER_SECOND,
+    ):
+        self.capacity = capacity
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.max_lines_per_second = max_lines_per_second
+        self.max_repeats_per_second = max_repeats_per_second
+
+        self._slots: list[tuple | None] = [None] * capacity
+        self._record_numbers = itertools.count()
+        self._next_record = 0  # Oldest record the flusher hasn't written yet
+        self.overwritten_count = 0  # Records lost because the ring wrapped
+        self.suppressed_count = 0  # Records dropped by the rate limits
+
+        self._window_start = 0.0
+        self._window_lines = 0
+        self._window_repeats: dict[str, int] = {}
+        self._window_suppressed: dict[str, int] = {}
+
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.set_level(level)
+
+    def set_level(self, level: int):
+        self.level = level
+        for method_level, name in (
+            (DEBUG, "debug"),
+            (INFO, "info"),
+            (WARNING, "warning"),
+            (ERROR, "error"),
+        ):
+            if method_level >= level:
+                # Drop the instance override so the class method is used again
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _disabled)
+
+    def enabled_for(self, level: int) -> bool:
+        """For call sites that would do real work just to build the arguments."""
+        return level >= self.level
+
+    def _record(self, level: int, fmt: str, args: tuple):
+        if self._thread is None:
+            self.start()
+        number = next(self._record_numbers)
+        self._slots[number % self.capacity] = (number, time.time(), level, fmt, args)
+
+    def debug(self, fmt: str, *args):
+        self._record(DEBUG, fmt, args)
+
+    def info(self, fmt: str, *args):
+        self._record(INFO, fmt, args)
+
+    def warning(self, fmt: str, *args):
+        self._record(WARNING, fmt, args)
+
+    def error(self, fmt: str, *args):
+        self._record(ERROR, fmt, args)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write out everything recorded so far. Safe to call from any thread."""
+        with self._flush_lock:
+            stream = self.stream if self.stream is not None else sys.stdout
+            lines = []
+            slots = self._slots
+            lost = 0
+            while True:
+                record = slots[self._next_record % self.capacity]
+                if record is None or record[0] < self._next_record:
+                    break  # Nothing newer has been written to this slot yet
+                if record[0] > self._next_record:
+                    # The ring wrapped before we got here, this record was overwritten
+                    lost += 1
+                    self._next_record += 1
+                    continue
+                if lost:
+                    lines.append(f"[ring_log] {lost} messages lost, log ring overflowed")
+                    self.overwritten_count += lost
+                    lost = 0
+                self._next_record += 1
+                if record[1] - self._window_start >= 1.0:
+                    lines.extend(self._close_window(record[1]))
+                line = self._format(record)
+                if line is not None:
+                    lines.append(line)
+
+            now = time.time()
+            if now - self._window_start >= 1.0:
+                lines.extend(self._close_window(now))
+
+            if lines:
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass  # Nowhere left to log to, e.g. stdout closed at exit
+
+    def _format(self, record: tuple) -> str | None:
+        _, timestamp, level, fmt, args = record
+        repeats = self._window_repeats.get(fmt, 0)
+        if self._window_lines >= self.max_lines_per_second or (
+            repeats >= self.max_repeats_per_second
+        ):
+            self.suppressed_count += 1
+            self._window_suppressed[fmt] = self._window_suppressed.get(fmt, 0) + 1
+            return None
+        self._window_repeats[fmt] = repeats + 1
+        self._window_lines += 1
+
+        try:
+            message = fmt % args if args else fmt
+        except (TypeError, ValueError) as e:
+            message = f"{fmt!r} {args!r} (bad log arguments: {e})"
+        clock = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        return f"{clock}.{int(timestamp * 1000) % 1000:03d} {LEVEL_NAMES.get(level, level)} {message}"
+
+    def _close_window(self, window_start: float) -> list[str]:
+        """Summarize what the rate limits dropped in the window that just ended."""
+        summary = [
+            f"[ring_log] suppressed {count} x {fmt!r}"
+            for fmt, count in self._window_suppressed.items()
+        ]
+        self._window_lines = 0
+        self._window_repeats.clear()
+        self._window_suppressed.clear()
+        self._window_start = window_start
+        return summary
+
+
+# Process-wide logger for the control pipeline
+log = RingLogger()
@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+from .arduino_communication import get_arduino_serial_interface
+from .async_control_receiver import bind_control_socket, run_async_udp_control_receiver
+from .clock_sync import ClockSync, start_clock_sync_client
+from .control_frame_ring import ControlFrameRing
+from .headset_location import get_headset_location
+from .ring_log import log
+from .udp_control_receiver import KEEPALIVE_MESSAGE, get_remote_address
+
+
+class StartupTimeline:
+    """
+    When each startup stage began and finished, in ms since the timeline was created.
+
+    Stages that run concurrently overlap in the report, so it shows which one the
+    control loop actually waited on.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages: dict[str, tuple[float, float, bool]] = {}  # name -> (start, end, ok)
+
+    def _now_ms(self) -> float:
+        return (time.perf_counter() - self.origin) * 1000
+
+    def _finish(self, name: str, start_ms: float, ok: bool):
+        end_ms = self._now_ms()
+        self.stages[name] = (start_ms, end_ms, ok)
+        status = "done" if ok else "FAILED"
+        print(f"Startup: {name} {status} at +{end_ms:.0f}ms (took {end_ms - start_ms:.0f}ms)")
+
+    def run(self, name: str, func, *args):
+        """Run a quick stage inline."""
+        start_ms = self._now_ms()
+        try:
+            result = func(*args)
+        except Exception:
+            self._finish(name, start_ms, False)
+            raise
+        self._finish(name, start_ms, True)
+        return result
+
+    async def run_in_thread(self, name: str, func, *args):
+        """Run a blocking stage on the default executor, so other stages can proceed."""
+        start_ms = self._now_ms()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, func, *args)
+        except Exception:
+            self._finish(name, start_ms, False)
+            raise
+        self._finish(name, start_ms, result is not None)
+        return result
+
+    def mark(self, name: str):
+        """Record an instant, such as the first command arriving."""
+        now_ms = self._now_ms()
+        self.stages[name] = (now_ms, now_ms, True)
+
+    def report(self):
+        print("Startup timeline:")
+        for name, (start_ms, end_ms, ok) in sorted(self.stages.items(), key=lambda item: item[1]):
+            status = "" if ok else "  FAILED"
+            print(f"  {name:<14} +{start_ms:7.0f}ms -> +{end_ms:7.0f}ms{status}")
+
+
+async def run_clock_sync_stage(timeline: StartupTimeline, clock_sync: ClockSync):
+    # The UDP ClockSync in the control loop keeps the offset up to date, so this
+    # handshake with the headset no longer has to finish before commands flow
+    try:
+        result = await timeline.run_in_thread("clock_sync", start_clock_sync_client)
+    except Exception as e:
+        log.error("TCP clock sync failed: %s", e)
+        return
+    if result is None:
+        return
+    print(f"Clock sync cycles: {result}")
+    if result > 0:
+        # Until (unless) the headset answers the UDP SYNC requests
+        clock_sync.adopt_headset_sync()
+
+
+async def run_startup(
+    mac_test_environment: bool = False,
+    control_frames: ControlFrameRing | None = None,
+    predict_pose: bool = False,
+):
+    """
+    Bring the control loop up as fast as the slowest stage it really needs.
+
+    Serial port discovery and opening, the rendezvous and the socket bind all start
+    at once. The control loop waits only for the rendezvous and the socket; the
+    Arduino is attached when its port is ready, and the TCP clock sync runs
+    alongside.
+    """
+    timeline = StartupTimeline()
+
+    serial_ready = None
+    if not mac_test_environment:
+        serial_ready = asyncio.ensure_future(
+            timeline.run_in_thread("serial", get_arduino_serial_interface)
+        )
+    rendezvous = asyncio.ensure_future(timeline.run_in_thread("rendezvous", get_headset_location))
+    sock = timeline.run("socket", bind_control_socket)
+
+    headset_location = await rendezvous
+    if headset_location is None:
+        print("Failed to get headset server info")
+        sock.close()
+        if serial_ready is not None:
+            serial_ready.cancel()
+        return
+
+    # Open the NAT mapping before anything else needs it
+    remote_addr = get_remote_address(headset_location, mac_test_environment)
+    timeline.run("nat_punch", sock.sendto, KEEPALIVE_MESSAGE, remote_addr)
+
+    clock_sync = ClockSync()
+    clock_sync_task = asyncio.create_task(run_clock_sync_stage(timeline, clock_sync))
+
+    def on_first_command():
+        timeline.mark("first_command")
+        timeline.report()
+
+    timeline.mark("control_loop")
+    try:
+        await run_async_udp_control_receiver(
+            mac_test_environment,
+            control_frames,
+            predict_pose,
+            headset_location=headset_location,
+            sock=sock,
+            serial_ready=serial_ready,
+            on_first_command=on_first_command,
+            clock_sync=clock_sync,
+        )
+    finally:
+        clock_sync_task.cancel()
+
+
+def start(
+    mac_test_environment: bool = False,
+    control_frames: ControlFrameRing | None = None,
+    predict_pose: bool = False,
+):
+    asyncio.run(run_startup(mac_test_environment, control_frames, predict_pose))
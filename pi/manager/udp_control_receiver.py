@@ -4,11 +4,28 @@ import struct
 import threading
 import time
 
+import numpy as np
+
 from manager.constants import CONTROL_STREAM_PORT
 
-from .arduino_communication import (get_arduino_serial_interface, read_from_arduino,
-                                    send_command_to_arduino)
+from .arduino_communication import (SerialCommandWriter, get_arduino_serial_interface,
+                                    read_from_arduino)
+from .checksum import calculate_checksum, validate_control_batch
+from .clock_sync import SYNC_REPLY, ClockSync, is_sync_reply
+from .compact_packets import (COMPACT_CONTROL_MARKER, COMPACT_CONTROL_MAX_SIZE,
+                              decode_compact_control)
+from .control_redundancy import recover_missing_frames
+from .control_frame_ring import (FIELD_PITCH, FIELD_STEERING, FIELD_THROTTLE, FIELD_YAW,
+                                 HALF_SEQ_RANGE, SEQ_MODULUS, ControlFrameRing,
+                                 seq_distance)
+from .datagram_batch import DatagramBatch
+from .metrics import (COUNTER_CONTROL_PACKETS, COUNTER_FRAMES_RECOVERED, COUNTER_INVALID_PACKETS,
+                      COUNTER_SEQ_GAPS, COUNTER_STALE_DROPS, STAGE_NETWORK_LAG, STAGE_PARSE,
+                      MetricsReporter, metrics)
 from .headset_location import get_headset_location
+from .link_quality import LinkQualityMonitor
+from .pose_prediction import PosePredictor
+from .ring_log import log
 
 # UDP settings
 LOCAL_IP = "0.0.0.0"  # Bind to all interfaces
@@ -31,35 +48,268 @@ HEADER_SIZE = sum(
     ]
 )
 
+CONTROL_HEADER = struct.Struct(">IHQ")
+
+# Payload: pitch, yaw, throttle, steering (big-endian floats)
+CONTROL_PAYLOAD = struct.Struct(">ffff")
+PAYLOAD_SIZE = CONTROL_PAYLOAD.size
 
-def calculate_checksum(data: bytes) -> int:
-    """Calculate a 16-bit checksum by summing the bytes of the payload."""
-    return sum(data) & 0xFFFF  # Mask to 16 bits
+# Packets older than this (headset timestamp -> receive) are dropped. Once the
+# clock sync has converged, ClockSync.stale_threshold_ms() tightens it.
+STALE_PACKET_THRESHOLD_MS = 500
 
 
 def send_keepalive(sock: socket.socket, addr: tuple[str, int]):
     """Send a keepalive packet to maintain the NAT mapping."""
     _ = sock.sendto(KEEPALIVE_MESSAGE, addr)
-    print(f"Sent keepalive to {addr[0]}:{addr[1]}")
-
-
-def start_udp_control_receiver(mac_test_environment: bool = False):
+    log.debug("Sent keepalive to %s:%d", addr[0], addr[1])
+
+
+def get_remote_address(
+    headset_location: dict[str, str], mac_test_environment: bool = False
+) -> tuple[str, int]:
+    """Address the keepalives and telemetry are sent to."""
+    if mac_test_environment:
+        return ("172.16.226.154", CONTROL_STREAM_PORT)
+    return (headset_location["server_ip"], CONTROL_STREAM_PORT)
+
+
+def decode_control_header(
+    buffer: bytes | bytearray | memoryview, offset: int = 0, length: int | None = None
+) -> tuple[int, int] | None:
+    """
+    Validate the control packet stored at buffer[offset:offset + length].
+
+    Returns (seq, timestamp_ms), or None if the packet is malformed or fails the
+    checksum. The payload is left in place for CONTROL_PAYLOAD.unpack_from.
+    """
+    if length is None:
+        length = len(buffer) - offset
+
+    # Check if packet has enough data for header and payload
+    if length < HEADER_SIZE + PAYLOAD_SIZE:
+        log.warning("Received packet too short, skipping")
+        metrics.increment(COUNTER_INVALID_PACKETS)
+        return None
+
+    # Extract sequence number and checksum from header
+    # I - unsigned int (4 bytes) (sequence number)
+    # H - unsigned short (2 bytes) (checksum)
+    # Q - unsigned long long (8 bytes) (timestamp)
+    seq, received_checksum, timestamp_ms = CONTROL_HEADER.unpack_from(buffer, offset)
+
+    # Verify checksum
+    calc_checksum = calculate_checksum(
+        memoryview(buffer)[offset + HEADER_SIZE : offset + length]
+    )
+    if calc_checksum != received_checksum:
+        log.warning(
+            "Checksum mismatch for seq %d: %d != %d", seq, received_checksum, calc_checksum
+        )
+        metrics.increment(COUNTER_INVALID_PACKETS)
+        return None
+
+    return seq, timestamp_ms
+
+
+def take_sync_replies(batch: DatagramBatch, count: int, clock_sync: ClockSync) -> int:
+    """Hand clock sync replies in the batch to `clock_sync` and blank their slots."""
+    taken = 0
+    for i in range(count):
+        if batch.lengths[i] != SYNC_REPLY.size:
+            continue
+        start = i * batch.slot_size
+        packet = batch.view[start : start + SYNC_REPLY.size]
+        if is_sync_reply(packet):
+            clock_sync.handle_reply(packet)
+            batch.lengths[i] = 0
+            taken += 1
+    return taken
+
+
+def expand_compact_packets(batch: DatagramBatch, count: int, reference_ms: float) -> int:
+    """
+    Rewrite compact control packets in the batch into the regular layout in place, so
+    the rest of the pipeline only deals with one format. Returns how many were valid.
+
+    `reference_ms` is the current time on the headset's clock.
+    """
+    expanded = 0
+    for i in range(count):
+        length = batch.lengths[i]
+        start = i * batch.slot_size
+        if length > COMPACT_CONTROL_MAX_SIZE or batch.buffer[start] != COMPACT_CONTROL_MARKER:
+            continue
+        frame = decode_compact_control(batch.view[start : start + length], reference_ms)
+        if frame is None:
+            continue  # Too short for a regular packet, so it is dropped as invalid
+        expanded += 1
+        seq, timestamp_ms, pitch, yaw, throttle, steering = frame
+        CONTROL_PAYLOAD.pack_into(
+            batch.buffer, start + HEADER_SIZE, pitch, yaw, throttle, steering
+        )
+        checksum = calculate_checksum(
+            batch.view[start + HEADER_SIZE : start + HEADER_SIZE + PAYLOAD_SIZE]
+        )
+        CONTROL_HEADER.pack_into(batch.buffer, start, seq, checksum, timestamp_ms)
+        batch.lengths[i] = HEADER_SIZE + PAYLOAD_SIZE
+    return expanded
+
+
+def ingest_control_batch(
+    batch: DatagramBatch,
+    count: int,
+    control_frames: ControlFrameRing,
+    clock_sync: ClockSync | None = None,
+    link_quality: LinkQualityMonitor | None = None,
+) -> float | None:
+    """
+    Validate the `count` packets received into `batch` and push the newest fresh one
+    into `control_frames`. Clock sync replies are passed on to `clock_sync`, and every
+    valid packet, stale or not, is counted by `link_quality`.
+
+    Returns the time lag (ms) of the pushed frame, or None if nothing newer arrived.
+    """
+    parse_start = time.perf_counter()
+
+    # Headset timestamps are converted to our clock before judging their age
+    clock_offset_ms = 0.0
+    stale_threshold_ms = STALE_PACKET_THRESHOLD_MS
+    sync_reply_count = 0
+    if clock_sync is not None:
+        clock_offset_ms = clock_sync.offset_ms()
+        stale_threshold_ms = clock_sync.stale_threshold_ms(STALE_PACKET_THRESHOLD_MS)
+        sync_reply_count = take_sync_replies(batch, count, clock_sync)
+        if sync_reply_count == count:
+            return None
+
+    newest_offset = -1
+    if count == 1:
+        # Common case: a single packet, validate it directly
+        if batch.lengths[0] == 0:
+            log.warning("Received packet too large for the batch ring, skipping")
+            return None
+        header = decode_control_header(batch.buffer, 0, batch.lengths[0])
+        if header is None:
+            return None
+        seq, timestamp_ms = header
+        metrics.increment(COUNTER_CONTROL_PACKETS)
+
+        time_lag_ms = (time.time() * 1000) - timestamp_ms + clock_offset_ms
+        if link_quality is not None:
+            link_quality.record(seq, time_lag_ms)
+
+        # Check if timestamp is too old
+        if time_lag_ms > stale_threshold_ms:
+            log.warning("Packet too old, seq %d - Time lag: %.1fms", seq, time_lag_ms)
+            metrics.increment(COUNTER_STALE_DROPS)
+            return None
+
+        newest_offset = 0
+        newest_length = batch.lengths[0]
+        received_seqs = {seq}
+    else:
+        # Burst: validate every packet in one vectorized pass
+        seqs, timestamps_ms, valid = validate_control_batch(
+            batch.buffer, count, batch.slot_size, batch.lengths, HEADER_SIZE, PAYLOAD_SIZE
+        )
+        time_lags_ms = (time.time() * 1000) - timestamps_ms + clock_offset_ms
+        fresh = valid & (time_lags_ms <= stale_threshold_ms)
+
+        valid_count = int(valid.sum())
+        fresh_count = int(fresh.sum())
+        invalid_count = count - sync_reply_count - valid_count
+        stale_count = valid_count - fresh_count
+        metrics.increment(COUNTER_CONTROL_PACKETS, valid_count)
+        metrics.increment(COUNTER_INVALID_PACKETS, invalid_count)
+        metrics.increment(COUNTER_STALE_DROPS, stale_count)
+        if invalid_count or stale_count:
+            log.warning(
+                "Dropped %d invalid and %d stale packets out of a burst of %d",
+                invalid_count,
+                stale_count,
+                count,
+            )
+
+        if not valid.any():
+            return None
+
+        # Wrap-safe sequence distances to find the newest packets
+        reference = control_frames.latest_seq if len(control_frames) else int(seqs[valid][0])
+        distances = (seqs - reference + HALF_SEQ_RANGE) % SEQ_MODULUS - HALF_SEQ_RANGE
+        if link_quality is not None:
+            newest_valid = int(np.argmax(np.where(valid, distances, -SEQ_MODULUS)))
+            link_quality.record(
+                int(seqs[newest_valid]), float(time_lags_ms[newest_valid]), valid_count
+            )
+
+        if not fresh.any():
+            return None
+
+        newest = int(np.argmax(np.where(fresh, distances, -SEQ_MODULUS)))
+
+        seq = int(seqs[newest])
+        timestamp_ms = int(timestamps_ms[newest])
+        time_lag_ms = float(time_lags_ms[newest])
+        newest_offset = newest * batch.slot_size
+        newest_length = batch.lengths[newest]
+        received_seqs = set(seqs[fresh].tolist())
+
+    # Only the newest payload is decoded, before the ring is reused
+    pitch, yaw, throttle, steering = CONTROL_PAYLOAD.unpack_from(
+        batch.buffer, newest_offset + HEADER_SIZE
+    )
+    previous_seq = control_frames.latest_seq if len(control_frames) else None
+    if not control_frames.is_newer(seq, timestamp_ms):
+        return None
+
+    # Redundant packets carry the frames before them; fill in any we lost
+    recovered = recover_missing_frames(
+        batch.buffer, newest_offset, newest_length, seq, timestamp_ms, control_frames, received_seqs
+    )
+    control_frames.push(seq, timestamp_ms, pitch, yaw, throttle, steering)
+
+    if recovered:
+        metrics.increment(COUNTER_FRAMES_RECOVERED, recovered)
+    if previous_seq is not None:
+        # Sequence numbers skipped that weren't in this burst or recovered either
+        received_count = sum(1 for received in received_seqs if seq_distance(received, previous_seq) > 0)
+        missing = seq_distance(seq, previous_seq) - received_count - recovered
+        if missing > 0:
+            metrics.increment(COUNTER_SEQ_GAPS, missing)
+    metrics.record(STAGE_NETWORK_LAG, time_lag_ms / 1000)
+    metrics.record(STAGE_PARSE, time.perf_counter() - parse_start)
+    return time_lag_ms
+
+
+def start_udp_control_receiver(
+    mac_test_environment: bool = False,
+    control_frames: ControlFrameRing | None = None,
+    predict_pose: bool = False,
+):
     headset_location = get_headset_location()
     if headset_location is None:
         print("Failed to get headset server info in udp_control_receiver.py")
         return
 
-    REMOTE_IP = headset_location["server_ip"]
-    REMOTE_PORT = CONTROL_STREAM_PORT
+    REMOTE_IP, REMOTE_PORT = get_remote_address(headset_location, mac_test_environment)
 
+    command_writer = None
     if not mac_test_environment:
         arduino_serial_interface = get_arduino_serial_interface()
-    else:
-        REMOTE_IP = '127.0.0.1'
-        REMOTE_IP = '172.16.226.154'
-        HOST = '172.16.226.154'
+        command_writer = SerialCommandWriter(arduino_serial_interface)
+        command_writer.start()
+
+    forwarded_count = 0
 
-    arduino_sequence_number = 0
+    # Estimates the headset clock in the background, over the control socket
+    clock_sync = ClockSync()
+
+    # Optional: lead the turret by the network latency
+    pose_predictor = PosePredictor() if predict_pose else None
+
+    # Recommends a send rate to the headset from the measured loss, jitter and lag
+    link_quality = LinkQualityMonitor()
 
     # Create and configure the UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -72,18 +322,31 @@ def start_udp_control_receiver(mac_test_environment: bool = False):
 
     arduino_thread_flags = {
         "thread_enabled": True,
+        "compact_telemetry": False,
     }
 
     if not mac_test_environment:
         arduino_read_thread = threading.Thread(
             target=read_from_arduino,
-            args=(arduino_thread_flags, sock, arduino_serial_interface, (REMOTE_IP, REMOTE_PORT)),
+            args=(
+                arduino_thread_flags,
+                sock,
+                arduino_serial_interface,
+                (REMOTE_IP, REMOTE_PORT),
+                command_writer,
+            ),
         )
         arduino_read_thread.start()
 
-    # Variables to track the latest packet
-    latest_seq = -1  # Latest sequence number received
-    latest_packet = None  # Latest valid payload
+    metrics_reporter = MetricsReporter()
+    metrics_reporter.start()
+
+    # Burst datagrams are received into this preallocated ring
+    batch = DatagramBatch()
+
+    # History of accepted frames; the newest one is what we forward
+    if control_frames is None:
+        control_frames = ControlFrameRing()
 
     print(f"Listening for UDP packets on {LOCAL_IP}:{LOCAL_PORT}...")
     while True:
@@ -94,91 +357,68 @@ def start_udp_control_receiver(mac_test_environment: bool = False):
             send_keepalive(sock, (REMOTE_IP, REMOTE_PORT))
             last_keepalive_time = current_time
 
+        sync_request = clock_sync.poll()
+        if sync_request is not None:
+            _ = sock.sendto(sync_request, (REMOTE_IP, REMOTE_PORT))
+
+        rate_message = link_quality.poll()
+        if rate_message is not None:
+            _ = sock.sendto(rate_message, (REMOTE_IP, REMOTE_PORT))
+            if command_writer is not None:
+                command_writer.set_rate(link_quality.rate_hz)
+
         # Check for incoming packets with a short timeout
         readable, _, _ = select.select([sock], [], [], 0.01)  # 10ms timeout
         if readable:
             # Drain the socket buffer to find the latest packet
-            time_lag_ms = 0
+            time_lag_ms = None
             while True:
-                try:
-                    data, _ = sock.recvfrom(1024)  # Buffer size of 1024 bytes
-
-                    # Check if packet has enough data for header
-                    if len(data) < HEADER_SIZE:
-                        print("Received packet too short, skipping")
-                        continue
-
-                    # Extract sequence number and checksum from header
-                    # I - unsigned int (4 bytes) (sequence number)
-                    # H - unsigned short (2 bytes) (checksum)
-                    # Q - unsigned long long (8 bytes) (timestamp)
-                    try:
-                        seq, received_checksum, timestamp_ms = struct.unpack(
-                            ">IHQ", data[:HEADER_SIZE]
-                        )
-                    except struct.error:
-                        print("Failed to unpack header data")
-                        continue
-                    payload = data[HEADER_SIZE:]
-
-                    # Verify checksum
-                    calc_checksum = calculate_checksum(payload)
-                    if calc_checksum != received_checksum:
-                        print(
-                            f"Checksum mismatch for seq {seq}: {received_checksum} != {calc_checksum}"
-                        )
-                        continue
-
-                    failure_threshold = 500
-                    time_lag_ms = (time.time() * 1000) - timestamp_ms
-
-                    # Check if timestamp is too old
-                    timeout_failure = time_lag_ms > failure_threshold
-                    if timeout_failure:
-                        print(f"Packet too old, seq {seq} - Time lag: {time_lag_ms}ms")
-                        continue
-
-                    # Update if this packet is newer
-                    if seq > latest_seq:
-                        latest_seq = seq
-                        latest_packet = payload
-
-                except BlockingIOError:
+                count = batch.receive(sock)
+                if count == 0:
                     # No more packets to read, exit the inner loop
                     break
 
-            # Process the latest packet if one was found
-            if latest_packet:
-                # print(
-                #     f"processing - Seq: {int(latest_seq):05d}, Data: {latest_packet.hex()}"
-                # )
-                # if latest_seq % 1000 == 0:
-                #     print(
-                #         f"processing - Seq: {int(latest_seq / 1000):05d}, Data: {latest_packet.hex()}"
-                #     )
-
-                pitch, yaw, throttle, steering = struct.unpack(">ffff", latest_packet)
-
-                if arduino_sequence_number % 100 == 0:
-                    print(
-                        f"processing - Seq: {int(latest_seq):05d}, lag: {time_lag_ms:.2f}ms p: {pitch:.2f}, y: {yaw:.2f}, t: {throttle:.2f}, s: {steering:.2f}"
-                    )
+                if expand_compact_packets(batch, count, clock_sync.headset_time_ms()):
+                    # Answer in the compact telemetry format from now on
+                    arduino_thread_flags["compact_telemetry"] = True
+
+                batch_lag_ms = ingest_control_batch(
+                    batch, count, control_frames, clock_sync, link_quality
+                )
+                if batch_lag_ms is not None:
+                    time_lag_ms = batch_lag_ms
 
-                if not mac_test_environment:
-                    # Send the command to the Arduino
-                    send_command_to_arduino(
-                        arduino_serial_interface,
-                        arduino_sequence_number,
+            # Process the latest packet if one was found
+            if time_lag_ms is not None:
+                latest_seq = control_frames.latest_seq
+                pitch = control_frames.get(FIELD_PITCH)
+                yaw = control_frames.get(FIELD_YAW)
+                throttle = control_frames.get(FIELD_THROTTLE)
+                steering = control_frames.get(FIELD_STEERING)
+
+                if pose_predictor is not None and clock_sync.synced:
+                    # The lag is only a true one-way latency once the clocks are synced
+                    pitch, yaw = pose_predictor.predict(control_frames, time_lag_ms)
+
+                if forwarded_count % 100 == 0:
+                    log.info(
+                        "processing - Seq: %05d, lag: %.2fms p: %.2f, y: %.2f, t: %.2f, s: %.2f",
+                        latest_seq,
+                        time_lag_ms,
                         pitch,
                         yaw,
                         throttle,
                         steering,
                     )
-                arduino_sequence_number = (arduino_sequence_number + 1) % 256
 
-                latest_packet = None  # Reset for the next cycle
+                if command_writer is not None:
+                    # Hand the command to the serial writer thread
+                    command_writer.submit(pitch, yaw, throttle, steering)
+                forwarded_count += 1
 
-    if not mac_test_environment:
+    metrics_reporter.stop()
+    if command_writer is not None:
+        command_writer.stop()
         arduino_thread_flags["thread_enabled"] = False
         arduino_read_thread.join()
         arduino_serial_interface.close()
@@ -1,20 +1,135 @@
-from functools import wraps
+from collections.abc import Callable
+from functools import update_wrapper
+import json
+import os
 import socket
+import threading
+import time
+from typing import Generic, TypeVar
 
+from .ring_log import log
 
-def cache_if_not_none(func):
-    cache = {}
+# Cached results survive restarts of the control process in here
+CACHE_DIR = os.environ.get("FPV_CACHE_DIR", os.path.expanduser("~/.cache/fpv_robot"))
 
-    @wraps(func)
-    def wrapper(*args):
-        if args in cache:
-            return cache[args]
-        result = func(*args)
+R = TypeVar("R")
+
+
+class PersistentCache(Generic[R]):
+    """
+    A function whose results are cached in memory and in CACHE_DIR/<name>.json; see
+    persistent_cache().
+    """
+
+    def __init__(self, func: Callable[..., R], name: str, ttl: float, max_stale: float):
+        update_wrapper(self, func)
+        self.func = func
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.path = os.path.join(CACHE_DIR, f"{name}.json")
+        self._lock = threading.Lock()
+        self._refreshing: set[str] = set()
+        # Bumped by invalidate(), so a call that started before it can't store its result
+        self._generation = 0
+        self._entries = self._load()  # repr(args) -> {"value": ..., "stored_at": unix seconds}
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Write then rename, so a crash never leaves a half-written cache behind
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Failed to write cache %s: %s", self.path, e)
+
+    def _store(self, key: str, args: tuple, started_generation: int) -> R:
+        result = self.func(*args)
         if result is not None:
-            cache[args] = result
+            with self._lock:
+                if self._generation == started_generation:
+                    self._entries[key] = {"value": result, "stored_at": time.time()}
+                    self._save()
         return result
 
-    return wrapper
+    def _refresh(self, key: str, args: tuple, started_generation: int):
+        try:
+            _ = self._store(key, args, started_generation)
+        except Exception as e:
+            log.warning("Background refresh of %s failed: %s", self.name, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def __call__(self, *args) -> R:
+        key = repr(args)
+        with self._lock:
+            started_generation = self._generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.time() - entry["stored_at"]
+                if 0 <= age < self.ttl:
+                    return entry["value"]
+                if 0 <= age < self.ttl + self.max_stale:
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(
+                            target=self._refresh, args=(key, args, started_generation), daemon=True
+                        ).start()
+                    return entry["value"]
+        return self._store(key, args, started_generation)
+
+    def invalidate(self):
+        """Forget every result, including those of calls and refreshes still in flight."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def persistent_cache(
+    name: str, ttl: float, max_stale: float
+) -> Callable[[Callable[..., R]], PersistentCache[R]]:
+    """
+    Cache a function's non-None, JSON-serializable results in memory and in
+    CACHE_DIR/<name>.json.
+
+    A result younger than `ttl` seconds is returned as is. One up to `max_stale`
+    seconds past that is still returned right away, but refreshed in a background
+    thread (stale-while-revalidate). Anything older, or missing, is computed in the
+    caller. `.invalidate()` on the decorated function forgets every result, for when
+    one turns out wrong, including those of calls and refreshes still in flight.
+    """
+
+    def decorator(func: Callable[..., R]) -> PersistentCache[R]:
+        return PersistentCache(func, name, ttl, max_stale)
+
+    return decorator
+
+
+# Below this, sleep() tends to overshoot, so the rest of the wait is spent spinning
+SPIN_THRESHOLD = 0.001  # Seconds
+
+
+def sleep_until(deadline: float):
+    """Wait until time.perf_counter() reaches `deadline`, to within a few microseconds."""
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_THRESHOLD:
+        time.sleep(remaining - SPIN_THRESHOLD)
+    while time.perf_counter() < deadline:
+        pass
 
 
 def recv_all(sock: socket.socket, length: int) -> bytes:
@@ -26,3 +141,37 @@ def recv_all(sock: socket.socket, length: int) -> bytes:
         data += more
     return data
 
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, with bursts of up to `burst` events.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, rate: float):
+        self._refill(time.monotonic())
+        self.rate = rate
+
+    def try_take(self, now: float | None = None) -> bool:
+        """Take a token if one is available."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def time_until_available(self, now: float | None = None) -> float:
+        """Seconds until try_take() will succeed."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
@@ -0,0 +1,291 @@
+# Emulates the serial side of stepper/stepper.ino on a pseudo-terminal, so the full
+# receive -> serial path can run without a Nano Every:
+#
+#   python -m manager.virtual_arduino --telemetry-rate 10 --corrupt 0.001
+#   ARDUINO_PORT=/dev/pts/N python -m manager.async_control_receiver
+import argparse
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from .arduino_communication import (ARDUINO_BAUD_RATE, BAUD_COMMIT_TIMEOUT, CANDIDATE_BAUD_RATES,
+                                     COMMAND_FRAME, LINK_BAUD_ACK, LINK_COMMIT_BAUD,
+                                     LINK_FRAME, LINK_PING, LINK_PONG, LINK_SET_BAUD,
+                                     TELEMETRY_FRAME)
+from .checksum import xor_checksum
+
+# The firmware sends telemetry every 1000 loop() iterations
+DEFAULT_TELEMETRY_RATE_HZ = 10
+# Outputs go neutral when no command arrived for this long, as in the firmware
+FAILSAFE_TIMEOUT = 0.4  # Seconds
+BITS_PER_BYTE = 10  # 8N1: start bit, 8 data bits, stop bit
+MAX_SPEED_MPH = 15.0  # Simulated speed at full throttle
+SIMULATED_LIPO_PERCENTAGE = 87
+SIMULATED_NIMH_PERCENTAGE = 64
+
+_HEADER = struct.Struct("<I")
+
+
+class VirtualArduino:
+    """
+    A pty that behaves like the car's Arduino.
+
+    Bytes are parsed one at a time with the firmware's state machine: the same header
+    resync, checksum and sequence rules for command frames, and answers to link pings
+    and baud negotiation (including falling back if a new rate is never committed).
+    Telemetry is sent at `telemetry_rate_hz`, with a speed that follows the throttle.
+
+    With `emulate_baud`, bytes in both directions take as long as they would at the
+    negotiated baud rate. `corrupt_rate` and `drop_rate` are per-byte probabilities of
+    a flipped bit or a lost byte, applied in both directions.
+
+    `on_command(sequence_number, pitch, yaw, throttle, steering)` is called from the
+    emulator thread for every command the firmware would act on.
+    """
+
+    def __init__(
+        self,
+        telemetry_rate_hz: float = DEFAULT_TELEMETRY_RATE_HZ,
+        emulate_baud: bool = True,
+        corrupt_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int | None = None,
+        on_command=None,
+    ):
+        self.telemetry_rate_hz = telemetry_rate_hz
+        self.emulate_baud = emulate_baud
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.on_command = on_command
+        self.random = random.Random(seed)
+
+        self.master_fd, self._slave_fd = pty.openpty()
+        # Raw mode, so the line discipline never rewrites the binary frames
+        tty.setraw(self._slave_fd)
+        # Holding the slave open keeps the master usable while the Pi side reconnects
+        self.port = os.ttyname(self._slave_fd)
+
+        self.baud_rate = ARDUINO_BAUD_RATE
+        self.baud_commit_deadline: float | None = None
+
+        # Firmware receive state
+        self.serial_buffer = bytearray(COMMAND_FRAME.size)
+        self.serial_buffer_index = 0
+        self.expected_frame_size = COMMAND_FRAME.size
+        self.expected_sequence_number = 0
+        self.link_sequence_number = 0
+        self.telemetry_sequence_number = 0
+
+        # Simulated car
+        self.last_command: tuple[float, float, float, float] | None = None
+        self.last_command_time = 0.0
+        self.distance_ft = 0.0
+
+        self.commands_received = 0
+        self.checksum_errors = 0
+        self.sequence_errors = 0
+        self.telemetry_sent = 0
+        self.bytes_corrupted = 0
+        self.bytes_dropped = 0
+
+        self._running = False
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master_fd)
+        os.close(self._slave_fd)
+
+    @property
+    def failsafe_active(self) -> bool:
+        """True while the outputs would be held at neutral."""
+        return time.monotonic() - self.last_command_time > FAILSAFE_TIMEOUT
+
+    def _byte_time(self, count: int) -> float:
+        return count * BITS_PER_BYTE / self.baud_rate if self.emulate_baud else 0.0
+
+    def _impair(self, data: bytes | bytearray) -> bytes | bytearray:
+        """Apply the configured line noise to bytes crossing the link."""
+        if not (self.corrupt_rate or self.drop_rate):
+            return data
+        out = bytearray()
+        for b in data:
+            if self.random.random() < self.drop_rate:
+                self.bytes_dropped += 1
+                continue
+            if self.random.random() < self.corrupt_rate:
+                b ^= 1 << self.random.randrange(8)
+                self.bytes_corrupted += 1
+            out.append(b)
+        return bytes(out)
+
+    def _write(self, frame: bytes | bytearray):
+        time.sleep(self._byte_time(len(frame)))
+        os.write(self.master_fd, self._impair(frame))
+
+    def _send_link_frame(self, operation: int, value: int):
+        frame = bytearray(LINK_FRAME.size)
+        LINK_FRAME.pack_into(frame, self.link_sequence_number, operation, value)
+        self.link_sequence_number = (self.link_sequence_number + 1) % 256
+        self._write(frame)
+
+    def _send_telemetry(self):
+        throttle = 0.0 if self.failsafe_active or self.last_command is None else self.last_command[2]
+        speed_mph = max(throttle, 0.0) * MAX_SPEED_MPH
+        self.distance_ft += speed_mph * 5280 / 3600 / self.telemetry_rate_hz
+        frame = bytearray(TELEMETRY_FRAME.size)
+        TELEMETRY_FRAME.pack_into(
+            frame,
+            self.telemetry_sequence_number,
+            speed_mph,
+            self.distance_ft,
+            SIMULATED_LIPO_PERCENTAGE,
+            SIMULATED_NIMH_PERCENTAGE,
+        )
+        self.telemetry_sequence_number = (self.telemetry_sequence_number + 1) % 256
+        self.telemetry_sent += 1
+        self._write(frame)
+
+    def _handle_link_frame(self):
+        size = LINK_FRAME.size
+        if xor_checksum(self.serial_buffer[: size - 1]) != self.serial_buffer[size - 1]:
+            self.checksum_errors += 1
+            return
+        _, _, operation, value = LINK_FRAME.layout.unpack_from(self.serial_buffer)
+
+        if operation == LINK_PING:
+            self._send_link_frame(LINK_PONG, value)
+        elif operation == LINK_SET_BAUD and value in CANDIDATE_BAUD_RATES + (ARDUINO_BAUD_RATE,):
+            self._send_link_frame(LINK_BAUD_ACK, value)
+            self.baud_rate = value
+            self.baud_commit_deadline = time.monotonic() + BAUD_COMMIT_TIMEOUT
+        elif operation == LINK_COMMIT_BAUD and self.baud_commit_deadline is not None:
+            self.baud_commit_deadline = None
+            self._send_link_frame(LINK_BAUD_ACK, value)
+
+    def _handle_command_frame(self):
+        size = COMMAND_FRAME.size
+        if xor_checksum(self.serial_buffer[: size - 1]) != self.serial_buffer[size - 1]:
+            self.checksum_errors += 1
+            return
+        _, sequence_number, pitch, yaw, throttle, steering = COMMAND_FRAME.layout.unpack_from(
+            self.serial_buffer
+        )
+        if sequence_number != self.expected_sequence_number:
+            # The firmware skips the frame and resynchronizes on the next one
+            self.sequence_errors += 1
+            self.expected_sequence_number = (sequence_number + 1) % 256
+            return
+        self.expected_sequence_number = (self.expected_sequence_number + 1) % 256
+
+        self.commands_received += 1
+        self.last_command = (pitch, yaw, throttle, steering)
+        self.last_command_time = time.monotonic()
+        if self.on_command is not None:
+            self.on_command(sequence_number, pitch, yaw, throttle, steering)
+
+    def feed(self, data: bytes | bytearray):
+        """Run received bytes through the firmware's loop(), one byte per iteration."""
+        buffer = self.serial_buffer
+        for b in data:
+            if self.serial_buffer_index < COMMAND_FRAME.size:
+                buffer[self.serial_buffer_index] = b
+                self.serial_buffer_index += 1
+
+            if self.serial_buffer_index == 4:
+                header = _HEADER.unpack_from(buffer)[0]
+                if header == COMMAND_FRAME.header:
+                    self.expected_frame_size = COMMAND_FRAME.size
+                elif header == LINK_FRAME.header:
+                    self.expected_frame_size = LINK_FRAME.size
+                else:
+                    # Drop the first byte; only the header bytes are in the buffer yet
+                    buffer[0:3] = buffer[1:4]
+                    self.serial_buffer_index -= 1
+
+            if (
+                self.expected_frame_size == LINK_FRAME.size
+                and self.serial_buffer_index == LINK_FRAME.size
+            ):
+                self._handle_link_frame()
+                self.serial_buffer_index = 0
+            elif self.serial_buffer_index == COMMAND_FRAME.size:
+                self._handle_command_frame()
+                self.serial_buffer_index = 0
+
+    def _run(self):
+        telemetry_interval = 1.0 / self.telemetry_rate_hz if self.telemetry_rate_hz > 0 else None
+        next_telemetry = time.monotonic()
+        while self._running:
+            now = time.monotonic()
+            if self.baud_commit_deadline is not None and now > self.baud_commit_deadline:
+                self.baud_commit_deadline = None
+                self.baud_rate = ARDUINO_BAUD_RATE
+            if telemetry_interval is not None and now >= next_telemetry:
+                self._send_telemetry()
+                next_telemetry = max(next_telemetry + telemetry_interval, now)
+
+            timeout = 0.05
+            if telemetry_interval is not None:
+                timeout = min(timeout, max(0.0, next_telemetry - time.monotonic()))
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                # Nobody has the port open right now
+                time.sleep(0.01)
+                continue
+            # Receiving takes as long as the bytes would need on the wire
+            time.sleep(self._byte_time(len(data)))
+            self.feed(self._impair(data))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulate the car's Arduino on a pty")
+    parser.add_argument("--telemetry-rate", type=float, default=DEFAULT_TELEMETRY_RATE_HZ,
+                        help="telemetry frames per second (0 to disable)")
+    parser.add_argument("--no-baud-delay", action="store_true",
+                        help="deliver bytes instantly instead of at the baud rate")
+    parser.add_argument("--corrupt", type=float, default=0.0,
+                        help="probability of a bit flip per byte")
+    parser.add_argument("--drop", type=float, default=0.0,
+                        help="probability of losing a byte")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    arduino = VirtualArduino(
+        args.telemetry_rate,
+        emulate_baud=not args.no_baud_delay,
+        corrupt_rate=args.corrupt,
+        drop_rate=args.drop,
+        seed=args.seed,
+    )
+    arduino.start()
+    print(f"Virtual Arduino on {arduino.port}")
+    print(f"Run the receiver with ARDUINO_PORT={arduino.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(
+                f"commands: {arduino.commands_received}, checksum errors: {arduino.checksum_errors}, "
+                f"sequence errors: {arduino.sequence_errors}, telemetry: {arduino.telemetry_sent}, "
+                f"baud: {arduino.baud_rate}"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        arduino.stop()
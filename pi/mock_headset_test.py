@@ -12,19 +12,42 @@
 # The headset can now stream control messages to the pi
 
 # Create a TCP socket for the clock sync
+import argparse
 import select
 import socket
 import struct
 import time
+from collections import deque
 
 from pynput import keyboard
 
+from manager.clock_sync import is_sync_request, make_sync_reply, wall_clock_us
+from manager.compact_packets import (decode_compact_telemetry, encode_compact_control,
+                                     is_compact_telemetry)
 from manager.constants import CLOCK_SYNC_PORT, CONTROL_STREAM_PORT
+from manager.control_redundancy import MAX_REDUNDANT_FRAMES, pack_control_packet
 from manager.headset_location import set_headset_location
+from manager.link_quality import is_rate_message, unpack_rate_message
+from manager.ring_log import log
 from manager.utils import recv_all
 
 TELEMETRY_PACKET_SIZE = 16
 
+parser = argparse.ArgumentParser(description="Mock headset for testing the pi receivers")
+parser.add_argument(
+    "--redundancy",
+    type=int,
+    default=0,
+    choices=range(MAX_REDUNDANT_FRAMES + 1),
+    help="previous frames repeated in every control packet, so the pi can rebuild lost ones",
+)
+parser.add_argument(
+    "--compact",
+    action="store_true",
+    help="send control packets in the compact fixed-point format",
+)
+args = parser.parse_args()
+
 print("Setting headset location...")
 success = set_headset_location()
 if not success:
@@ -44,7 +67,8 @@ conn, addr = sock.accept()
 print(f"Accepted connection from {addr}")
 
 
-timestamp_ms_offsets = []
+# (round trip, offset) of each exchange; the fastest round trip gives the best offset
+clock_samples = []
 
 for i in range(10):
     before_timestamp_ms = int(time.time() * 1000)
@@ -72,20 +96,22 @@ for i in range(10):
         f"diff_1: {remote_timestamp_ms - before_timestamp_ms} = {remote_timestamp_ms} - {before_timestamp_ms}"
     )
     print(
-        f"diff_2: {after_timestamp_ms - remote_timestamp_ms} = {after_timestamp_ms} - {remote_timestamp_ms}"
+        f"diff_2: {remote_timestamp_ms - after_timestamp_ms} = {remote_timestamp_ms} - {after_timestamp_ms}"
     )
 
+    # Both differences are pi minus headset time, so the round trip cancels out
     diff_1 = remote_timestamp_ms - before_timestamp_ms
-    diff_2 = after_timestamp_ms - remote_timestamp_ms
+    diff_2 = remote_timestamp_ms - after_timestamp_ms
 
     offset = (diff_1 + diff_2) / 2
-    timestamp_ms_offsets.append(offset)
+    clock_samples.append((after_timestamp_ms - before_timestamp_ms, offset))
 
 sock.close()
 
-avg_offset = int(sum(timestamp_ms_offsets) / len(timestamp_ms_offsets))
+best_rtt, best_offset = min(clock_samples)
+clock_offset_ms = int(best_offset)
 
-print(f"Average offset: {avg_offset} ms")
+print(f"Clock offset: {clock_offset_ms} ms (round trip {best_rtt} ms)")
 
 print("Opening UDP socket for control messages...")
 # Create a UDP socket for control messages
@@ -101,22 +127,13 @@ print(f"Received initial packet from {target_addr}, starting to send data.")
 
 udp_sock.setblocking(False)
 
-def calculate_checksum(data: bytes) -> int:
-    """
-    Calculate a simple 16-bit checksum by summing all bytes in the data.
-    The result is masked to 16 bits (0xFFFF).
-    """
-    return sum(data) & 0xFFFF
-
-
 def send_packet(
     sock: socket.socket,
     target_addr: tuple[str, int],
     seq: int,
-    payload: bytes,
-    steering_value: float,
-    throttle_value: float,
-):
+    values: tuple[float, float, float, float],
+    history: list[tuple[int, tuple[float, float, float, float]]],
+) -> int:
     """
     Send a UDP packet with sequence number, checksum, and payload.
 
@@ -124,15 +141,22 @@ def send_packet(
         sock: UDP socket object
         target_addr: Tuple of (target_ip, target_port)
         seq: Sequence number
-        payload: Byte string of the payload data
+        values: pitch, yaw, throttle, steering
+        history: (timestamp_ms, values) of previous frames, newest first, repeated
+            after the payload
+
+    Returns the packet timestamp.
     """
-    checksum = calculate_checksum(payload)
-    # Pack header: sequence number (1 byte), checksum (2 bytes), long (8 bytes) (big-endian)
-    # Payload: 4-byte float (big-endian)
-    header = struct.pack(">IHQ", seq, checksum, avg_offset + int(time.time() * 1000))
-    packet = header + payload
+    # Header: sequence number (4 bytes), checksum (2 bytes), timestamp (8 bytes) (big-endian)
+    # Payload: 4-byte floats (big-endian), then the redundant frames
+    timestamp_ms = clock_offset_ms + int(time.time() * 1000)
+    if args.compact:
+        packet = encode_compact_control(seq, timestamp_ms, *values)
+    else:
+        packet = pack_control_packet(seq, timestamp_ms, values, history)
     _ = sock.sendto(packet, target_addr)
-    print(f"sent - Seq: {int(seq):05d}, Payload: {steering_value}, {throttle_value}")
+    log.info("sent - Seq: %05d, Payload: %s, %s", seq, values[3], values[2])
+    return timestamp_ms
     # if seq % 1000 == 0:
     #     # Print the packet details every 1k packets
     #     print(f"sent - Seq: {int(seq / 1000):05d}, Payload: {payload.hex()}")
@@ -181,10 +205,18 @@ listener.start()  # Start the listener
 seq = 0  # Initialize sequence number
 counter = 0  # Initialize payload counter for simulation
 
+# Control packet rate, adjusted by the pi's rate recommendations
+send_interval = 0.01
+next_send_time = time.monotonic()
+
+# Frames repeated in the following packets
+sent_history = deque(maxlen=args.redundancy)
+
 # Send data packets continuously
 while True:
-    # Check if there is data to read from the socket
-    readable, _, _ = select.select([udp_sock], [], [], 0.01)  # 10ms timeout
+    # Check for incoming data until the next packet is due
+    timeout = max(0.0, next_send_time - time.monotonic())
+    readable, _, _ = select.select([udp_sock], [], [], timeout)
     if readable:
         latest_packet = None
 
@@ -193,9 +225,34 @@ while True:
             try:
                 data, _ = udp_sock.recvfrom(1024)  # Buffer size of 1024 bytes
 
+                # Answer clock sync requests in the clock control packets are stamped with
+                if is_sync_request(data):
+                    _ = udp_sock.sendto(
+                        make_sync_reply(data, wall_clock_us(), clock_offset_ms * 1000),
+                        target_addr,
+                    )
+                    continue
+
+                if is_rate_message(data):
+                    rate_hz, loss, jitter_ms = unpack_rate_message(data)
+                    if rate_hz > 0 and abs(1.0 / rate_hz - send_interval) > 1e-6:
+                        print(
+                            f"pi recommends {rate_hz} Hz (loss {loss * 100:.1f}%, jitter {jitter_ms:.1f}ms)"
+                        )
+                        send_interval = 1.0 / rate_hz
+                    continue
+
+                if is_compact_telemetry(data):
+                    telemetry = decode_compact_telemetry(data)
+                    if telemetry is None:
+                        log.warning("Compact telemetry checksum mismatch, skipping")
+                    else:
+                        latest_packet = telemetry
+                    continue
+
                 # Check if packet is
                 if len(data) != TELEMETRY_PACKET_SIZE:
-                    print("Received packet not the right size, skipping")
+                    log.warning("Received packet not the right size, skipping")
                     continue
 
                 try:
@@ -208,7 +265,7 @@ while True:
                         data
                     )
                 except struct.error:
-                    print("Failed to unpack telemetry data")
+                    log.warning("Failed to unpack telemetry data")
                     continue
             except BlockingIOError:
                 # No more packets to read, exit the inner loop
@@ -218,19 +275,22 @@ while True:
                 break
         if latest_packet:
             # Process the latest packet if one was found
-            print(
-                f"received - speed_mph: {latest_packet[0]}, distance_ft: {latest_packet[1]}, control_battery_percentage: {latest_packet[2]}, drive_battery_percentage: {latest_packet[3]}"
+            log.info(
+                "received - speed_mph: %s, distance_ft: %s, control_battery_percentage: %s, drive_battery_percentage: %s",
+                *latest_packet,
             )
 
+    if time.monotonic() < next_send_time:
+        continue
+
     # Simulate a control signal with a payload of 4 floats
-    payload = struct.pack(
-        ">ffff", float(counter / 10), 0.0, float(throttle), float(steering)
-    )
-    send_packet(udp_sock, target_addr, seq, payload, steering, throttle)
+    values = (float(counter / 10), 0.0, float(throttle), float(steering))
+    timestamp_ms = send_packet(udp_sock, target_addr, seq, values, list(sent_history))
+    sent_history.appendleft((timestamp_ms, values))
 
     # Increment sequence number
     seq = seq + 1
     counter += 1
 
-    # Control packet rate
-    time.sleep(0.01)
+    # Schedule the next packet, without trying to catch up after a stall
+    next_send_time = max(next_send_time + send_interval, time.monotonic())
@@ -2,14 +2,16 @@
 # Get the server_ip out of the json response store it in IP_ADDRESS
 LOCAL_IP=$(ifconfig | grep 'inet 192.168.' | awk '{print $2}' | cut -d/ -f1)
 echo "LOCAL_IP: $LOCAL_IP"
-PUBLIC_IP=$(curl -s https://api.ipify.org)
 
 # if no local ip then make one up
 if [ -z "$LOCAL_IP" ]; then
   LOCAL_IP="192.168.0.2"
 fi
 
-CONNECTION_SERVICE_URL="http://3.215.138.208:4337/client"
+# /client/wait holds the request until the headset registers (up to 25 s), and the
+# service fills in our public IP from the address it sees
+CONNECTION_SERVICE_URL="http://3.215.138.208:4337/client/wait"
+SESSION_ID="${FPV_SESSION_ID:-default}"
 
 # Example POST request
 # curl -X POST http://127.0.0.1:5000/client \
@@ -23,15 +25,15 @@ PORT=5253
 
 while true
 do
-  IP_ADDRESS=$(curl -s -X POST $CONNECTION_SERVICE_URL -H "Content-Type: application/json" -d "{\"client_local_ip\": \"$LOCAL_IP\", \"client_public_ip\": \"$PUBLIC_IP\"}" | jq -r '.server_ip')
+  IP_ADDRESS=$(curl -s --max-time 30 -X POST $CONNECTION_SERVICE_URL -H "Content-Type: application/json" -d "{\"session_id\": \"$SESSION_ID\", \"client_local_ip\": \"$LOCAL_IP\"}" | jq -r '.server_ip // empty')
 
   echo "IP_ADDRESS: $IP_ADDRESS"
   echo "PORT: $PORT"
 
-  # if no IP_ADDRESS then sleep for 5 seconds and try again
+  # if no IP_ADDRESS then the long poll timed out or failed, so ask again
   if [ -z "$IP_ADDRESS" ]; then
-    echo "No IP_ADDRESS found. Sleeping for 5 seconds..."
-    sleep 5
+    echo "No IP_ADDRESS found. Retrying..."
+    sleep 1
     continue
   fi
 
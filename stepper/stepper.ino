@@ -2,6 +2,18 @@
 #include <TMCStepper.h>
 #include "hall_effect_sensor.h"
 
+// Set to 1 to echo received commands and errors over Serial.
+// Leave at 0 when driving from the Pi, the extra text costs UART time.
+#define DEBUG_SERIAL 0
+
+#if DEBUG_SERIAL
+#define DEBUG_PRINT(x) Serial.print(x)
+#define DEBUG_PRINTLN(x) Serial.println(x)
+#else
+#define DEBUG_PRINT(x)
+#define DEBUG_PRINTLN(x)
+#endif
+
 HallSensor hallSensor(5, 10, 100000); // Pin 5, buffer size 10, valid window 100us
 
 #define dirPin 21
@@ -28,6 +40,8 @@ TMC2209Stepper yawDriver(&Serial1, R_sense, YAW_DRIVER_ADDRESS);
 const int MAX_STEPPER_SPEED = 3000;
 const int MAX_STEPPER_ACCELERATION = 10000;
 const int TMC2209_BAUD_RATE = 9600;
+// Rate the link to the Pi starts at, before the Pi negotiates a faster one
+const uint32_t DEFAULT_BAUD_RATE = 115200;
 const int MICROSTEPS = 4;
 
 int degrees_to_microsteps(float degrees) {
@@ -97,13 +111,13 @@ void update_stepper_angles(AccelStepper& pitch_stepper, float pitch_angle, Accel
 
     // If yaw limit is reached, do not write
     if (yaw_angle < -YAW_MAX_ANGLE || yaw_angle > YAW_MAX_ANGLE) {
-      Serial.println("Yaw limit reached");
+      DEBUG_PRINTLN("Yaw limit reached");
       return;
     }
 
     // If pitch limit is reached, do not write
     if (pitch_angle < -half_turn_pitch_angle || pitch_angle > half_turn_pitch_angle) {
-      Serial.println("Pitch limit reached");
+      DEBUG_PRINTLN("Pitch limit reached");
       return;
     }
 
@@ -213,7 +227,7 @@ void setup() {
   prepare_driver(yawDriver);
 
   // Start talking to command computer
-  Serial.begin(115200);
+  Serial.begin(DEFAULT_BAUD_RATE);
   while (!Serial) {
     ;
   }
@@ -284,6 +298,37 @@ void setup() {
 
 int loop_counter = 0;
 
+// Telemetry frame, mirroring the command frame:
+// 4 bytes for header (0xFEEDFACE),
+// 1 byte for sequence number,
+// 4 bytes for speed (mph),
+// 4 bytes for distance (ft),
+// 1 byte for lipo battery percentage,
+// 1 byte for nimh battery percentage,
+// 1 byte for checksum
+const int telemetry_frame_size = 16;
+const uint32_t TELEMETRY_HEADER = 0xFEEDFACE;
+uint8_t telemetry_sequence_number = 0;
+
+void send_telemetry(float speed, float distance_ft, uint8_t lipo_percentage, uint8_t nimh_percentage) {
+    byte frame[telemetry_frame_size];
+    memcpy(frame, &TELEMETRY_HEADER, 4);
+    frame[4] = telemetry_sequence_number;
+    memcpy(frame + 5, &speed, 4);
+    memcpy(frame + 9, &distance_ft, 4);
+    frame[13] = lipo_percentage;
+    frame[14] = nimh_percentage;
+
+    uint8_t checksum = 0;
+    for (int i = 0; i < telemetry_frame_size - 1; i++) {
+        checksum ^= frame[i];
+    }
+    frame[telemetry_frame_size - 1] = checksum;
+
+    Serial.write(frame, telemetry_frame_size);
+    telemetry_sequence_number++;
+}
+
 // 4 bytes for header, 
 // 1 byte for sequence number,
 // 4 bytes for pitch,
@@ -297,6 +342,84 @@ byte serial_buffer[buffer_size];
 int serial_buffer_index = 0;
 int32_t HEADER = 0xDEADBEEF;
 
+// Link management frame (ping and baud negotiation):
+// 4 bytes for header (0xCAFEBABE),
+// 1 byte for sequence number,
+// 1 byte for operation,
+// 4 bytes for value,
+// 1 byte for checksum
+const int link_frame_size = 11;
+const int32_t LINK_HEADER = 0xCAFEBABE;
+const uint8_t LINK_PING = 1;
+const uint8_t LINK_PONG = 2;
+const uint8_t LINK_SET_BAUD = 3;
+const uint8_t LINK_BAUD_ACK = 4;
+const uint8_t LINK_COMMIT_BAUD = 5;
+uint8_t link_sequence_number = 0;
+
+// Size of the frame currently being received, picked from its header
+int expected_frame_size = buffer_size;
+
+// A new baud rate has to be committed within this time, otherwise we go back
+// to the default rate so the Pi can always reach us again
+const unsigned long BAUD_COMMIT_TIMEOUT_MS = 1000;
+bool baud_commit_pending = false;
+unsigned long baud_switch_time = 0;
+
+bool is_supported_baud_rate(uint32_t baud_rate) {
+    return baud_rate == 1000000 || baud_rate == 500000 || baud_rate == 250000
+        || baud_rate == 230400 || baud_rate == DEFAULT_BAUD_RATE;
+}
+
+void switch_baud_rate(uint32_t baud_rate) {
+    Serial.flush();
+    Serial.end();
+    Serial.begin(baud_rate);
+}
+
+void send_link_frame(uint8_t operation, uint32_t value) {
+    byte frame[link_frame_size];
+    memcpy(frame, &LINK_HEADER, 4);
+    frame[4] = link_sequence_number++;
+    frame[5] = operation;
+    memcpy(frame + 6, &value, 4);
+
+    uint8_t checksum = 0;
+    for (int i = 0; i < link_frame_size - 1; i++) {
+        checksum ^= frame[i];
+    }
+    frame[link_frame_size - 1] = checksum;
+
+    Serial.write(frame, link_frame_size);
+}
+
+void handle_link_frame() {
+    uint8_t computed_checksum = 0;
+    for (int i = 0; i < link_frame_size - 1; i++) {
+        computed_checksum ^= serial_buffer[i];
+    }
+    if (computed_checksum != serial_buffer[link_frame_size - 1]) {
+        DEBUG_PRINTLN("Link checksum mismatch");
+        return;
+    }
+
+    uint8_t operation = serial_buffer[header_size + 1];
+    uint32_t value = 0;
+    memcpy(&value, serial_buffer + header_size + 2, 4);
+
+    if (operation == LINK_PING) {
+        send_link_frame(LINK_PONG, value);
+    } else if (operation == LINK_SET_BAUD && is_supported_baud_rate(value)) {
+        send_link_frame(LINK_BAUD_ACK, value);
+        switch_baud_rate(value);
+        baud_commit_pending = true;
+        baud_switch_time = millis();
+    } else if (operation == LINK_COMMIT_BAUD && baud_commit_pending) {
+        baud_commit_pending = false;
+        send_link_frame(LINK_BAUD_ACK, value);
+    }
+}
+
 unsigned long last_control_update = 0;
 uint8_t expected_sequence_number = 0;
 
@@ -324,15 +447,7 @@ void loop() {
         float distance = hallSensor.getDistance();
         float speed = hallSensor.getSpeed();
 
-        Serial.print("tel: ");
-        Serial.print(speed);
-        Serial.print(" ");
-        Serial.print(distance / 12.0f); // inches to feet
-        Serial.print(" ");
-        Serial.print(lipo_average_percentage);
-        Serial.print(" ");
-        Serial.print(nimh_average_percentage);
-        Serial.println();
+        send_telemetry(speed, distance / 12.0f, lipo_average_percentage, nimh_average_percentage); // inches to feet
     }
 
     loop_counter++;
@@ -348,11 +463,13 @@ void loop() {
         if (serial_buffer_index == 4) {
             int32_t header = 0;
             memcpy(&header, serial_buffer, 4);
-            if (header != HEADER) {
-                // Shift the buffer by 1 byte
-                for (int i = 0; i < buffer_size - 1; i++) {
-                    serial_buffer[i] = serial_buffer[i + 1];
-                }
+            if (header == HEADER) {
+                expected_frame_size = buffer_size;
+            } else if (header == LINK_HEADER) {
+                expected_frame_size = link_frame_size;
+            } else {
+                // Drop the first byte; only the header bytes are in the buffer yet
+                memmove(serial_buffer, serial_buffer + 1, header_size - 1);
                 serial_buffer_index--;
             }
         }
@@ -362,7 +479,10 @@ void loop() {
         float throttle_value = 0;
         float steering_value = 0;
 
-        if (serial_buffer_index == buffer_size) {
+        if (expected_frame_size == link_frame_size && serial_buffer_index == link_frame_size) {
+            handle_link_frame();
+            serial_buffer_index = 0;
+        } else if (serial_buffer_index == buffer_size) {
             uint8_t receieved_sequence_number = serial_buffer[header_size]; 
             uint8_t received_checksum = serial_buffer[buffer_size - 1];
             
@@ -382,14 +502,14 @@ void loop() {
 
                     update_stepper_angles(stepper, pitch_angle, yawStepper, yaw_angle);
 
-                    Serial.print("Pitch: ");
-                    Serial.println(pitch_angle);
-                    Serial.print("Yaw: ");
-                    Serial.println(yaw_angle);
-                    Serial.print("Throttle: ");
-                    Serial.println(throttle_value);
-                    Serial.print("Steering: ");
-                    Serial.println(steering_value);
+                    DEBUG_PRINT("Pitch: ");
+                    DEBUG_PRINTLN(pitch_angle);
+                    DEBUG_PRINT("Yaw: ");
+                    DEBUG_PRINTLN(yaw_angle);
+                    DEBUG_PRINT("Throttle: ");
+                    DEBUG_PRINTLN(throttle_value);
+                    DEBUG_PRINT("Steering: ");
+                    DEBUG_PRINTLN(steering_value);
                     
                     // Adjust steering angle based on speed
                     steering_value = get_speed_limited_steering_angle(steering_value, hallSensor.getSpeed());
@@ -415,16 +535,21 @@ void loop() {
                     // pin 10 (throttle)
                     TCA0.SINGLE.CMP1 = mapThrottle(throttle_val);
                 } else {
-                    Serial.println("Sequence number mismatch");
+                    DEBUG_PRINTLN("Sequence number mismatch");
                     expected_sequence_number = (receieved_sequence_number + 1) % 256;
                 }
             } else {
-                Serial.println("Checksum mismatch");
+                DEBUG_PRINTLN("Checksum mismatch");
             }
             serial_buffer_index = 0;
         }
     }
 
+    if (baud_commit_pending && millis() - baud_switch_time > BAUD_COMMIT_TIMEOUT_MS) {
+        baud_commit_pending = false;
+        switch_baud_rate(DEFAULT_BAUD_RATE);
+    }
+
     if (millis() - last_control_update > 400) {
         // pin 9 (steering)
         TCA0.SINGLE.CMP0 = mapSteering(0.5);